@@ -1,14 +1,25 @@
-from flask import Flask, render_template, request
-from myEphem import Ephem
+from flask import Flask, render_template, request, Response, send_file, abort
 # from myContec import Contec
-from myDatabase import DB
+from myDatabase import get_db, COMPRESS_DEFAULTS
+from myBattery import Battery, BATTERY_DEFAULTS
+from myState import LightCounter, Cadence, Lazy
+from myStats import StreamStats
+from myHardware import Device, HardwareError
+from mySharedState import HardwareClient
+import myMetrics
+from myProfile import Profiler, SORT_KEYS
+from myResponse import json_response, columns, VersionCache
 import json
 import random
 from time import sleep
 import datetime
 import configparser
 import os
+import math
+import atexit
+import tempfile
 import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
 
 """
 import RPi.GPIO as GPIO
@@ -25,10 +36,18 @@ pilot_status = False
 humi_sensor = dht11.DHT11(pin=humi_pin)
 """
 
-# グローバル変数
-light_sum = 0               # 光センサーオフの累計
-sensing_count = 1           # 光センサー計測リセット回数
-light_cnt = 0               # 光センサー計測回数　sensing_countの回数でリセット
+# 光センサーの積算状態　複数スレッドから使うのでロック付きのクラスにまとめる
+light_counter = LightCounter(sensing_count=1)
+
+# センサーを読む間隔　値が変わっているときやしきい値に近いときは短く、落ち着いているときは長くする
+# 範囲（秒）は設定のcontec_min・contec_max・humi_min・humi_maxで変えられる
+CADENCE_DEFAULTS = {"contec_min": 1, "contec_max": 60, "humi_min": 600, "humi_max": 3600}
+light_cadence = Cadence(1, 60, tolerance=0, threshold=2.5, margin=1)   # 5個のうち曇りの数　しきい値は5×0.5
+humi_cadence = Cadence(600, 3600, tolerance=0.5)                        # 温度が0.5℃より変われば短くする
+
+# センサーごとの平均・分散・移動平均・窓ごとの最小最大　読み取りのたびに更新する
+sensor_stats = StreamStats()
+BATTERY_LEVELS = {"黄": 0, "緑": 1, "青": 2}                            # バッテリーの色を統計用の数値にする
 
 
 # 日時を文字列として返す
@@ -37,12 +56,31 @@ def getTime():
     return dt.strftime("%Y/%m/%d %H:%M:%S")
 
 
+# 今日の日付　日付が変われば暦やデイリーログの中身も変わる
+def getDate():
+    return datetime.date.today().strftime("%Y/%m/%d")
+
+
 """
 contec = Contec()                   # コンテックのクラス
 """
-db = DB()                           # データベースのクラス
+contec_device = Device("contec", timeout=2.0)      # コンテックの呼び出しは専用スレッドで行う
+humi_device = Device("dht11", timeout=3.0)          # 温湿度計の呼び出しも同様
+hardware = HardwareClient()         # ハードウェアデーモン（hwdaemon.py）が動いていれば、デバイスはそちらに任せる
+db = Lazy(get_db)                   # データベースのクラス　最初に使うときに作る
+battery = Battery(db)               # バッテリーの時系列のクラス
+adc_sampler = None                  # バッテリー電圧を読むMCP3004の巡回読み取り（serve.pyの--adcで有効にする）
+adc_channel = 0                     # バッテリー電圧をつないだチャンネル
+adc_scale = 1.0                     # 分圧の比　バッテリー電圧 = ADCの電圧 × adc_scale
+ADC_MAX_AGE = 5.0                   # これより古いADCの値は使わない（秒）
+
+bootstrap_executor = ThreadPoolExecutor(max_workers=4)    # /bootstrapで暦・ログ・センサーを同時に取得する
+response_cache = VersionCache()     # 読み取りが多い応答をテーブルの書き込み世代ごとに覚えておく
 
 app = Flask(__name__)
+myMetrics.init_app(app)             # 全ルートの所要時間を記録する
+profiler = Profiler(mode=lambda: db.profile_mode)      # 設定のisProfileで、全リクエストかヘッダーで指定されたものをプロファイルする
+profiler.init_app(app)
 
 @app.route("/")
 def index():
@@ -56,7 +94,7 @@ def writeDB():
         if table == "LED":
             print("LEDテーブルに追記するぞ")
             db.set_LED(values)
-        return json.dumps({"result": "OK"})
+        return json_response({"result": "OK"})
 
 
 
@@ -67,26 +105,43 @@ def writeLog():
         text = request.form["text"]
         filename = request.form["filename"]
         print(text, filename)
-        return json.dumps({"result": "OK"})
+        return json_response({"result": "OK"})
+
 
+# デイリーログ　過去5日分のHTMLを作る
+def read_dailylog():
+    sunlight_from = db.sunlight_from
+    temperature_from = db.temperature_from
+    dict = db.get_summary(sunlight_from, temperature_from, days=5)
+    html = f"<b>日々の実績　および　{sunlight_from} からの累計</b>"\
+            "<table><tr><td class='center'>日付</td><td class='right'>実績</td><td class='right'>累計</td></tr>"
+    for key, item in dict.items():
+        html += f"<tr><td>{key}</td><td class='right w1'>{item['lighting_minutes']}分</td><td class='right w1'>{item['lighting_minutes_sum']}分</td></td>"
+    html += "</table>"
+    return {"html": html}
 
 # デイリーログ　過去5日分を表示
 @app.route("/showDailyLog", methods=["POST"])
 def showDailyLog():
     if request.method == "POST":
-        sunlight_from = db.sunlight_from
-        temperature_from = db.temperature_from
-        dict = db.get_summary(sunlight_from, temperature_from, days=5)
-        html = f"<b>日々の実績　および　{sunlight_from} からの累計</b>"\
-                "<table><tr><td class='center'>日付</td><td class='right'>実績</td><td class='right'>累計</td></tr>"
-        for key, item in dict.items():
-            html += f"<tr><td>{key}</td><td class='right w1'>{item['lighting_minutes']}分</td><td class='right w1'>{item['lighting_minutes_sum']}分</td></td>"
-        html += "</table>"
-        return json.dumps({"html": html})
+        version = (getDate(),) + db.generation("summary", "config")
+        return response_cache.respond("showDailyLog", version, read_dailylog)
 
-# 暦
-@app.route("/getEphem", methods = ["POST"])
-def getEphem():
+# サマリー　日付ごとの実績と累計を列ごとの配列で返す
+@app.route("/getSummary", methods=["POST"])
+def getSummary():
+    if request.method == "POST":
+        days = int(request.form.get("days", 7))
+        date = request.form.get("date")
+        version = (getDate(), date, days) + db.generation("summary", "config")
+        def build():
+            df = db.get_summary_table(db.sunlight_from, db.temperature_from, date, days)
+            return columns(df, index="date")
+        return response_cache.respond("getSummary", version, build)
+
+# 暦を計算する
+def read_ephem():
+    from myEphem import Ephem                       # numpy・cv2・ephemは重いので、初めて暦を計算するときに読み込む
     try:
         ephem = Ephem(db.ephem_config)              # 設定をもとにephemを作成する
         dict = ephem.get_data()                     # データを辞書として取得する
@@ -94,34 +149,61 @@ def getEphem():
     except Exception as e:
         message = str(e)
         dict = {"error": message}                   # エラーメッセージ
-    return json.dumps(dict)                         # 辞書をJSONにして返す
+    return dict
 
+# 暦
+@app.route("/getEphem", methods = ["POST"])
+def getEphem():
+    version = (getDate(),) + db.generation("config")  # 暦は日付と場所だけで決まる
+    return response_cache.respond("getEphem", version, read_ephem)
+
+
+# 温湿度を取得する
+def read_humi(is_try):
+    state = None if is_try else hardware.state()
+    read_time = None                                # 読み取った時刻（デーモンの値は、デーモンが読んだ時刻）
+    if is_try:                                      # トライならば
+        temp = random.randint(30, 60)
+        humi = random.randint(60, 90)
+        db.set_temperature(temp, humi)
+    elif state is not None:                         # デーモンが公開している最新の値を使う
+        if state["humi_ok"] and hardware.is_fresh(state, "humi_time"):
+            temp = state["temp"]
+            humi = state["humi"]
+            read_time = state["humi_time"]
+        else:
+            myMetrics.sensor_failures.inc("dht11_invalid")
+            temp = 0
+            humi = 0
+    else:                                           # 本番ならば
+        print("本番")
+        for i in range(10):                         # センサー値取得失敗するかもしれないので10回ループする
+            try:
+                result = humi_device.call(humi_sensor.read)
+            except HardwareError as e:              # 固まった・遮断中ならばあきらめる
+                print(e)
+                temp = 0
+                humi = 0
+                break
+            if result.is_valid():
+                temp = round(result.temperature, 1) # 温度 小数第一位まで
+                humi = round(result.humidity, 1)    # 湿度 小数第一位まで
+                break
+            else:
+                myMetrics.sensor_failures.inc("dht11_invalid")
+                temp = 0
+                humi = 0
+    if humi != 0:                                   # 読めなかったとき（0）は統計に入れない
+        sensor_stats.add_many({"temperature": temp, "humidity": humi}, read_time)   # 同じ読み取りは一度だけ数える
+    return {"temp": temp,
+            "humi": humi}
 
 # 温湿度計
 @app.route("/getHumi", methods=["POST"])
 def getHumi():
     if request.method == "POST":
         is_try = request.form["isTry"]
-        if is_try=="true":                          # トライならば
-            temp = random.randint(30, 60)
-            humi = random.randint(60, 90)
-            db.set_temperature(temp, humi)
-            dict = {"temp": temp,
-                    "humi": humi}
-        else:                                       # 本番ならば
-            print("本番")
-            for i in range(10):                     # センサー値取得失敗するかもしれないので10回ループする
-                result = humi_sensor.read()
-                if result.is_valid():
-                    temp = round(result.temperature, 1) # 温度 小数第一位まで
-                    humi = round(result.humidity, 1)    # 湿度 小数第一位まで
-                    break
-                else:
-                    temp = 0
-                    humi = 0
-            dict = {"temp": temp,
-                    "humi": humi}
-        return json.dumps(dict)
+        return json_response(read_humi(is_try=="true"))
 
 
 # 育成LED（コンテック）への出力
@@ -130,32 +212,50 @@ def enpowerLED():
     if request.method == "POST":
         is_On = int(request.form["isOn"])
         is_try = request.form["isTry"]
-        if is_On:
+        if is_try != "true" and hardware.available():   # デーモンが動いていれば命令を送る
+            try:
+                hardware.command("led", on=bool(is_On))
+            except HardwareError as e:
+                return json_response({"response": "error", "error": str(e)})
+        elif is_On:
             # print("育成LEDオン")
             if is_try != "true":            # 本番ならば
-                contec.output(True)
+                try:
+                    contec_device.call(contec.output, True)
+                except HardwareError as e:
+                    return json_response({"response": "error", "error": str(e)})
             pass
         else:
             # print("育成LEDオフ")
             if is_try != "true":            # 本番ならば
-                contec.output(False)
+                try:
+                    contec_device.call(contec.output, False)
+                except HardwareError as e:
+                    return json_response({"response": "error", "error": str(e)})
             pass
-        return json.dumps({"response": "done"})
-
+        return json_response({"response": "done"})
+
+
+# 設定を読み込み、サーバー側の状態に反映する
+def read_config():
+    dict = db.get_config()                                  # データベースから設定を読み込む
+    # コンテックの設定はリストにして登録する
+    arr = []
+    for i in [1, 2, 3, 4]:
+        arr.append(int(dict[f"output{i}"]))
+#    contec.define_output_relays(arr)
+    light_counter.set_sensing_count(dict["sensing_count"])
+    bounds = {key: float(dict.get(key, value)) for key, value in CADENCE_DEFAULTS.items()}
+    light_cadence.set_bounds(bounds["contec_min"], bounds["contec_max"])
+    humi_cadence.set_bounds(bounds["humi_min"], bounds["humi_max"])
+    battery.set_config(dict)
+    return dict
 
 # 設定DB 読み込み
 @app.route("/getConfig", methods=["POST"])
 def getConfig():
-    global sensing_count
     if request.method == "POST":
-        dict = db.get_config()                              # データベースから設定を読み込む
-        # コンテックの設定はリストにして登録する
-        arr = []
-        for i in [1, 2, 3, 4]:
-            arr.append(int(dict[f"output{i}"]))
-#        contec.define_output_relays(arr)
-        sensing_count = int(dict["sensing_count"])
-        return json.dumps(dict)
+        return response_cache.respond("getConfig", db.generation("config"), read_config)
 
 # 設定DB 書き込み
 @app.route("/setConfig", methods=["POST"])
@@ -185,6 +285,11 @@ def setConfig():
                 "isLEDTry": request.form["isLEDTry"],
                 "isNightSense": request.form["isNightSense"],
                 }
+        config = db.get_config()
+        for key, value in {**CADENCE_DEFAULTS, **COMPRESS_DEFAULTS, **BATTERY_DEFAULTS}.items():     # 画面にない設定は引き継ぐ
+            dict[key] = request.form.get(key, config.get(key, str(value)))
+        for key, value in config.items():                  # サーバーが覚えた値（yellow_volt）なども消さない
+            dict.setdefault(key, value)
         db.set_config(dict)
         
         # コンテックリレー出力設定を変更する
@@ -196,7 +301,7 @@ def setConfig():
         contec.define_output_relays(arr)
         """
         
-        return json.dumps({"response": "done"})
+        return json_response({"response": "done"})
 
 # DB削除
 @app.route("/delDB", methods=["POST"])
@@ -204,56 +309,270 @@ def delDB():
     if request.method == "POST":
         del_date = request.form["date"]
         db.delete(del_date)
-    return json.dumps({"result":"OK"})
-
+    return json_response({"result":"OK"})
+
+
+# 過去のデータ（CSV・日当たりログ.txt）を取り込む　サーバーのDBに書くので、--memory-dbでもキャッシュが古くならない
+@app.route("/importData", methods=["POST"])
+def importData():
+    from myImport import import_files, ImportDataError, TABLES
+    table = request.form.get("table") or None
+    if table is not None and table not in list(TABLES) + ["summary"]:
+        abort(400)
+    uploads = request.files.getlist("files")
+    if not uploads:
+        abort(400)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        names = {}                                  # 保存したパス -> 送られたファイル名
+        for upload in uploads:
+            name = os.path.basename(upload.filename or "")
+            if os.path.splitext(name)[1].lower() not in (".csv", ".txt"):
+                abort(400)
+            path = os.path.join(directory, f"{len(paths)}-{name}")     # 同じ名前のファイルが来ても上書きしない
+            upload.save(path)
+            paths.append(path)
+            names[path] = name
+
+        def rename(message):
+            for path, name in names.items():
+                message = message.replace(path, name)
+            return message
+        try:
+            result = import_files(db, paths, table)
+        except ImportDataError as e:
+            return json_response({"response": "error", "error": rename(str(e))})
+    result["files"] = {names[path]: r for path, r in result["files"].items()}
+    result["errors"] = [rename(error) for error in result["errors"]]
+    return json_response(result)
+
+
+# バッテリー電圧の巡回読み取りを始める
+def start_adc(channel=0, scale=1.0, interval=0.5):
+    global adc_sampler, adc_channel, adc_scale
+    from mcp3004 import Sampler                     # gpiozeroはラズパイにしかないので、使うときだけ読み込む
+    adc_channel = channel
+    adc_scale = scale
+    adc_sampler = Sampler(channels=(channel,), interval=interval).start()
+    atexit.register(adc_sampler.stop)
+    return adc_sampler
+
+
+# 最新のバッテリー電圧　ADCを使っていない・値が古いときはNone
+def read_battery_volt():
+    if adc_sampler is None:
+        return None
+    volt = adc_sampler.latest(adc_channel, max_age=ADC_MAX_AGE)
+    return None if volt is None else volt * adc_scale
+
+
+# コンテック（光センサー＋バッテリー）を読み取り、光センサーを積算する
+def read_contec(is_try, is_light_cnt):
+    inputs = []                                         # コンテックの戻り値の初期値
+    state = None if is_try else hardware.state()
+    read_time = None                                    # 読み取った時刻（デーモンの値は、デーモンが読んだ時刻）
+    if is_try:                                          # トライならば
+        for _ in range(8):
+            inputs.append(random.choice([1, 0]))
+    elif state is not None:                             # デーモンが公開している最新の値を使う
+        if not state["contec_ok"] or not hardware.is_fresh(state, "contec_time"):
+            return {"error": "コンテックの読み取り失敗"}
+        inputs = state["inputs"]
+        read_time = state["contec_time"]
+    else:                                               # 本番ならば
+        try:
+            inputs = contec_device.call(contec.input)
+        except HardwareError as e:                      # 固まった・遮断中ならば今回は値なし
+            return {"error": str(e)}
+        print("コンテック　本番", inputs)
+        if len(inputs) != 8:                            # 読み取りに失敗したとき
+            return {"error": "コンテックの読み取り失敗"}
+
+    # コンテックの結果を光センサーの結果と電圧リレーの結果に分ける
+    lights = inputs[:5]
+    volts = inputs[5:]
+
+    log = ""
+    for input in inputs:
+        log += "○" if input==1 else "−"
+
+    # 光センサーの積算　積算する設定ならば回数を進めて光の合計を加算する
+    light_sum, light_cnt = light_counter.add(lights, is_light_cnt)
+    dict = {}
+    dict["light_sum"] = light_sum
+    dict["log"] = log
+    dict["light_cnt"] = light_cnt
+    dict["cloudy"] = sum(lights)                        # 今回の曇りの数（読む間隔を決めるのに使う）
+
+    # 電圧リレーの計算
+    relay1, relay2, _ = volts           # リレー1=緑信号（低圧）　リレー2=青信号（高圧）　
+    dict["volt"] = battery.add(relay1, relay2, read_battery_volt())     # 青・緑・黄　変化があれば時系列に記録する
+
+    values = {f"light{i + 1}": light for i, light in enumerate(lights)}
+    values["battery"] = BATTERY_LEVELS[dict["volt"]]
+    sensor_stats.add_many(values, read_time)            # デーモンの同じ読み取りを問い合わせのたびに数えない
+    return dict
 
 # コンテック（光センサー＋バッテリー）
 @app.route("/getContec", methods=["POST"])
 def getContec():
-    global light_cnt, light_sum, light_log, sensing_count
     if request.method == "POST":
         is_try = request.form["isTry"]
         is_light_cnt = request.form["isLightCnt"]
-        if is_light_cnt == "true":
-            light_cnt = (light_cnt+1) % sensing_count
-            if light_cnt == 0:
-                light_log = ""
-                light_sum = 0
-        inputs = []                                         # コンテックの戻り値の初期値
-        if is_try=="true":                                  # トライならば
-            for _ in range(8):
-                inputs.append(random.choice([1, 0]))
-        else:                                               # 本番ならば
-            inputs = contec.input()
-            print("コンテック　本番", inputs)
-            pass
+        return json_response(read_contec(is_try=="true", is_light_cnt=="true"))
+
 
-        # コンテックの結果を光センサーの結果と電圧リレーの結果に分ける
-        lights = inputs[:5]
-        volts = inputs[5:]
+# 画面の初期表示に必要なものをまとめて返す
+# 設定を読んでから、コンテックを読み始めるのと同時に暦を計算する
+# 暦は今日のサマリーの行を作る（set_ephem）ので、それを使うデイリーログと温湿度は暦の後に同時に取得する
+@app.route("/bootstrap", methods=["POST"])
+def bootstrap():
+    if request.method == "POST":
+        config = read_config()
+        is_humi_try = config["isHumiTry"] == "1"
+        is_contec_try = config["isContecTry"] == "1"
+        futures = {"contec": profiler.submit(bootstrap_executor, read_contec, is_contec_try, False)}
+        dict = {"config": config}
+        try:
+            dict["ephem"] = read_ephem()
+        except Exception as e:
+            dict["ephem"] = {"error": str(e)}
+        futures["dailylog"] = profiler.submit(bootstrap_executor, read_dailylog)
+        futures["humi"] = profiler.submit(bootstrap_executor, read_humi, is_humi_try)
+        for key, future in futures.items():
+            try:
+                dict[key] = future.result()
+            except Exception as e:                      # 1つ失敗しても他は返す
+                dict[key] = {"error": str(e)}
+        return json_response(dict)
+
+
+# 定期的な更新に必要なものをまとめて返す
+# 次にコンテックと温湿度を読むまでの秒数も返し、ブラウザはそれまで問い合わせない
+@app.route("/tick", methods=["POST"])
+def tick():
+    if request.method == "POST":
+        humi_future = None
+        if request.form.get("isHumi") == "true":       # 温湿度を更新する時刻ならば、コンテックと同時に取得する
+            humi_future = profiler.submit(bootstrap_executor, read_humi, request.form["isHumiTry"]=="true")
+        contec = read_contec(request.form["isContecTry"]=="true", request.form["isLightCnt"]=="true")
+        myMetrics.sensor_reads.inc("contec")
+        dict = {"contec": contec,
+                "next": {"contec": light_cadence.update(contec.get("cloudy"))}}
+        if humi_future is not None:
+            try:
+                dict["humi"] = humi_future.result()
+            except Exception as e:
+                dict["humi"] = {"error": str(e)}
+            myMetrics.sensor_reads.inc("dht11")
+            is_valid = "error" not in dict["humi"] and dict["humi"]["humi"] != 0   # 読めなかったときは0
+            dict["next"]["humi"] = humi_cadence.update(dict["humi"]["temp"] if is_valid else None)
+        return json_response(dict)
+
+
+# センサーごとの統計（sensorを省略すると全センサー）
+@app.route("/getStats", methods=["GET", "POST"])
+def getStats():
+    return json_response(sensor_stats.get(request.values.get("sensor")))
+
+
+# センサーを読む間隔の状態
+@app.route("/getCadence", methods=["POST"])
+def getCadence():
+    if request.method == "POST":
+        return json_response({"contec": light_cadence.get_status(), "humi": humi_cadence.get_status()})
 
-        log = ""
-        for input in inputs:
-            log += "○" if input==1 else "−"
 
-        # 光センサーの積算
-        if is_light_cnt == "true":          # 光センサーの状態を積算する設定ならば
-            light_sum += sum(lights)        # 光の合計を加算する
-        dict = {}
-        dict["light_sum"] = light_sum
-        dict["log"] = log
-        dict["light_cnt"] = light_cnt
+# ハードウェア呼び出しの状態（所要時間・失敗回数・遮断中かどうか）
+@app.route("/getDevices", methods=["POST"])
+def getDevices():
+    if request.method == "POST":
+        return json_response([contec_device.get_status(), humi_device.get_status()])
 
-        # 電圧リレーの計算
-        relay1, relay2, _ = volts           # リレー1=緑信号（低圧）　リレー2=青信号（高圧）　
-        if relay2:                          # リレー2がオンならば
-            dict["volt"] = "青"             # 「青」
-        elif relay1:                        # リレー2がオフでリレー1がオンならば
-            dict["volt"] = "緑"             # 「緑」
-        else:                               # いずれでもなければ
-            dict["volt"] = "黄"             # 「黄」
 
-        return json.dumps(dict)
+# バッテリーの状態と傾向
+@app.route("/getBattery", methods=["POST"])
+def getBattery():
+    if request.method == "POST":
+        return json_response(battery.get_status())
+
+
+# グラフ用の履歴　期間の時系列を点数を指定して間引いて返す
+@app.route("/history", methods=["GET", "POST"])
+def history():
+    import myHistory                                # numpyは重いので、初めて履歴を取得するときに読み込む
+    table = request.values.get("table", "temperature")
+    if table not in myHistory.SERIES:
+        abort(400)
+    columns = request.values.get("columns")
+    columns = columns.split(",") if columns else myHistory.SERIES[table]
+    if not set(columns) <= set(myHistory.SERIES[table]):
+        abort(400)
+    method = request.values.get("method", "lttb")
+    if method not in myHistory.METHODS:
+        abort(400)
+    try:
+        points = int(request.values.get("points", myHistory.DEFAULT_POINTS))
+        step = float(request.values.get("step") or 0)
+    except ValueError:
+        abort(400)
+    if not 2 <= points <= myHistory.MAX_POINTS or not math.isfinite(step) or step < 0:   # nan・infも受け付けない
+        abort(400)
+    interp = request.values.get("interp", "linear")
+    if interp not in myHistory.INTERPOLATIONS:
+        abort(400)
+    now = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+    datetime_from = request.values.get("from") or \
+        (datetime.datetime.now() - datetime.timedelta(days=7)).strftime("%Y/%m/%d %H:%M")
+    datetime_to = request.values.get("to") or now
+    if len(datetime_to) == 10:                      # 日付だけならばその日の終わりまで
+        datetime_to += " 23:59:59"
+
+    if datetime_to < now:                           # 終わった期間だけキャッシュする
+        df = db.get_history(table, datetime_from, datetime_to)
+    else:                                           # 今までの期間は、毎回違う終点でキャッシュを埋めてしまう
+        df = db.read_history(table, datetime_from, datetime_to)
+    if step:                                        # 間引いて保存した温湿度を、step秒ごとの等間隔に戻す
+        start, t, values = myHistory.resample(df, columns, step, interp)
+    else:
+        start, t, values = myHistory.downsample(df, columns, points, method)
+    start = start.strftime("%Y/%m/%d %H:%M:%S") if start is not None else None
+    if request.values.get("format") == "f32":       # float32を詰めたバイナリ　列の順はX-History-Columns
+        headers = {"X-History-Start": start or "",
+                   "X-History-Columns": ",".join(columns),
+                   "X-History-Count": str(len(t)),
+                   }
+        return Response(myHistory.pack(t, values, columns), mimetype="application/octet-stream", headers=headers)
+    dict = {"start": start, "t": t}
+    dict.update(values)
+    return json_response(dict)
+
+
+# 所要時間・失敗回数などのメトリクス（Prometheusのテキスト形式）
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(myMetrics.expose(), mimetype="text/plain; version=0.0.4")
+
+
+# 保存してあるプロファイルの一覧
+@app.route("/profiles", methods=["GET"])
+def profiles():
+    if not profiler.is_enabled():
+        abort(404)
+    return json_response(profiler.list())
+
+# プロファイルの内容　?raw=1 ならばpstatsのファイルそのもの
+@app.route("/profiles/<name>", methods=["GET"])
+def profile(name):
+    path = profiler.path(name) if profiler.is_enabled() else None
+    if path is None:
+        abort(404)
+    if request.args.get("raw") == "1":
+        return send_file(os.path.abspath(path), as_attachment=True, download_name=name)
+    sort = request.args.get("sort", "cumulative")
+    if sort not in SORT_KEYS:
+        abort(400)
+    return Response(profiler.report(name, sort=sort), mimetype="text/plain")
 
 
 # OSの時刻を設定する
@@ -263,7 +582,7 @@ def setClock():
         set_time = request.form["set_time"] # 設定する日時
         cmd = f"sudo date {set_time}"       # linuxのコマンド
         sp.Popen(cmd.split())               # 空白で区切ってリストにし、実行する
-        return json.dumps({"response": "done"})
+        return json_response({"response": "done"})
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -1,4 +1,6 @@
 import time
+from array import array
+import numpy as np
 import RPi
 
 
@@ -27,8 +29,34 @@ class DHT11:
 
     __pin = 0
 
-    def __init__(self, pin):
+    # enough samples for the whole 40 bit transmission even on a fast Pi
+    MAX_SAMPLES = 10000
+
+    # capacity of the edge timestamp buffer (the transmission has 83 edges)
+    MAX_EDGES = 200
+
+    # how long the edge capture waits for the transmission (it takes about 5 ms)
+    EDGE_CAPTURE_TIME = 0.01
+
+    # a data pull up longer than this is a 1 bit (0: 26-28 us, 1: 70 us);
+    # only used when the widths are too close together to split them into two groups
+    EDGE_BIT_THRESHOLD = 0.00005
+
+    # the widths of 0 and 1 bits are at least this far apart even with callback jitter
+    EDGE_MIN_SPREAD = 0.00002
+
+    # widths within this fraction of the group distance from the threshold are not trusted
+    EDGE_AMBIGUOUS = 0.05
+
+    def __init__(self, pin, use_edges=False, clock=time.perf_counter):
         self.__pin = pin
+        self.__buffer = array('B', bytes(DHT11.MAX_SAMPLES))
+
+        # edge mode records edge timestamps from GPIO callbacks instead of busy polling
+        self.__use_edges = use_edges
+        self.__clock = clock
+        self.__edges = array('d', bytes(8 * DHT11.MAX_EDGES))
+        self.__edge_count = 0
 
     def read(self):
         RPi.GPIO.setup(self.__pin, RPi.GPIO.OUT)
@@ -42,18 +70,25 @@ class DHT11:
         # change to input using pull up
         RPi.GPIO.setup(self.__pin, RPi.GPIO.IN, RPi.GPIO.PUD_UP)
 
-        # collect data into an array
-        data = self.__collect_input()
+        if self.__use_edges:
+            # collect edge timestamps and take the bits from the pulse widths
+            edges = self.__collect_edges()
+            bits = self.__edges_to_bits(edges)
+            if bits is None:
+                return DHT11Result(DHT11Result.ERR_MISSING_DATA, 0, 0)
+        else:
+            # collect data into an array
+            data = self.__collect_input()
 
-        # parse lengths of all data pull up periods
-        pull_up_lengths = self.__parse_data_pull_up_lengths(data)
+            # parse lengths of all data pull up periods
+            pull_up_lengths = self.__parse_data_pull_up_lengths(data)
 
-        # if bit count mismatch, return error (4 byte data + 1 byte checksum)
-        if len(pull_up_lengths) != 40:
-            return DHT11Result(DHT11Result.ERR_MISSING_DATA, 0, 0)
+            # if bit count mismatch, return error (4 byte data + 1 byte checksum)
+            if len(pull_up_lengths) != 40:
+                return DHT11Result(DHT11Result.ERR_MISSING_DATA, 0, 0)
 
-        # calculate bits from lengths of the pull up periods
-        bits = self.__calculate_bits(pull_up_lengths)
+            # calculate bits from lengths of the pull up periods
+            bits = self.__calculate_bits(pull_up_lengths)
 
         # we have the bits, calculate bytes
         the_bytes = self.__bits_to_bytes(bits)
@@ -87,11 +122,19 @@ class DHT11:
         # this is used to determine where is the end of the data
         max_unchanged_count = 100
 
+        # the samples are written into a preallocated buffer, so the loop does
+        # not pay for list growth between two GPIO reads
+        data = self.__buffer
+        size = len(data)
+        gpio_input = RPi.GPIO.input
+        pin = self.__pin
+
         last = -1
-        data = []
-        while True:
-            current = RPi.GPIO.input(self.__pin)
-            data.append(current)
+        i = 0
+        while i < size:
+            current = gpio_input(pin)
+            data[i] = current
+            i += 1
             if last != current:
                 unchanged_count = 0
                 last = current
@@ -100,104 +143,104 @@ class DHT11:
                 if unchanged_count > max_unchanged_count:
                     break
 
-        return data
+        return memoryview(data)[:i]
+
+    def __on_edge(self, channel):
+        # called from the GPIO event thread, only store the timestamp
+        if self.__edge_count < DHT11.MAX_EDGES:
+            self.__edges[self.__edge_count] = self.__clock()
+            self.__edge_count += 1
+
+    def __collect_edges(self):
+        self.__edge_count = 0
+        RPi.GPIO.add_event_detect(self.__pin, RPi.GPIO.BOTH, callback=self.__on_edge)
+        try:
+            # sleep instead of spinning, the callbacks do the work
+            time.sleep(DHT11.EDGE_CAPTURE_TIME)
+        finally:
+            RPi.GPIO.remove_event_detect(self.__pin)
+
+        return np.frombuffer(self.__edges, dtype=np.float64, count=self.__edge_count)
+
+    def __edges_to_bits(self, edges):
+        # the transmission ends with the sensor releasing the line (a rising edge),
+        # so counting back from the end the edges alternate falling, rising, ...
+        # and the 40 data pull ups are the last 40 rising-to-falling intervals
+        if edges.size < 81:
+            return None
+        widths = np.diff(edges[edges.size - 81:])
+        pull_up_widths = widths[0:80:2].copy()
+
+        # every data pull down lasts 50 us, so its deviation from the typical one tells which
+        # edge was timestamped late: a long pull down means its rising edge was late and the
+        # next pull up looks short by as much, a short one means its falling edge was late and
+        # the previous pull up looks long; move the late edge back before classifying
+        pull_down_widths = widths[1:80:2]
+        typical = np.median(pull_down_widths)
+        if edges.size >= 82:                                # the pull down before the first bit
+            pull_up_widths[0] += max(edges[edges.size - 81] - edges[edges.size - 82] - typical, 0)
+        deviations = pull_down_widths - typical
+        pull_up_widths += np.minimum(deviations, 0)
+        pull_up_widths[1:] += np.maximum(deviations[:-1], 0)
+
+        # the callback latency shifts every timestamp, so a fixed threshold breaks when the
+        # jitter between two edges is large; split the widths into a short and a long group
+        # instead (two-means), starting from the halfway like the sampled decoder does
+        shortest = pull_up_widths.min()
+        longest = pull_up_widths.max()
+        if longest - shortest < DHT11.EDGE_MIN_SPREAD:
+            return pull_up_widths > DHT11.EDGE_BIT_THRESHOLD
+        threshold = shortest + (longest - shortest) / 2
+        for _ in range(10):
+            ones = pull_up_widths > threshold
+            short_mean = pull_up_widths[~ones].mean()
+            long_mean = pull_up_widths[ones].mean()
+            updated = (short_mean + long_mean) / 2
+            if updated == threshold:
+                break
+            threshold = updated
+
+        # a width still close to the threshold had two late edges in a row and may be either bit;
+        # reporting missing data makes the caller read again instead of trusting the checksum
+        margin = (long_mean - short_mean) * DHT11.EDGE_AMBIGUOUS
+        if np.any(np.abs(pull_up_widths - threshold) < margin):
+            return None
+
+        return pull_up_widths > threshold
 
     def __parse_data_pull_up_lengths(self, data):
-        STATE_INIT_PULL_DOWN = 1
-        STATE_INIT_PULL_UP = 2
-        STATE_DATA_FIRST_PULL_DOWN = 3
-        STATE_DATA_PULL_UP = 4
-        STATE_DATA_PULL_DOWN = 5
-
-        state = STATE_INIT_PULL_DOWN
-
-        lengths = [] # will contain the lengths of data pull up periods
-        current_length = 0 # will contain the length of the previous period
-
-        for i in range(len(data)):
-
-            current = data[i]
-            current_length += 1
-
-            if state == STATE_INIT_PULL_DOWN:
-                if current == RPi.GPIO.LOW:
-                    # ok, we got the initial pull down
-                    state = STATE_INIT_PULL_UP
-                    continue
-                else:
-                    continue
-            if state == STATE_INIT_PULL_UP:
-                if current == RPi.GPIO.HIGH:
-                    # ok, we got the initial pull up
-                    state = STATE_DATA_FIRST_PULL_DOWN
-                    continue
-                else:
-                    continue
-            if state == STATE_DATA_FIRST_PULL_DOWN:
-                if current == RPi.GPIO.LOW:
-                    # we have the initial pull down, the next will be the data pull up
-                    state = STATE_DATA_PULL_UP
-                    continue
-                else:
-                    continue
-            if state == STATE_DATA_PULL_UP:
-                if current == RPi.GPIO.HIGH:
-                    # data pulled up, the length of this pull up will determine whether it is 0 or 1
-                    current_length = 0
-                    state = STATE_DATA_PULL_DOWN
-                    continue
-                else:
-                    continue
-            if state == STATE_DATA_PULL_DOWN:
-                if current == RPi.GPIO.LOW:
-                    # pulled down, we store the length of the previous pull up period
-                    lengths.append(current_length)
-                    state = STATE_DATA_PULL_UP
-                    continue
-                else:
-                    continue
-
-        return lengths
+        samples = np.frombuffer(data, dtype=np.uint8)
+        if samples.size == 0:
+            return np.empty(0, dtype=np.intp)
+
+        # run-length encode the samples: start index, level and length of every run
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(samples)) + 1))
+        lengths = np.diff(np.append(starts, samples.size))
+        levels = samples[starts]
+
+        # the initial pull down is the first low run, it is followed by the
+        # initial pull up and the first data pull down
+        low_runs = np.flatnonzero(levels == RPi.GPIO.LOW)
+        if low_runs.size == 0:
+            return np.empty(0, dtype=np.intp)
+        first_data_pull_up = low_runs[0] + 3
+
+        # runs alternate, so every second run from there is a data pull up;
+        # the last run is dropped because it is not terminated by a pull down
+        return lengths[first_data_pull_up:lengths.size - 1:2]
 
     def __calculate_bits(self, pull_up_lengths):
         # find shortest and longest period
-        shortest_pull_up = 1000
-        longest_pull_up = 0
-
-        for i in range(0, len(pull_up_lengths)):
-            length = pull_up_lengths[i]
-            if length < shortest_pull_up:
-                shortest_pull_up = length
-            if length > longest_pull_up:
-                longest_pull_up = length
+        shortest_pull_up = pull_up_lengths.min()
+        longest_pull_up = pull_up_lengths.max()
 
         # use the halfway to determine whether the period it is long or short
         halfway = shortest_pull_up + (longest_pull_up - shortest_pull_up) / 2
-        bits = []
-
-        for i in range(0, len(pull_up_lengths)):
-            bit = False
-            if pull_up_lengths[i] > halfway:
-                bit = True
-            bits.append(bit)
 
-        return bits
+        return pull_up_lengths > halfway
 
     def __bits_to_bytes(self, bits):
-        the_bytes = []
-        byte = 0
-
-        for i in range(0, len(bits)):
-            byte = byte << 1
-            if (bits[i]):
-                byte = byte | 1
-            else:
-                byte = byte | 0
-            if ((i + 1) % 8 == 0):
-                the_bytes.append(byte)
-                byte = 0
-
-        return the_bytes
+        return np.packbits(bits).tolist()
 
     def __calculate_checksum(self, the_bytes):
         return the_bytes[0] + the_bytes[1] + the_bytes[2] + the_bytes[3] & 255
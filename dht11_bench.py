@@ -0,0 +1,253 @@
+# DHT11の波形デコードのベンチマークと回帰確認
+# 実機なしで動かすため、RPi.GPIOの代わりに記録した波形やエッジ時刻を再生する偽物を使う
+import sys
+import time
+import random
+import types
+
+
+class FakeGPIO:
+    """
+    RPi.GPIOの代用品
+    記録した波形（0/1のサンプル列）をinput()のたびに1サンプルずつ返す
+    エッジ検出が登録されたら、記録したエッジ時刻を順にコールバックへ再生する
+    """
+    LOW = 0
+    HIGH = 1
+    OUT = 0
+    IN = 1
+    PUD_UP = 22
+    BOTH = 33
+
+    def __init__(self):
+        self.samples = []
+        self.pos = 0
+        self.edges = []
+        self.now = 0.0
+
+    def load(self, samples):
+        self.samples = samples
+        self.pos = 0
+
+    def load_edges(self, edges):
+        self.edges = edges
+
+    def clock(self):
+        return self.now
+
+    def add_event_detect(self, pin, edge, callback=None):
+        for t in self.edges:                                    # エッジの時刻を進めながらコールバックを呼ぶ
+            self.now = t
+            callback(pin)
+
+    def remove_event_detect(self, pin):
+        pass
+
+    def setup(self, pin, mode, pull_up_down=None):
+        pass
+
+    def output(self, pin, value):
+        pass
+
+    def input(self, pin):
+        if self.pos < len(self.samples):
+            value = self.samples[self.pos]
+            self.pos += 1
+            return value
+        return 1                                                # 波形の終わり以降はプルアップでHIGH
+
+
+gpio = FakeGPIO()
+rpi = types.ModuleType("RPi")
+rpi.GPIO = gpio
+sys.modules["RPi"] = rpi
+sys.modules["RPi.GPIO"] = gpio
+
+import dht11                                                    # 偽物のGPIOを登録してから読み込む
+dht11.time.sleep = lambda sec: None                             # スタート信号の待ち時間は計測しない
+
+
+def make_pulses(humi, temp, jitter=0.0, seed=0):
+    """
+    DHT11の応答をパルスの並びとして作る
+    Args:
+        humi, temp : 湿度と温度（整数）
+        jitter     : パルス幅のゆらぎ（割合）　0ならきれいな波形
+    Returns:
+        pulses : (レベル, マイクロ秒)のリスト
+    """
+    rnd = random.Random(seed)
+    the_bytes = [humi, 0, temp, 0]
+    the_bytes.append(sum(the_bytes) & 255)
+    pulses = [(1, 30), (0, 80), (1, 80)]                        # 応答信号（プルアップ→プルダウン→プルアップ）
+    for byte in the_bytes:
+        for i in range(7, -1, -1):
+            pulses.append((0, 50))                              # ビットの前のプルダウン
+            pulses.append((1, 70 if byte >> i & 1 else 27))     # 長ければ1、短ければ0
+    pulses.append((0, 50))                                      # 最後のプルダウン
+    return [(level, us * (1 + rnd.uniform(-jitter, jitter))) for level, us in pulses]
+
+
+def make_wave(humi, temp, us_per_sample=5, jitter=0.0, seed=0):
+    """
+    DHT11の応答波形を作る
+    Args:
+        us_per_sample : 1サンプルあたりのマイクロ秒
+    Returns:
+        samples : 0/1のリスト
+    """
+    samples = []
+    for level, us in make_pulses(humi, temp, jitter, seed):
+        samples += [level] * max(1, round(us / us_per_sample))
+    return samples
+
+
+# RPi.GPIOのコールバックの遅れ（マイクロ秒）　割り込みスレッドがGILを取るまで待つので、
+# 数十マイクロ秒の遅れに、ときどき大きな揺れが乗る
+LATENCY_BASE = 60                                               # どのエッジにも乗る遅れ
+LATENCY_JITTER = 8                                              # 揺れの標準偏差
+LATENCY_SPIKE = 30                                              # たまに乗る大きな揺れの平均
+LATENCY_SPIKE_RATE = 0.02                                       # 大きな揺れが乗る割合
+MAX_REREAD_RATE = 0.05                                          # コールバックの遅れで読み直しになってよい割合
+
+
+def callback_latency(rnd):
+    """
+    コールバック1回分の遅れ（マイクロ秒）
+    """
+    latency = LATENCY_BASE + abs(rnd.gauss(0, LATENCY_JITTER))
+    if rnd.random() < LATENCY_SPIKE_RATE:
+        latency += rnd.expovariate(1 / LATENCY_SPIKE)
+    return latency
+
+
+def make_edges(humi, temp, jitter=0.0, latency=False, seed=0):
+    """
+    DHT11の応答のエッジ時刻（秒）を作る
+    Args:
+        latency : Trueならばコールバックの遅れ（callback_latency）を乗せる
+    Returns:
+        edges : 時刻のリスト　最初のプルアップの前の立ち下がりから最後の立ち上がりまで
+    """
+    rnd = random.Random(seed + 1000)
+    edges = []
+    t = 1.0
+    delay = (lambda: callback_latency(rnd) * 1e-6) if latency else (lambda: 0.0)
+    for _, us in make_pulses(humi, temp, jitter, seed)[1:]:     # 最初のプルアップはスタート信号の続きなのでエッジではない
+        edges.append(t + delay())
+        t += us * 1e-6
+    edges.append(t + delay())                                   # センサーが線を離したときの立ち上がり
+    return edges
+
+
+def legacy_pull_up_lengths(data):
+    """
+    以前のステートマシンによるデコード（比較用）
+    """
+    state = 1
+    lengths = []
+    current_length = 0
+    for current in data:
+        current_length += 1
+        if state == 1 and current == 0:
+            state = 2
+        elif state == 2 and current == 1:
+            state = 3
+        elif state == 3 and current == 0:
+            state = 4
+        elif state == 4 and current == 1:
+            current_length = 0
+            state = 5
+        elif state == 5 and current == 0:
+            lengths.append(current_length)
+            state = 4
+    return lengths
+
+
+def main():
+    sensor = dht11.DHT11(pin=14)
+    cases = []
+    for seed in range(50):
+        humi = random.Random(seed).randint(20, 95)
+        temp = random.Random(seed + 100).randint(0, 45)
+        cases.append(("clean", humi, temp, make_wave(humi, temp, seed=seed)))
+        cases.append(("noisy", humi, temp, make_wave(humi, temp, us_per_sample=3, jitter=0.15, seed=seed)))
+
+    # 回帰確認　デコード結果が元の値と一致し、以前の実装とも一致すること
+    failed = 0
+    for kind, humi, temp, wave in cases:
+        gpio.load(wave + [1] * 200)
+        result = sensor.read()
+        if not result.is_valid() or (result.humidity, result.temperature) != (humi, temp):
+            failed += 1
+            print(f"NG {kind}: expected {humi}/{temp}, got {result.error_code} {result.humidity}/{result.temperature}")
+        new = sensor._DHT11__parse_data_pull_up_lengths(bytes(wave)).tolist()
+        if new != legacy_pull_up_lengths(wave):
+            failed += 1
+            print(f"NG {kind}: pull up lengths differ from the legacy decoder")
+    print(f"回帰確認: {len(cases)}件中 {len(cases) - failed}件OK")
+    total_failed = failed
+
+    # 回帰確認　エッジ検出モード　コールバックの遅れがあってもデコードできること
+    # コールバックが遅れた読み取りは読めなくてもよい（呼び出し側が読み直す）が、違う値を返してはいけない
+    edge_sensor = dht11.DHT11(pin=14, use_edges=True, clock=gpio.clock)
+    failed = 0
+    rejected = 0
+    noisy_cases = 1000
+    for seed in range(noisy_cases):
+        humi = random.Random(seed).randint(20, 95)
+        temp = random.Random(seed + 100).randint(0, 45)
+        for kind, edges in [("clean", make_edges(humi, temp, seed=seed)),
+                            ("noisy", make_edges(humi, temp, jitter=0.05, latency=True, seed=seed)),
+                            ("late", make_edges(humi, temp, seed=seed)[3:])]:   # 応答信号の最初を取りこぼした場合
+            gpio.load_edges(edges)
+            result = edge_sensor.read()
+            if kind == "noisy" and not result.is_valid():
+                rejected += 1
+            elif not result.is_valid() or (result.humidity, result.temperature) != (humi, temp):
+                failed += 1
+                print(f"NG edge {kind}: expected {humi}/{temp}, got {result.error_code} {result.humidity}/{result.temperature}")
+    print(f"回帰確認（エッジ）: {noisy_cases * 3}件中 {noisy_cases * 3 - failed - rejected}件OK　"
+          f"コールバックの遅れで読み直し {rejected}件（{rejected / noisy_cases:.1%}）")
+    if rejected > noisy_cases * MAX_REREAD_RATE:                # 読み直しばかりでは負荷の高いときに使えない
+        failed += 1
+        print(f"NG edge noisy: 読み直しが{MAX_REREAD_RATE:.0%}を超えています")
+    total_failed += failed
+    if total_failed:                                            # 回帰があれば、ベンチマークを測らずに失敗で終わる
+        sys.exit(1)
+
+    # ベンチマーク　デコード部分の所要時間
+    loops = 20
+    waves = [bytes(wave) for _, _, _, wave in cases]
+    start = time.perf_counter()
+    for _ in range(loops):
+        for wave in waves:
+            legacy_pull_up_lengths(wave)
+    legacy = (time.perf_counter() - start) / (loops * len(waves))
+    start = time.perf_counter()
+    for _ in range(loops):
+        for wave in waves:
+            sensor._DHT11__parse_data_pull_up_lengths(wave)
+    vectorised = (time.perf_counter() - start) / (loops * len(waves))
+    print(f"デコード: 以前 {legacy*1e6:.0f}us, NumPy {vectorised*1e6:.0f}us")
+
+    # ベンチマーク　サンプリング1回あたりの所要時間
+    wave = cases[0][3] + [1] * 200
+    start = time.perf_counter()
+    for _ in range(loops):
+        gpio.load(wave)
+        sensor.read()
+    elapsed = (time.perf_counter() - start) / loops
+    print(f"読み取り全体: {elapsed*1e3:.2f}ms / {len(wave)}サンプル")
+
+    # ベンチマーク　エッジ検出モードのデコードの所要時間（待ち時間を除く）
+    gpio.load_edges(make_edges(50, 20))
+    start = time.perf_counter()
+    for _ in range(loops):
+        edge_sensor.read()
+    elapsed = (time.perf_counter() - start) / loops
+    print(f"読み取り全体（エッジ）: {elapsed*1e3:.2f}ms / {len(gpio.edges)}エッジ")
+
+
+if __name__ == "__main__":
+    main()
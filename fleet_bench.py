@@ -0,0 +1,127 @@
+# 中央サーバー（/fleet/ingest）の取り込みのベンチマーク
+# 複数のハウスのコントローラーのふりをしたクライアントが、温湿度・LED・サマリーのバッチを同時に送る
+# 一部の行はわざと前回と重ねて送り、重複を除けているかも確認する
+#   python fleet_bench.py                       一時ディレクトリに中央サーバーを立てて測る
+#   python fleet_bench.py --url http://host:5000   動いている中央サーバーを測る
+import json
+import time
+import math
+import random
+import argparse
+import datetime
+import tempfile
+import threading
+import statistics
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from myFleet import encode
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def make_batch(site, batch_no, rows, overlap):
+    """
+    1回分のアップロード　温湿度はrows行（1分おき）で、先頭のoverlap行は前回の最後と同じ時刻
+    """
+    first = batch_no * (rows - overlap)
+    temperature = []
+    for i in range(first, first + rows):
+        dt = START + datetime.timedelta(minutes=i)
+        temp = round(20 + 8 * math.sin(i / 1440 * 2 * math.pi) + random.random(), 1)
+        temperature.append([dt.strftime("%Y/%m/%d"), dt.strftime("%Y/%m/%d %H:%M"), temp, 60.0])
+    dt = START + datetime.timedelta(minutes=first + rows)
+    led = [[dt.strftime("%Y/%m/%d"), (dt - datetime.timedelta(minutes=5)).strftime("%Y/%m/%d %H:%M"),
+            dt.strftime("%Y/%m/%d %H:%M"), 5]]
+    summary = [[dt.strftime("%Y/%m/%d"), "06:00", "17:00", "12.3", 60, 28.0, 12.0, 20.0]]
+    return {"site": site,
+            "tables": {"temperature": {"columns": ["date", "datetime", "temperature", "humidity"], "rows": temperature},
+                       "LED": {"columns": ["date", "datetime_from", "datetime_to", "minute"], "rows": led},
+                       "summary": {"columns": ["date", "sunrise_time", "sunset_time", "moon_phase",
+                                               "lighting_minutes", "max_temp", "min_temp", "mean_temp"],
+                                   "rows": summary},
+                       },
+            }
+
+
+def client(url, site, batches, rows, overlap):
+    """
+    1つのハウスのコントローラー　batches回アップロードして、所要時間と保存された行数を返す
+    """
+    latencies = []
+    accepted = 0
+    for batch_no in range(batches):
+        body = encode(make_batch(site, batch_no, rows, overlap))
+        req = urllib.request.Request(url + "/fleet/ingest", data=body, method="POST",
+                                     headers={"Content-Encoding": "gzip", "Content-Type": "application/json"})
+        start = time.perf_counter()
+        with urllib.request.urlopen(req) as res:
+            reply = json.loads(res.read())
+        latencies.append(time.perf_counter() - start)
+        accepted += reply["accepted"].get("temperature", 0)
+    return latencies, accepted
+
+
+def start_server(directory):
+    """
+    一時ディレクトリに中央サーバーを立てる（マルチスレッド）
+    """
+    import logging
+    from flask import Flask
+    from werkzeug.serving import make_server
+    from myFleet import FleetStore
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)             # リクエストごとのログを出さない
+    app = Flask("fleet_bench")
+    FleetStore(directory).init_app(app)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="中央サーバーの取り込みベンチマーク")
+    parser.add_argument("--url", help="測る中央サーバー（省略すると一時ディレクトリに立てる）")
+    parser.add_argument("--sites", type=int, default=24, help="ハウスの数")
+    parser.add_argument("--clients", type=int, default=8, help="同時に送るクライアントの数")
+    parser.add_argument("--batches", type=int, default=20, help="1ハウスあたりのアップロード回数")
+    parser.add_argument("--rows", type=int, default=500, help="1回のアップロードの温湿度の行数")
+    parser.add_argument("--overlap", type=int, default=50, help="前回と重ねて送る行数")
+    args = parser.parse_args()
+
+    server = None
+    tmp = None
+    url = args.url
+    if url is None:
+        tmp = tempfile.TemporaryDirectory()
+        server, url = start_server(tmp.name)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        futures = [executor.submit(client, url, f"house{i:02d}", args.batches, args.rows, args.overlap)
+                   for i in range(args.sites)]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    accepted = sum(result[1] for result in results)
+    sent = args.sites * args.batches * args.rows
+    expected = args.sites * (args.batches * (args.rows - args.overlap) + args.overlap)
+    print(f"ハウス {args.sites}　クライアント {args.clients}　アップロード {len(latencies)}回")
+    print(f"送った行 {sent}　保存された行 {accepted}（重複を除くと {expected}）")
+    print(f"取り込み {sent / elapsed:,.0f}行/秒　{len(latencies) / elapsed:,.1f}回/秒")
+    print(f"所要時間 中央値 {statistics.median(latencies)*1000:.1f}ms　"
+          f"95% {latencies[int(len(latencies) * 0.95) - 1]*1000:.1f}ms　最大 {latencies[-1]*1000:.1f}ms")
+    if accepted != expected:
+        print("重複の除去が正しくありません")
+
+    if server is not None:
+        start = time.perf_counter()
+        with urllib.request.urlopen(url + "/fleet/summary?from=2024/01/01&to=2024/12/31") as res:
+            size = len(res.read())
+        print(f"全ハウスのサマリー {size}バイト {(time.perf_counter() - start)*1000:.1f}ms")
+        server.shutdown()
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
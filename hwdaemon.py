@@ -0,0 +1,170 @@
+# ハードウェアデーモン
+# コンテック・温湿度計を持つのはこのプロセスだけにして、最新の値を共有メモリに公開する
+# Webのプロセス（serve.py）は共有メモリを読むだけなので、再起動しても制御が途切れない
+#   python hwdaemon.py          本番
+#   python hwdaemon.py --try    ハードウェアなしで乱数を公開する
+import os
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+import threading
+import socketserver
+from myHardware import Device, HardwareError
+from mySharedState import SharedState, SOCKET_PATH, empty_state
+
+
+class Daemon():
+    def __init__(self, is_try=False, interval=1.0, humi_interval=60.0, humi_pin=14):
+        """
+        Args:
+            is_try        : Trueならばハードウェアを使わずに乱数を公開する
+            interval      : コンテックを読む間隔（秒）
+            humi_interval : 温湿度計を読む間隔（秒）　DHT11は連続で読めないので長めにする
+            humi_pin      : 温湿度計のGPIOピン
+        """
+        self.is_try = is_try
+        self.interval = interval
+        self.humi_interval = humi_interval
+        self.lock = threading.Lock()                        # 状態の更新と共有メモリへの書き込みをひとまとまりにする
+        self.state = empty_state(os.getpid())
+        self.shared = SharedState(create=True)
+        self.stop = threading.Event()
+        self.contec_device = Device("contec", timeout=2.0)
+        self.humi_device = Device("dht11", timeout=3.0)
+        if is_try:
+            self.contec = None
+            self.humi_sensor = None
+        else:
+            from myContec import Contec
+            import RPi.GPIO as GPIO
+            import dht11
+            GPIO.setwarnings(False)
+            GPIO.setmode(GPIO.BCM)
+            self.contec = Contec()
+            self.humi_sensor = dht11.DHT11(pin=humi_pin)
+        self.publish()
+
+    def publish(self, **values):
+        with self.lock:
+            self.state.update(values)
+            self.shared.write(self.state)
+
+    def read_contec(self):
+        if self.is_try:
+            inputs = [random.choice([1, 0]) for _ in range(8)]
+        else:
+            try:
+                inputs = self.contec_device.call(self.contec.input)
+            except HardwareError as e:
+                print(e)
+                inputs = []
+        if len(inputs) == 8:
+            self.publish(contec_time=time.time(), inputs=inputs, contec_ok=True)
+        else:
+            self.publish(contec_ok=False)
+
+    def read_humi(self):
+        if self.is_try:
+            self.publish(humi_time=time.time(), temp=random.randint(30, 60), humi=random.randint(60, 90), humi_ok=True)
+            return
+        for i in range(10):                                 # センサー値取得失敗するかもしれないので10回ループする
+            try:
+                result = self.humi_device.call(self.humi_sensor.read)
+            except HardwareError as e:
+                print(e)
+                break
+            if result.is_valid():
+                self.publish(humi_time=time.time(), temp=round(result.temperature, 1),
+                             humi=round(result.humidity, 1), humi_ok=True)
+                return
+        self.publish(humi_ok=False)
+
+    def set_led(self, on):
+        if not self.is_try:
+            self.contec_device.call(self.contec.output, on)
+        self.publish(led_on=on)
+
+    def set_relays(self, relays):
+        relays = [int(r) for r in relays]
+        if not self.is_try:
+            self.contec.define_output_relays(relays)
+        self.publish(relays=relays)
+
+    def handle(self, message):
+        """
+        ソケットで受け取った命令を実行する
+        """
+        cmd = message.get("cmd")
+        if cmd == "led":
+            self.set_led(bool(message["on"]))
+        elif cmd == "relays":
+            self.set_relays(message["relays"])
+        elif cmd == "read_humi":                            # 次の周期を待たずに読む
+            self.read_humi()
+        elif cmd == "status":
+            return {"state": dict(self.state),
+                    "devices": [self.contec_device.get_status(), self.humi_device.get_status()]}
+        else:
+            return {"error": f"知らない命令です: {cmd}"}
+        return {"response": "done"}
+
+    def run(self):
+        humi_next = 0.0
+        while not self.stop.is_set():
+            start = time.monotonic()
+            self.read_contec()
+            if start >= humi_next:
+                self.read_humi()
+                humi_next = start + self.humi_interval
+            self.stop.wait(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def close(self):
+        self.stop.set()
+        self.contec_device.shutdown()
+        self.humi_device.shutdown()
+        self.shared.close()
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.daemon.handle(json.loads(line))
+            except (HardwareError, KeyError, ValueError) as e:
+                reply = {"error": str(e)}
+            self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="agri ハードウェアデーモン")
+    parser.add_argument("--try", dest="is_try", action="store_true", help="ハードウェアなしで乱数を公開する")
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--humi-interval", type=float, default=60.0)
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    args = parser.parse_args()
+
+    daemon = Daemon(is_try=args.is_try, interval=args.interval, humi_interval=args.humi_interval)
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    server = socketserver.ThreadingUnixStreamServer(args.socket, CommandHandler)
+    server.daemon_threads = True
+    server.daemon = daemon
+    threading.Thread(target=server.serve_forever, name="command", daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))           # systemctl stopでも後片付けをする
+    print(f"ハードウェアデーモン開始 pid={os.getpid()} socket={args.socket}")
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.remove(args.socket)
+        daemon.close()
+
+
+if __name__ == "__main__":
+    main()
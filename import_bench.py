@@ -0,0 +1,81 @@
+# 過去データの取り込み（myImport.py）のベンチマークと回帰確認
+# agri.dbを一時フォルダーにコピーし、そちらに取り込むので元のDBは変わらない
+#   python import_bench.py [行数]
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import datetime
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+
+def write_csv(filename, rows):
+    """
+    toCSVと同じ列の温湿度のCSVを、いろいろな日付の書き方で作る
+    """
+    start = datetime.datetime(2020, 1, 1)
+    with open(filename, mode="w", encoding="utf-8") as f:
+        f.write("date,datetime,temperature,humidity\n")
+        for i in range(rows):
+            dt = start + datetime.timedelta(minutes=10 * i)
+            text = dt.strftime("%Y%m%d %H:%M") if i % 3 else dt.strftime("%Y/%m/%d %H:%M")
+            f.write(f"{dt:%Y/%m/%d},{text},{15 + i % 20},{40 + i % 50}\n")
+
+
+def main():
+    import myImport
+    from myDatabase import DB
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    failed = 0
+    with tempfile.TemporaryDirectory() as directory:
+        shutil.copy(os.path.join(HERE, "agri.db"), directory)
+        os.chdir(directory)                                     # DBはカレントフォルダーのagri.dbを使う
+        db = DB()
+
+        # 回帰確認　気温が空欄・nanだけの日があっても取り込めて、その日の気温は書かないこと
+        with open("nan.csv", mode="w", encoding="utf-8") as f:
+            f.write("date,datetime,temperature,humidity\n"
+                    "2023/11/02,20231102 11:00,nan,40\n"
+                    "2023/11/02,20231102 12:00,,41\n")
+        for attempt in ("1回目", "2回目"):                       # 取り込み直しても同じ日を計算し直す
+            try:
+                result = myImport.import_files(db, ["nan.csv"])
+            except Exception as e:
+                failed += 1
+                print(f"NG nan {attempt}: {type(e).__name__}: {e}")
+                continue
+            if result["summary_days"] != 1:
+                failed += 1
+                print(f"NG nan {attempt}: 計算し直した日数 {result['summary_days']}")
+        conn = sqlite3.connect("agri.db")
+        summary = conn.execute("SELECT max_temp, min_temp FROM summary WHERE date='2023/11/02'").fetchall()
+        conn.close()
+        if any(row != (None, None) for row in summary):
+            failed += 1
+            print(f"NG nan: 気温のない日のサマリー {summary}")
+
+        # ベンチマーク　まとめて取り込む時間と、同じファイルを取り込み直したときに重複になること
+        write_csv("temperature.csv", rows)
+        start = time.perf_counter()
+        result = myImport.import_files(db, ["temperature.csv"])
+        elapsed = time.perf_counter() - start
+        first = result["files"]["temperature.csv"]
+        print(f"取り込み: {first['inserted']}行 {elapsed:.2f}秒　サマリー {result['summary_days']}日")
+        result = myImport.import_files(db, ["temperature.csv"])
+        again = result["files"]["temperature.csv"]
+        if first["inserted"] != rows or again["inserted"] != 0 or again["skipped"] != rows:
+            failed += 1
+            print(f"NG 取り込み直し: 1回目 {first}　2回目 {again}")
+        os.chdir(HERE)
+
+    print(f"回帰確認: {'OK' if not failed else f'{failed}件NG'}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
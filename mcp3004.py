@@ -1,5 +1,8 @@
 import time
 import datetime
+import threading
+import statistics
+from collections import deque
 from gpiozero import MCP3004
 
 Vref = 5
@@ -9,17 +12,103 @@ def analog_read(ch):
     volt = adc.value * Vref
     return volt
 
+
+class Sampler():
+    def __init__(self, channels=(0, 1, 2, 3), interval=0.5, oversample=8, size=120, method="mean"):
+        """
+        MCP3004の全チャンネルを一定周期で巡回して読み取り続けるクラス
+        Args:
+            channels   : 読み取るチャンネル
+            interval   : 1巡の周期（秒）
+            oversample : 1回の読み取りでのサンプル数　これを平均（または中央値）する
+            size       : チャンネルごとに保持する値の数（リングバッファ）
+            method     : "mean" もしくは "median"
+        """
+        self.interval = interval
+        self.oversample = oversample
+        self.reduce = statistics.median if method == "median" else statistics.fmean
+        self.channels = tuple(channels)
+        self.adcs = {}                                                                  # SPIはstart()で開き、stop()で閉じる
+        self.buffers = {ch: deque(maxlen=size) for ch in channels}                      # チャンネルごとのリングバッファ
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def scan(self):
+        """
+        全チャンネルを1巡読み取り、リングバッファに追加する
+        """
+        now = time.time()
+        for ch, adc in self.adcs.items():
+            values = [adc.value for _ in range(self.oversample)]       # オーバーサンプリング
+            volt = self.reduce(values) * Vref
+            with self.lock:
+                self.buffers[ch].append((now, volt))
+
+    def run(self):
+        next_time = time.monotonic()
+        while not self.stop_event.is_set():
+            self.scan()
+            next_time += self.interval                                  # 読み取りにかかった時間に関係なく一定周期にする
+            self.stop_event.wait(max(0, next_time - time.monotonic()))
+
+    def start(self):
+        """
+        バックグラウンドで巡回を開始する
+        """
+        if self.thread is None:
+            if not self.adcs:                                           # 止めた後にもう一度始めるときは開き直す
+                self.adcs = {ch: MCP3004(channel=ch, max_voltage=Vref) for ch in self.channels}
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for adc in self.adcs.values():
+            adc.close()
+        self.adcs = {}
+
+    def latest(self, ch, max_age=None):
+        """
+        指定したチャンネルの最新の電圧を返す　まだ値がなければNone
+        Args:
+            max_age : これより古い値（秒）はNoneにする（止まっているときに古い値を使わない）
+        """
+        with self.lock:
+            buffer = self.buffers[ch]
+            if not buffer:
+                return None
+            t, volt = buffer[-1]
+        if max_age is not None and time.time() - t > max_age:
+            return None
+        return volt
+
+    def history(self, ch):
+        """
+        指定したチャンネルの(時刻, 電圧)のリストを返す
+        """
+        with self.lock:
+            return list(self.buffers[ch])
+
+
 def main():
+    sampler = Sampler(channels=(0, 3)).start()
     try:
         while True:
-            val0 = analog_read(ch=0)
-            val3 = analog_read(ch=3)
+            time.sleep(1)
+            val0 = sampler.latest(0)
+            val3 = sampler.latest(3)
+            if val0 is None or val3 is None:
+                continue
             now = datetime.datetime.now().strftime("%H:%M:%S")
             print(f"{now} : ch3={val3:.2f}V, ch0={val0:.2f}V")
-            time.sleep(1)
     except KeyboardInterrupt:
-        pass
+        sampler.stop()
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,214 @@
+import time
+import threading
+import datetime
+from collections import deque
+
+# 電圧から残量（%）を出すための、空と満充電の電圧　設定のvolt_empty・volt_fullで変えられる
+BATTERY_DEFAULTS = {"volt_empty": "11.8", "volt_full": "12.8"}
+
+
+class Battery():
+    def __init__(self, db, window=3600, keep_alive=600, volt_deadband=0.05):
+        """
+        バッテリーの状態を時系列として記録し、充放電の傾向を計算するクラス
+        Args:
+            db            : データベースのクラス
+            window        : 充放電レートを計算する期間（秒）
+            keep_alive    : 状態が変わらなくても記録する間隔（秒）
+            volt_deadband : これ以上電圧が変わったら記録する（V）
+        """
+        self.db = db
+        self.window = window
+        self.keep_alive = keep_alive
+        self.volt_deadband = volt_deadband
+        self.lock = threading.Lock()                        # 複数スレッドから呼ばれても状態を壊さない
+
+        self.color = None                                   # 現在の色（青／緑／黄）
+        self.volt = None                                    # 現在の電圧
+        self.color_since = None                             # 現在の色になった時刻
+        self.yellow_volt = None                             # 緑から黄になったときの電圧（リレーの切り替わり電圧）
+        self.volt_empty = float(BATTERY_DEFAULTS["volt_empty"])
+        self.volt_full = float(BATTERY_DEFAULTS["volt_full"])
+        self.yellow_percent = 20.0                          # 設定のbatt_yellow　これより下が黄
+        self.green_percent = 80.0                           # 設定のbatt_green　これより下が緑
+        self.is_configured = False                          # 設定を読み込んだかどうか
+        self.last_saved = None                              # 最後にDBに記録した（時刻, 色, 電圧）
+
+        # 最小二乗法の傾きを逐次計算するための累計　古いものは引き算して取り除く
+        self.samples = deque()
+        self.n = 0
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+        self.t0 = None                                      # 桁落ちを避けるための時刻の基準
+
+    def set_config(self, config):
+        """
+        設定からしきい値と、前に覚えた黄になる電圧を読み込む
+        Args:
+            config : 設定の辞書（値は文字列）
+        """
+        with self.lock:
+            self.volt_empty = float(config.get("volt_empty", BATTERY_DEFAULTS["volt_empty"]))
+            self.volt_full = float(config.get("volt_full", BATTERY_DEFAULTS["volt_full"]))
+            self.yellow_percent = float(config.get("batt_yellow", self.yellow_percent))
+            self.green_percent = float(config.get("batt_green", self.green_percent))
+            if config.get("yellow_volt"):                   # 再起動しても覚えた電圧を使う
+                self.yellow_volt = float(config["yellow_volt"])
+            self.is_configured = True
+
+    def percent(self, volt):
+        """
+        電圧を残量（%）にする　空と満充電の電圧の間を直線で結ぶ
+        """
+        if volt is None or self.volt_full <= self.volt_empty:
+            return None
+        percent = (volt - self.volt_empty) / (self.volt_full - self.volt_empty) * 100
+        return min(100.0, max(0.0, percent))
+
+    def percent2color(self, percent):
+        """
+        残量を画面のバッテリーグラフと同じ区切り（batt_yellow・batt_green）で色にする
+        """
+        if percent is None:
+            return None
+        if percent < self.yellow_percent:
+            return "黄"
+        if percent < self.green_percent:
+            return "緑"
+        return "青"
+
+    def threshold_volt(self):
+        """
+        黄になる電圧　リレーの切り替わりを見ていなければ、batt_yellowの残量に当たる電圧
+        """
+        if self.yellow_volt is not None:
+            return self.yellow_volt
+        return self.volt_empty + (self.volt_full - self.volt_empty) * self.yellow_percent / 100
+
+    @staticmethod
+    def relay2color(relay1, relay2):
+        """
+        電圧リレーの状態を色にする
+        Args:
+            relay1 : リレー1=緑信号（低圧）
+            relay2 : リレー2=青信号（高圧）
+        """
+        if relay2:                                          # リレー2がオンならば
+            return "青"                                     # 「青」
+        elif relay1:                                        # リレー2がオフでリレー1がオンならば
+            return "緑"                                     # 「緑」
+        else:                                               # いずれでもなければ
+            return "黄"                                     # 「黄」
+
+    def add(self, relay1, relay2, volt=None, now=None):
+        """
+        バッテリーの状態を追加する
+        Args:
+            relay1, relay2 : 電圧リレーの状態
+            volt           : MCP3004の電圧（なければNone）
+            now            : 時刻（UNIX時間）未指定ならば今
+        Returns:
+            color : 色
+        """
+        if now is None:
+            now = time.time()
+        if not self.is_configured:                          # 設定を読む前に呼ばれたとき
+            self.set_config(self.db.get_config())
+        with self.lock:
+            return self.update(relay1, relay2, volt, now)
+
+    def update(self, relay1, relay2, volt, now):
+        """
+        状態を更新する（ロックを取ってから呼ぶ）
+        """
+        color = self.relay2color(relay1, relay2)
+        if color != self.color:                             # 色が変わったら
+            if self.color == "緑" and color == "黄" and volt is not None:
+                self.yellow_volt = volt                     # 黄になった電圧を覚えておく
+                self.db.set_config_value("yellow_volt", round(volt, 3))    # 再起動しても使えるように残す
+            self.color = color
+            self.color_since = now
+        if volt is not None:
+            self.volt = volt
+            self.add_volt(now, volt)
+
+        # 色が変わった・電圧が変わった・しばらく記録していない　ときだけDBに記録する
+        if self.last_saved is None:
+            is_save = True
+        else:
+            saved_time, saved_color, saved_volt = self.last_saved
+            is_save = color != saved_color \
+                or now - saved_time >= self.keep_alive \
+                or (volt is not None and (saved_volt is None or abs(volt - saved_volt) >= self.volt_deadband))
+        if is_save:
+            self.db.set_battery(relay1, relay2, volt, datetime.datetime.fromtimestamp(now))
+            self.last_saved = (now, color, volt)
+        return color
+
+    def add_volt(self, now, volt):
+        """
+        電圧を充放電レート計算用の累計に加え、期間外のものを取り除く
+        """
+        if self.t0 is None:
+            self.t0 = now
+        t = now - self.t0
+        self.samples.append((t, volt))
+        self.n += 1
+        self.sum_t += t
+        self.sum_v += volt
+        self.sum_tt += t * t
+        self.sum_tv += t * volt
+        while self.samples and self.samples[0][0] < t - self.window:
+            old_t, old_v = self.samples.popleft()
+            self.n -= 1
+            self.sum_t -= old_t
+            self.sum_v -= old_v
+            self.sum_tt -= old_t * old_t
+            self.sum_tv -= old_t * old_v
+
+    def rate(self):
+        """
+        充放電レート（V/時）を返す　プラスは充電、マイナスは放電　計算できなければNone
+        """
+        denom = self.n * self.sum_tt - self.sum_t * self.sum_t
+        if self.n < 2 or denom <= 0:
+            return None
+        slope = (self.n * self.sum_tv - self.sum_t * self.sum_v) / denom   # V/秒
+        return slope * 3600
+
+    def minutes_to_yellow(self):
+        """
+        今の放電レートが続いたとき黄になるまでの分数　予測できなければNone
+        """
+        rate = self.rate()
+        if self.color == "黄":
+            return 0
+        if rate is None or rate >= 0 or self.volt is None:
+            return None
+        return max(0, (self.volt - self.threshold_volt()) / -rate * 60)
+
+    def get_status(self):
+        """
+        現在の状態を辞書として返す
+        """
+        with self.lock:
+            return self.status()
+
+    def status(self):
+        """
+        現在の状態の辞書を作る（ロックを取ってから呼ぶ）
+        """
+        rate = self.rate()
+        minutes = self.minutes_to_yellow()
+        percent = self.percent(self.volt)
+        since = None
+        if self.color_since is not None:
+            since = datetime.datetime.fromtimestamp(self.color_since).strftime("%Y/%m/%d %H:%M:%S")
+        return {"color": self.color,
+                "since": since,
+                "volt": None if self.volt is None else round(self.volt, 3),
+                "percent": None if percent is None else round(percent),
+                "volt_color": self.percent2color(percent),  # 電圧から見た色（リレーの色と比べられる）
+                "yellow_volt": None if self.yellow_volt is None else round(self.yellow_volt, 3),
+                "rate": None if rate is None else round(rate, 3),
+                "minutes_to_yellow": None if minutes is None else round(minutes),
+                }
@@ -0,0 +1,157 @@
+# 温湿度を保存するときに、読み取りを間引くモジュール
+# DHT11は1℃・1%刻みなので、天気が安定していると何時間も同じ値が続く
+# 許容幅の中で元の時系列を再現できる点だけを残し、行数・DBの大きさ・サマリーの計算を減らす
+#
+# DBには「確定した点」と「最新の読み取り（仮の点）」を置く
+# 次の読み取りも許容幅に収まれば仮の点をその読み取りで置き換え、収まらなければ仮の点を確定して新しい仮の点を追加する
+# なので、DBには常に最新の読み取りがあり、確定した点はどれも実際の読み取り
+
+import math
+
+MAX_GAP = 3600                                              # これより長く確定しないときは、許容幅に収まっていても確定する（秒）
+
+
+class Deadband():
+    def __init__(self, tolerance):
+        """
+        起点の値から許容幅より離れるまで点を残さない
+        確定した点から次の点まで起点の値が続くとみなせば、誤差は許容幅以内
+        Args:
+            tolerance : 許容幅
+        """
+        self.tolerance = tolerance
+        self.value = None
+
+    def start(self, t, value):
+        self.value = value
+
+    def fits(self, t, value):
+        return abs(value - self.value) <= self.tolerance
+
+    def add(self, t, value):
+        pass
+
+
+class SwingingDoor():
+    def __init__(self, tolerance):
+        """
+        スウィングドア法　起点から引いた直線が、その間のすべての点から許容幅以内にあるかぎり点を残さない
+        確定した点を直線で結べば、誤差は許容幅以内
+        Args:
+            tolerance : 許容幅
+        """
+        self.tolerance = tolerance
+        self.t = None
+        self.value = None
+        self.upper = -math.inf                              # 起点から引ける直線の傾きの下限
+        self.lower = math.inf                               # 同じく上限
+
+    def start(self, t, value):
+        self.t = t
+        self.value = value
+        self.upper = -math.inf
+        self.lower = math.inf
+
+    def fits(self, t, value):
+        """
+        起点からこの点への直線が、これまでの点すべてから許容幅以内かどうか
+        """
+        dt = t - self.t
+        if dt <= 0:
+            return abs(value - self.value) <= self.tolerance
+        slope = (value - self.value) / dt
+        return self.upper <= slope <= self.lower
+
+    def add(self, t, value):
+        dt = t - self.t
+        if dt <= 0:
+            return
+        self.upper = max(self.upper, (value - self.value - self.tolerance) / dt)
+        self.lower = min(self.lower, (value - self.value + self.tolerance) / dt)
+
+
+class Keep():
+    def __init__(self, tolerance=0):
+        """
+        間引かない　すべての読み取りを残す
+        """
+
+    def start(self, t, value):
+        pass
+
+    def fits(self, t, value):
+        return False
+
+    def add(self, t, value):
+        pass
+
+
+COMPRESSORS = {"swinging_door": SwingingDoor, "deadband": Deadband, "none": Keep}
+
+
+class RowFilter():
+    def __init__(self, settings, max_gap=MAX_GAP):
+        """
+        同じ行に入る複数の列（温度と湿度）をまとめて間引くクラス
+        どれかの列が許容幅に収まらなければ、全部の列について仮の点を確定する
+        Args:
+            settings : 列名 -> (方法, 許容幅)　方法は"swinging_door"・"deadband"・"none"
+            max_gap  : 確定せずにおく最長の時間（秒）
+        """
+        self.compressors = {name: COMPRESSORS[method](tolerance) for name, (method, tolerance) in settings.items()}
+        self.max_gap = max_gap
+        self.reset()
+
+    def reset(self):
+        """
+        次の読み取りから新しく始める（日付が変わったときなど）
+        """
+        self.base_time = None                               # 起点の時刻
+        self.tail = None                                    # 仮の点 (時刻, 値の辞書)
+        self.tail_is_base = False                           # 仮の点が起点そのもの（確定済み）かどうか
+
+    def _start(self, t, values):
+        for name, compressor in self.compressors.items():
+            compressor.start(t, values[name])
+        self.base_time = t
+
+    def _fits(self, t, values):
+        return (t - self.base_time <= self.max_gap
+                and all(compressor.fits(t, values[name]) for name, compressor in self.compressors.items()))
+
+    def _add(self, t, values):
+        for name, compressor in self.compressors.items():
+            compressor.add(t, values[name])
+
+    def offer(self, t, values):
+        """
+        読み取りを1つ加え、DBをどうするかを返す
+        Args:
+            t      : 時刻（秒）
+            values : 列名 -> 値
+        Returns:
+            "update" : 仮の点をこの読み取りで置き換える
+            "insert" : 仮の点はそのまま確定し、この読み取りを新しい行として追加する
+        """
+        if self.tail is None:                               # 最初の読み取りは起点として確定する
+            self._start(t, values)
+            self.tail = (t, values)
+            self.tail_is_base = True
+            return "insert"
+        if self._fits(t, values):                           # 許容幅に収まるので、仮の点を進める
+            self._add(t, values)
+            action = "insert" if self.tail_is_base else "update"
+            self.tail = (t, values)
+            self.tail_is_base = False
+            return action
+        if not self.tail_is_base:                           # 仮の点を確定して、そこを新しい起点にする
+            self._start(*self.tail)
+            if self._fits(t, values):
+                self._add(t, values)
+                self.tail = (t, values)
+                self.tail_is_base = False
+                return "insert"
+        self._start(t, values)                              # 起点からも離れすぎているので、この読み取りも確定する
+        self.tail = (t, values)
+        self.tail_is_base = True
+        return "insert"
@@ -1,5 +1,6 @@
 import configparser
 import os
+import io
 import datetime
 import re
 
@@ -9,6 +10,8 @@ class Config():
         self.filename = "config.ini"
         self.parser = configparser.ConfigParser()
         self.parser.optionxform = str               # 大文字小文字を区別する
+        self.values = {}                            # 読み込み済みの設定
+        self.signature = None                       # 読み込んだときのファイルの更新時刻とサイズ
         self.default_values = \
 """
 [DEFAULT]
@@ -33,55 +36,121 @@ batt_green = 20
     def read(self):
         # 設定ファイルが存在しない場合、デフォルト設定を新規作成する
         if not os.path.exists(self.filename):
-            with open(self.filename, mode="w", encoding="utf-8") as f:
-                f.write(self.default_values)
-        
-        # 設定ファイルを読み込む 
-        self.parser.read(self.filename, encoding="utf-8")
-        return dict(self.parser["DEFAULT"])
+            self.write_atomic(self.default_values)
+
+        # ファイルの更新時刻とサイズが前回と同じならば、読み込み済みの値を返す
+        stat = os.stat(self.filename)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature != self.signature:
+            parser = configparser.ConfigParser()
+            parser.optionxform = str                    # 大文字小文字を区別する
+            parser.read(self.filename, encoding="utf-8")
+            self.parser = parser
+            self.values = dict(parser["DEFAULT"])
+            self.signature = signature
+        return dict(self.values)
 
     def write(self, dict):
         # 設定ファイルに書き込む
+        self.read()
         self.parser["DEFAULT"].update(dict)
-        with open(self.filename, mode="w",  encoding="utf-8") as f:
-            self.parser.write(f)
+        buffer = io.StringIO()
+        self.parser.write(buffer)
+        self.write_atomic(buffer.getvalue())
+        self.signature = None                           # 次に読むときに読み直す
+
+    def write_atomic(self, text):
+        # 一時ファイルに書いてから置き換えることで、電源断でも壊れた設定ファイルを残さない
+        tmp = self.filename + ".tmp"
+        with open(tmp, mode="w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.filename)
+
+
+# 固定長の1行　区切りの位置がすべて決まっているので、古い可変長の行とは区別できる
+DAILYLOG_RECORD = re.compile(r"\d{4}/\d{2}/\d{2},一日の実績:[ \d]{5}\d分, 累計:[ \d]{7}\d分\n".encode("utf-8"))
 
 
 # 日当たりログのクラス
 class Dailylog():
     def __init__(self):
         self.filename = "日当たりログ.txt"                        # ファイル名
+        # 1行を固定長にすることで、最終行の読み書きをファイル末尾からのシークだけで済ませる
+        self.record_size = len(self.format_record("2000/01/01", 0, 0))    # 1行のバイト数
+        self.migrate()
+
+    def format_record(self, date, value, total):
+        """
+        1行分のデータを固定長のバイト列にする
+        """
+        return f"{date},一日の実績:{value:>6}分, 累計:{total:>8}分\n".encode("utf-8")
+
+    def parse_record(self, record):
+        """
+        1行分のデータを 日付, 今日の累計, これまでの累計 にする
+        """
+        row_list = re.split("[,:]", record.decode("utf-8"))    # 行の内容をコンマおよびコロンで区切ってリストとする
+        date = row_list[0]                                      # 最初の要素が日付
+        value = int(row_list[2].strip()[:-1])                   # 0から数えて2番めが今日の累計　最後の1文字「分」を除いて数値化する
+        total = int(row_list[-1].strip()[:-1])                  # 最後の要素がこれまでの累計
+        return date, value, total
+
+    def migrate(self):
+        """
+        ファイルがなければ作り、可変長の古い形式ならば固定長の形式に一度だけ書き直す
+        """
+        if not os.path.exists(self.filename):
+            open(self.filename, mode="wb").close()
+            return
+        with open(self.filename, mode="rb") as f:
+            data = f.read()
+        if self.is_fixed(data):
+            return
+        lines = [line for line in data.splitlines() if line.strip()]
+        records = [self.format_record(*self.parse_record(line)) for line in lines]
+        tmp = self.filename + ".tmp"
+        with open(tmp, mode="wb") as f:
+            f.writelines(records)
+        os.replace(tmp, self.filename)
+
+    def is_fixed(self, data):
+        """
+        ファイル全体が固定長の形式かどうか　最終行だけでなく、すべての行の区切りの位置を確かめる
+        """
+        if len(data) % self.record_size != 0:
+            return False
+        return all(DAILYLOG_RECORD.fullmatch(data, i, i + self.record_size)
+                   for i in range(0, len(data), self.record_size))
+
+    def read_records(self, n):
+        """
+        最後のn行をファイル末尾からシークして読む
+        """
+        with open(self.filename, mode="rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            count = min(n, size // self.record_size)
+            f.seek(size - count * self.record_size)
+            data = f.read()
+        return [data[i:i + self.record_size] for i in range(0, len(data), self.record_size)]
 
     def read_last_data(self):
         """
         最終行のデータを取得する
         """
-        with open(self.filename, mode="r", encoding="utf-8") as f:
-            str_list = f.readlines()                            # 全テキストを行単位のリストとして読み込む
-        row_cnt = len(str_list)                                 # 行数
-        last_row = str_list[row_cnt - 1]                        # 最終行の内容
-        last_row_list = re.split("[,:]", last_row)              # 最終行の内容をコンマおよびコロンで区切ってリストとする
-
-        last_date = last_row_list[0]                            # 最初の要素が日付
-        last_value = last_row_list[2].strip()                   # 0から数えて2番めが今日の累計
-        last_value = int(last_value[:-1])                       # 最後の1文字は「分」なので、それを除いて数値化する
-        last_sum = last_row_list[-1].strip()                    # 最後の要素がこれまでの累計
-        last_sum = int(last_sum[:-1])                           # 最後の1文字は「分」なので、それを除いて数値化する
-        return last_date, last_value, last_sum
-    
+        records = self.read_records(1)
+        if not records:                                         # まだ1行もなければ
+            return "", 0, 0
+        return self.parse_record(records[0])                    # 日付, 今日の累計, これまでの累計
+
     def last_n_data(self, n=7):
         """
         最後の数行を取得する　n=行数
         """
-        with open(self.filename, mode="r", encoding="utf-8") as f:
-            str_list = f.readlines()                            # 全テキストを行単位のリストとして読み込む
-        last_row = len(str_list)                                # 行数
-        start_row = max(0, last_row-n)                          # 表示する最初の行
         text = "過去の実績<br><br>"
-        for i in range(start_row, last_row):
-            line = str_list[i]
-            print(i, line)
-            text += line + "<br>"
+        for record in self.read_records(n):
+            text += record.decode("utf-8") + "<br>"
         return text
 
     def refresh_last(self, val):
@@ -90,25 +159,15 @@ class Dailylog():
         """
         print(f"今日のデータを{val}だけプラスするぞ")
         today = datetime.datetime.now().strftime("%Y/%m/%d")    # 今日の日付
-        last_data = self.read_last_data()                       # ログの最終行のデータ
-        last_date, last_value, last_sum = last_data             # 最終行の3つのデータ
+        last_date, last_value, last_sum = self.read_last_data() # ログの最終行の3つのデータ
         print(last_date, last_value, last_sum)
 
-        if today != last_date:                                  # 日付が違っていたら
-            with open(self.filename, mode="a",  encoding="utf-8") as f:
-                last_date = today                               # 日付は今日
+        with open(self.filename, mode="r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            if today != last_date:                              # 日付が違っていたら今日の行を末尾に追記する
                 last_value = 0                                  # 今日の累計は0
-                f.write(f"{last_date},一日の実績:{last_value}分, 累計:{last_sum}分\n")        # 今日の行を追記する        
-
-        last_value += val                                       # 今日1日のデータに今回の点灯時間をプラス
-        last_sum += val                                         # これまでの累計データに今回の点灯時間をプラス
-
-        with open(self.filename, mode="r", encoding="utf-8") as f:
-            str_list = f.readlines()                            # 全テキストを行単位のリストとしてあらためて読み込む
-        row_cnt = len(str_list)                                 # 行数
-        print("更新前", str_list[row_cnt - 1])
-        str_list[row_cnt - 1] = f"{today},一日の実績:{last_value}分, 累計:{last_sum}分\n"    # 更新する最終行
-        print("更新後", str_list[row_cnt - 1])
-        print(str_list)
-        with open(self.filename, mode="w", encoding="utf-8") as f:
-            f.writelines(str_list)                   # あらためて全行書き込む　最終行の更新はこうするしかない？
+            else:                                               # 今日の行があればその行だけを上書きする
+                f.seek(size - self.record_size)
+            last_value += val                                   # 今日1日のデータに今回の点灯時間をプラス
+            last_sum += val                                     # これまでの累計データに今回の点灯時間をプラス
+            f.write(self.format_record(today, last_value, last_sum))
@@ -1,10 +1,16 @@
 # coding: utf-8
 import ctypes
-import sys
 import cdio
 import time
 import datetime
 
+class ContecError(Exception):
+    """
+    コンテックのドライバのエラー
+    """
+    pass
+
+
 class Contec():
     def __init__(self):
         print("start")
@@ -29,8 +35,9 @@ class Contec():
         ret = cdio.DioInit(self.DEV_NAME.encode(), ctypes.byref(self.dio_id))
         if ret != cdio.DIO_ERR_SUCCESS:
             cdio.DioGetErrorString(ret, self.err_str)
-            print(f"DioInit = {ret}: {self.err_str.value.decode('utf-8')}")
-            sys.exit()
+            message = f"DioInit = {ret}: {self.err_str.value.decode('utf-8')}"
+            print(message)
+            raise ContecError(message)                      # 呼び出し元（Webアプリ）ごと終了させない
 
     def num2array(self, num):
         # """8ビットの入力データを光センサーオンオフのリストとして返す"""
@@ -73,9 +80,8 @@ class Contec():
     def define_output_relays(self, array):
         self.relays = array
 
-contec = Contec()
-
 def main():
+    contec = Contec()
     while True:
         input_array = contec.input()
         print(f"{datetime.datetime.now().strftime('%H:%M:%S')}")
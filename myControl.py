@@ -0,0 +1,329 @@
+# 育成LEDの点灯消灯の判断（myscript.jsのgetTimeModeとapplyContecと同じ規則）をPythonにしたもの
+# 時計を差し替えられるので、記録した（または作った）光センサーとバッテリーの時系列を実時間の何千倍もの速さで再生し、
+# しきい値などの組み合わせごとの点灯時間と切り替え回数を、プロセスプールで並べて比べられる
+#   python myControl.py --days 120 --grid sensing_count=2,3,4 sensing_threshold=0.3,0.5,0.7
+#   python myControl.py --trace trace.csv --grid sensing_interval=3,5,10
+import csv
+import math
+import bisect
+import random
+import argparse
+import datetime
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from myState import LightCounter
+from myBattery import Battery
+
+# 設定テーブルと同じ名前の設定値
+DEFAULTS = {"morning_offset": 0,                            # 日の出の何分後に朝の強制点灯を始める
+            "evening_offset": 0,                            # 日の入りの何分前に夕方の強制点灯を終える
+            "morning_minutes": 90,                          # 朝の強制点灯時間（分）
+            "evening_minutes": 90,                          # 夕方の強制点灯時間（分）
+            "sensing_interval": 5,                          # 光センサーを読む間隔（分）
+            "sensing_count": 3,                             # 何回分を積算して判断するか
+            "sensing_threshold": 0.5,                       # 5個×回数に対する曇りの割合のしきい値
+            "isNightSense": 0,                              # 夜も光センサーを読むか
+            }
+
+
+def simple_sun(date):
+    """
+    日の出・日の入りの近似（北緯35度あたり）　ephemなしで季節の変化を付けるため
+    Returns:
+        sunrise, sunset : datetime
+    """
+    day = date.timetuple().tm_yday
+    length = 12 + 2.4 * math.sin(2 * math.pi * (day - 80) / 365)     # 昼の長さ（時間）
+    noon = datetime.datetime(date.year, date.month, date.day, 11, 45)
+    half = datetime.timedelta(hours=length / 2)
+    return noon - half, noon + half
+
+
+class SimClock():
+    def __init__(self, now):
+        """
+        再生用の時計　LightControllerにdatetime.datetime.nowの代わりに渡す
+        """
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class LightController():
+    def __init__(self, params=None, clock=datetime.datetime.now, sun_times=simple_sun):
+        """
+        育成LEDの点灯消灯を判断するクラス
+        Args:
+            params    : 設定値（DEFAULTSと同じキー　足りないものはDEFAULTS）
+            clock     : 今の時刻を返す関数
+            sun_times : 日付から(日の出, 日の入り)を返す関数
+        """
+        self.params = dict(DEFAULTS, **(params or {}))
+        self.clock = clock
+        self.sun_times = sun_times
+        self.counter = LightCounter(int(self.params["sensing_count"]))
+        self.threshold = 5 * int(self.params["sensing_count"]) * float(self.params["sensing_threshold"])
+        self.interval = datetime.timedelta(minutes=float(self.params["sensing_interval"]))
+        self.mode = ""                                      # 時刻モード　朝・昼・夕方・夜
+        self.is_led = False
+        self.next_sensing = None                            # 次に光センサーを読む時刻
+        self.windows_cache = {}
+        # 集計
+        self.on_since = None                                # 点灯した時刻
+        self.on_minutes = 0.0                               # 点灯していた時間の合計（分）
+        self.switches = 0                                   # 点灯消灯を切り替えた回数
+        self.battery_blocks = 0                             # 暗いのにバッテリーが黄色で点灯しなかった回数
+
+    def windows(self, date):
+        """
+        その日の朝と夕方の強制点灯の時間帯
+        """
+        windows = self.windows_cache.get(date)
+        if windows is None:
+            sunrise, sunset = self.sun_times(date)
+            p = self.params
+            morning_start = sunrise + datetime.timedelta(minutes=float(p["morning_offset"]))
+            morning_end = morning_start + datetime.timedelta(minutes=float(p["morning_minutes"]))
+            evening_end = sunset - datetime.timedelta(minutes=float(p["evening_offset"]))
+            evening_start = evening_end - datetime.timedelta(minutes=float(p["evening_minutes"]))
+            windows = self.windows_cache[date] = (morning_start, morning_end, evening_start, evening_end)
+        return windows
+
+    def time_mode(self, now):
+        morning_start, morning_end, evening_start, evening_end = self.windows(now.date())
+        if now >= evening_end:                              # 日の入り以降は強制OFF
+            return "夜"
+        if now >= evening_start:                            # 日の入り前は強制ON
+            return "夕方"
+        if now >= morning_end:                              # 日の出後しばらくしたら自動制御
+            return "昼"
+        if now >= morning_start:                            # 日の出以降は強制ON
+            return "朝"
+        return "夜"
+
+    def boundaries(self, date):
+        """
+        その日のモードが変わる時刻（再生のときに、その時刻にも判断させるため）
+        """
+        return list(self.windows(date))
+
+    def set_led(self, is_led, now):
+        if is_led == self.is_led:
+            return
+        self.switches += 1
+        if is_led:
+            self.on_since = now
+        elif self.on_since is not None:
+            self.on_minutes += (now - self.on_since).total_seconds() / 60
+            self.on_since = None
+        self.is_led = is_led
+
+    def step(self, lights, relay1, relay2):
+        """
+        今の時刻で1回判断する（時刻は時計から取る）
+        Args:
+            lights         : 5個の光センサーの状態（1が曇り）
+            relay1, relay2 : 電圧リレーの状態
+        Returns:
+            点灯するかどうか
+        """
+        now = self.clock()
+        mode = self.time_mode(now)
+        if mode != self.mode:                               # モードが変わったら
+            self.mode = mode
+            if mode == "夜":
+                self.set_led(False, now)
+            elif mode in ("朝", "夕方"):
+                self.set_led(True, now)
+
+        if self.next_sensing is None or now >= self.next_sensing:      # 光センサーを読む時刻になったら
+            self.next_sensing = (now + self.interval).replace(second=30, microsecond=0)
+            if mode == "昼" or int(self.params["isNightSense"]):
+                light_sum, light_cnt = self.counter.add(lights, True)
+                if light_cnt == self.counter.sensing_count - 1:         # 指定した回数だけ積算したら判断する
+                    if light_sum < self.threshold:                      # 明るいので消灯
+                        self.set_led(False, now)
+                    elif Battery.relay2color(relay1, relay2) in ("青", "緑"):
+                        self.set_led(True, now)                         # 暗くてバッテリーも十分なので点灯
+                    else:
+                        self.battery_blocks += int(not self.is_led)
+                        self.set_led(False, now)                        # バッテリーが不足気味なので消灯
+        return self.is_led
+
+    def finish(self, now):
+        """
+        再生の最後に、点灯中の時間を集計に入れる
+        """
+        if self.is_led and self.on_since is not None:
+            self.on_minutes += (now - self.on_since).total_seconds() / 60
+            self.on_since = now
+
+
+class Trace():
+    def __init__(self, times, lights, relays):
+        """
+        光センサーとバッテリーの時系列　各時刻の値は次の時刻まで続くとみなす
+        Args:
+            times  : datetimeのリスト（昇順）
+            lights : 5個の光センサーの状態のリスト
+            relays : (relay1, relay2)のリスト
+        """
+        self.times = times
+        self.lights = lights
+        self.relays = relays
+
+    def at(self, now, hint=0):
+        """
+        その時刻の値　hintから先を探すので、時刻の順に呼べば速い
+        """
+        i = bisect.bisect_right(self.times, now, lo=max(0, hint - 1)) - 1
+        i = max(i, 0)
+        return i, self.lights[i], self.relays[i]
+
+    @classmethod
+    def from_csv(cls, filename):
+        """
+        CSVから読む　列はdatetime,l1,l2,l3,l4,l5,relay1,relay2（datetimeは YYYY/MM/DD HH:MM[:SS]）
+        """
+        times, lights, relays = [], [], []
+        with open(filename, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                text = row["datetime"]
+                fmt = "%Y/%m/%d %H:%M:%S" if text.count(":") == 2 else "%Y/%m/%d %H:%M"
+                times.append(datetime.datetime.strptime(text, fmt))
+                lights.append([int(row[f"l{i}"]) for i in range(1, 6)])
+                relays.append((int(row["relay1"]), int(row["relay2"])))
+        return cls(times, lights, relays)
+
+    @classmethod
+    def synthetic(cls, start, days, seed=0, sun_times=simple_sun):
+        """
+        雲の出方を乱数で作った1分ごとの時系列　バッテリーは昼に充電され、夜に少しずつ減るものとする
+        （LEDの消費は入れていないので、バッテリーの色は制御によらない）
+        """
+        rng = random.Random(seed)
+        times, lights, relays = [], [], []
+        cloud = 0.5
+        charge = 0.6
+        for minute in range(days * 24 * 60):
+            now = start + datetime.timedelta(minutes=minute)
+            sunrise, sunset = sun_times(now.date())
+            if sunrise <= now < sunset:
+                sun = math.sin(math.pi * (now - sunrise).total_seconds() / (sunset - sunrise).total_seconds())
+            else:
+                sun = 0.0
+            cloud = min(1.0, max(0.0, cloud + rng.gauss(0, 0.03)))             # 雲はゆっくり変わる
+            level = sun * (1 - 0.8 * cloud)
+            lights.append([int(level + rng.gauss(0, 0.05) < 0.35) for _ in range(5)])   # 1が曇り
+            charge = min(1.0, max(0.0, charge + level * 0.0015 - 0.0004))
+            relays.append((int(charge > 0.3), int(charge > 0.7)))
+            times.append(now)
+        return cls(times, lights, relays)
+
+
+def replay(trace, params, sun_times=simple_sun):
+    """
+    時系列を再生して、設定ごとの点灯時間と切り替え回数を返す
+    判断するのは光センサーを読む時刻とモードが変わる時刻だけなので、1秒ごとに回すよりずっと速い
+    """
+    clock = SimClock(trace.times[0])
+    controller = LightController(params, clock=clock, sun_times=sun_times)
+    end = trace.times[-1]
+    index = 0
+    now = trace.times[0]
+    date = None
+    boundaries = []
+    while now <= end:
+        clock.now = now
+        index, lights, relays = trace.at(now, index)
+        controller.step(lights, *relays)
+        if now.date() != date:                              # 日が変わったらその日のモードの境目を入れる
+            date = now.date()
+            boundaries = sorted(b for b in controller.boundaries(date) if b > now)
+        while boundaries and boundaries[0] <= now:
+            boundaries.pop(0)
+        candidates = [controller.next_sensing]
+        if boundaries:
+            candidates.append(boundaries[0])
+        else:                                               # 翌日の境目を見落とさないように
+            candidates.append(datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time()))
+        now = min(candidates)
+    controller.finish(end)
+    days = max((end - trace.times[0]).total_seconds() / 86400, 1e-9)
+    return {"params": params,
+            "lighting_minutes": round(controller.on_minutes, 1),
+            "minutes_per_day": round(controller.on_minutes / days, 1),
+            "switches": controller.switches,
+            "switches_per_day": round(controller.switches / days, 2),
+            "battery_blocks": controller.battery_blocks,
+            }
+
+
+_trace = None                                               # プロセスプールの各プロセスで1回だけ受け取る時系列
+
+
+def _init_worker(trace):
+    global _trace
+    _trace = trace
+
+
+def _replay_worker(params):
+    return replay(_trace, params)
+
+
+def sweep(trace, grid, processes=None):
+    """
+    設定値の組み合わせをすべて再生する
+    Args:
+        trace     : Trace
+        grid      : {設定名: [値, ...]}　ここにない設定はDEFAULTS
+        processes : プロセス数（Noneならばコア数）
+    Returns:
+        組み合わせごとのreplayの結果のリスト
+    """
+    names = list(grid)
+    combos = [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+    if processes == 1:
+        return [replay(trace, params) for params in combos]
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(trace,)) as executor:
+        return list(executor.map(_replay_worker, combos, chunksize=max(1, len(combos) // 32)))
+
+
+def main():
+    import time
+    parser = argparse.ArgumentParser(description="LED制御の再生とパラメーターの比較")
+    parser.add_argument("--trace", help="記録した時系列のCSV（なければ乱数で作る）")
+    parser.add_argument("--days", type=int, default=30, help="作る時系列の日数")
+    parser.add_argument("--start", default="2024/04/01", help="作る時系列の開始日")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--grid", nargs="*", default=["sensing_count=2,3,4", "sensing_threshold=0.3,0.5,0.7"],
+                        help="設定名=値,値,... を並べる")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = Trace.from_csv(args.trace)
+    else:
+        trace = Trace.synthetic(datetime.datetime.strptime(args.start, "%Y/%m/%d"), args.days, args.seed)
+    grid = {}
+    for item in args.grid:
+        name, values = item.split("=")
+        grid[name] = [float(v) if "." in v else int(v) for v in values.split(",")]
+
+    start = time.perf_counter()
+    results = sweep(trace, grid, args.processes)
+    elapsed = time.perf_counter() - start
+    span = (trace.times[-1] - trace.times[0]).total_seconds()
+
+    names = list(grid)
+    print("  ".join(f"{name:>18}" for name in names) + f"{'点灯(分)':>10}{'1日あたり':>10}{'切替':>8}{'1日あたり':>10}{'電池不足':>8}")
+    for result in results:
+        print("  ".join(f"{result['params'][name]:>18}" for name in names) +
+              f"{result['lighting_minutes']:>12}{result['minutes_per_day']:>12}"
+              f"{result['switches']:>10}{result['switches_per_day']:>12}{result['battery_blocks']:>10}")
+    print(f"{len(results)}通り × {span / 86400:.0f}日分を{elapsed:.2f}秒で再生（実時間の{span * len(results) / elapsed:,.0f}倍）")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,212 @@
+import os
 import sqlite3
 import datetime
-import pandas as pd
 import random
+import atexit
+import threading
+import functools
+from collections import OrderedDict
+import myMetrics
+from myCompress import RowFilter
+
+# pandasは読み込みに時間がかかるので、DataFrameを返すメソッドの中で初めて使うときに読み込む
+
+CACHE_SIZE = 128                                                        # 読み取り結果を覚えておく数
+SNAPSHOT_INTERVAL = 300                                                 # メモリ上のDBをファイルに書き戻す間隔（秒）
+SYNC_BATCH = 5000                                                       # 中央サーバーに1回で送る行数の上限
+KEEP_TABLES = ("config", "sync", "sqlite_sequence")                     # deleteで消さないテーブル
+# 温湿度の間引き方と許容幅（方法は swinging_door・deadband・none）　設定に同じキーがあればそちらを使う
+COMPRESS_DEFAULTS = {"temperature_compress": "swinging_door", "temperature_tolerance": "0.5",
+                     "humidity_compress": "swinging_door", "humidity_tolerance": "1"}
+
+
+def cached(tables):
+    """
+    読み取りメソッドの結果を、メソッド名と引数ごとに覚えておくデコレーター
+    読んだテーブルの書き込み世代が変わっていれば読み直すので、古い結果を返すことはない
+    （世代はこのプロセスの書き込みでだけ進む）
+    Args:
+        tables : 読むテーブルのタプル　引数で決まるときは引数からタプルを返す関数
+    """
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            names = tables(*args, **kwargs) if callable(tables) else tables
+            today = datetime.date.today()                               # 日付の省略は今日なので、日付が変われば読み直す
+            version = (today,) + self.generation(*names)                # 読む前の世代　読んでいる間に書き込まれたら次は読み直す
+            key = (name, args, tuple(sorted(kwargs.items())))
+            with self.cache_lock:
+                entry = self.cache.get(key)
+                if entry is not None and entry[0] == version:
+                    self.cache.move_to_end(key)
+                    value = entry[1]
+                else:
+                    entry = None
+            if entry is None:
+                myMetrics.db_cache_misses.inc(name)
+                value = func(self, *args, **kwargs)
+                with self.cache_lock:
+                    self.cache[key] = (version, value)
+                    self.cache.move_to_end(key)
+                    while len(self.cache) > CACHE_SIZE:
+                        self.cache.popitem(last=False)
+            else:
+                myMetrics.db_cache_hits.inc(name)
+            if hasattr(value, "copy"):                                  # 呼び出し元が変更してもキャッシュが変わらないように
+                value = value.copy()
+            return value
+        return wrapper
+    return decorator
+
 
 class DB():
-    def __init__(self):
+    def __init__(self, memory=False, snapshot_interval=SNAPSHOT_INTERVAL):
         """
         初期設定
+        Args:
+            memory            : Trueならば起動時にagri.dbをメモリに読み込み、メモリ上のDBを使う
+                                SDカードに書くのはsnapshot_intervalごとと終了時だけになる
+                                （電源断のときは最大でsnapshot_interval秒分の書き込みを失う）
+            snapshot_interval : ファイルに書き戻す間隔（秒）
         """
         self.dbname = "agri.db"                                         # データベース名
+        self.memory = memory
+        self.snapshot_interval = snapshot_interval
+        if memory:
+            self._open_memory()
+        self.generations = {}                                           # テーブルごとの書き込み世代　書き込むたびに増える
+        self.generation_lock = threading.Lock()
+        self.cache = OrderedDict()                                      # 読み取り結果のキャッシュ　(メソッド名, 引数) -> (世代, 結果)
+        self.cache_lock = threading.Lock()
+        self.temperature_filter = None                                  # 温湿度の間引き　設定を読んだときに作る
+        self.filter_settings = None                                     # temperature_filterを作ったときの設定
+        self.filter_lock = threading.Lock()
+        self.tail_rowid = None                                          # 温湿度の仮の点（最新の読み取り）の行
+        self.tail_date = None                                           # 仮の点の日付
+        self.tail_extremes = None                                       # 仮の点の日の読み取りの(最高, 最低)　置き換えた読み取りも含む
+        self.create_tables()                                            # 後から追加したテーブルを作る
         self.get_config()                                               # 設定データを読み込む
 
+    def _open_memory(self):
+        """
+        agri.dbをメモリ上のDBに読み込み、書き戻すスレッドを動かす
+        """
+        self.memory_uri = "file:/agri?vfs=memdb"                       # 同じプロセスの接続で共有できるメモリ上のDB
+        try:
+            self.keeper = sqlite3.connect(self.memory_uri, uri=True, check_same_thread=False)
+        except sqlite3.OperationalError:                                # memdbのないSQLiteでは共有キャッシュを使う
+            self.memory_uri = "file:agri?mode=memory&cache=shared"
+            self.keeper = sqlite3.connect(self.memory_uri, uri=True, check_same_thread=False)
+        disk = sqlite3.connect(self.dbname)
+        disk.backup(self.keeper)                                        # オンラインバックアップでファイルからメモリへ
+        disk.close()
+        with open(memory_owner_file(self.dbname), mode="w") as f:       # 別のプロセスが書いても書き戻しで消えることを知らせる
+            f.write(str(os.getpid()))
+        self.snapshot_lock = threading.Lock()
+        self.snapshot_generations = {}                                  # 最後に書き戻したときの世代
+        self.snapshot_stop = threading.Event()
+        self.snapshot_thread = threading.Thread(target=self._snapshot_loop, name="db-snapshot", daemon=True)
+        self.snapshot_thread.start()
+        atexit.register(self.close)
+
+    def _snapshot_loop(self):
+        while not self.snapshot_stop.wait(self.snapshot_interval):
+            try:
+                self.snapshot()
+            except sqlite3.Error as e:                                  # 次の回にまたやり直す
+                print(f"DBの書き戻しに失敗しました: {e}")
+
+    def _connect(self):
+        """
+        DBに接続する　メモリ上のDBを使うときはそちらに接続する
+        """
+        if self.memory:
+            return sqlite3.connect(self.memory_uri, uri=True)
+        return sqlite3.connect(self.dbname)
+
+    def snapshot(self, force=False):
+        """
+        メモリ上のDBをagri.dbに書き戻す　前回から書き込みがなければ何もしない
+        Returns:
+            書き戻したかどうか
+        """
+        if not self.memory:
+            return False
+        with self.snapshot_lock:
+            generations = dict(self.generations)
+            if not force and generations == self.snapshot_generations:
+                return False
+            disk = sqlite3.connect(self.dbname)
+            self.keeper.backup(disk)                                    # 1つのトランザクションで書くので、途中で止まっても元のファイルは壊れない
+            disk.close()
+            self.snapshot_generations = generations
+            return True
+
+    def close(self):
+        """
+        書き戻しのスレッドを止めて、最後にもう一度書き戻す
+        """
+        if not self.memory or self.snapshot_stop.is_set():
+            return
+        self.snapshot_stop.set()
+        self.snapshot()
+        try:
+            os.remove(memory_owner_file(self.dbname))
+        except FileNotFoundError:
+            pass
+
+    def bump(self, *tables):
+        """
+        テーブルの書き込み世代を進める
+        """
+        with self.generation_lock:
+            for table in tables:
+                self.generations[table] = self.generations.get(table, 0) + 1
+
+    def generation(self, *tables):
+        """
+        テーブルの書き込み世代を返す　読み取り結果のキャッシュのバージョンとして使う
+        """
+        return tuple(self.generations.get(table, 0) for table in tables)
+
+    def create_tables(self):
+        """
+        後から追加したテーブルがなければ作成する
+        """
+        conn = self._connect()
+        cur = conn.cursor()
+        sql = "CREATE TABLE IF NOT EXISTS battery(date TEXT, datetime TEXT, relay1 INTEGER, relay2 INTEGER, volt REAL)"
+        cur.execute(sql)
+        sql = "CREATE TABLE IF NOT EXISTS sync(name TEXT PRIMARY KEY, value TEXT)"     # 中央サーバーへ送り済みの位置
+        cur.execute(sql)
+        # 書き換えたサマリーの日付　書き換えるたびに番号が進むので、中央サーバーへ送った番号より後を送り直す
+        is_new = cur.execute("SELECT 1 FROM sqlite_master WHERE name='summary_changes'").fetchone() is None
+        sql = "CREATE TABLE IF NOT EXISTS summary_changes(seq INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT UNIQUE)"
+        cur.execute(sql)
+        if is_new:                                                      # 作ったときは、今あるサマリーを全部送る対象にする
+            cur.execute("INSERT OR IGNORE INTO summary_changes(date) SELECT date FROM summary ORDER BY date")
+        conn.commit()
+        cur.close()
+        conn.close()
+
     def get_config(self):
         """
         設定データを取得する
         """
-        conn = sqlite3.connect(self.dbname)
+        conn = self._connect()
         sql = f"SELECT * FROM config"
-        df = pd.read_sql_query(sql, conn)                               # sql実行しpandas形式で格納する
+        rows = conn.execute(sql).fetchall()                             # (index, value)のリスト
         conn.close()
-        df = df.set_index("index")                                      # index列をインデックスに設定する
         dict = {}
-        for index, row in df.iterrows():                                # dataframeを辞書にする
-            dict[index] = row["value"]
+        for index, value in rows:                                       # 辞書にする
+            dict[index] = value
         # 辞書の中でよく使う値を変数として設定する
         self.sunlight_from =  dict["sunlight_from"]                     # LED点灯時間累計の始点
         self.temperature_from =  dict["temperature_from"]               # 温度累計の始点
+        self.profile_mode = dict.get("isProfile", "0")                  # "1"=全リクエスト "header"=ヘッダー付きだけ "0"=しない
+        self.set_filter(dict)
         self.ephem_config = {   "place": dict["place"],
                                 "lat": dict["lat"],
                                 "lon": dict["lon"],
@@ -38,27 +219,60 @@ class DB():
         """
         設定データを書き込む
         """
-        df = pd.DataFrame(index=[], columns=["index", "value"])         # 空のデータフレームを用意する
-        for key, value in dict.items():                                 # 辞書をデータフレームにする
-            df.loc[key] = [key, value]
-        conn = sqlite3.connect(self.dbname)
+        conn = self._connect()
         cur = conn.cursor()
-        df.to_sql("config", conn, if_exists="replace", index=None)      # dfをデータベースに書き込む
+        cur.execute("DELETE FROM config")                               # 全部入れ替える
+        sql = "INSERT INTO config VALUES(?, ?)"
+        cur.executemany(sql, [(key, str(value)) for key, value in dict.items()])
+        conn.commit()
+        cur.close()
+        conn.close()
+        self.bump("config")
+        self.get_config()                                               # よく使う値を更新する
+
+
+    def set_config_value(self, key, value):
+        """
+        設定を1つだけ書き込む（サーバーが覚えた値を残すときなど）　他の設定はそのまま
+        """
+        conn = self._connect()
+        cur = conn.cursor()
+        cur.execute('DELETE FROM config WHERE "index" = ?', (key,))
+        cur.execute("INSERT INTO config VALUES(?, ?)", (key, str(value)))
+        conn.commit()
         cur.close()
         conn.close()
+        self.bump("config")
+
+
+    def set_filter(self, config):
+        """
+        設定から温湿度の間引き方を決める　設定が変わったときだけ作り直す
+        """
+        settings = {}
+        for column in ("temperature", "humidity"):
+            method = config.get(f"{column}_compress", COMPRESS_DEFAULTS[f"{column}_compress"])
+            tolerance = float(config.get(f"{column}_tolerance", COMPRESS_DEFAULTS[f"{column}_tolerance"]))
+            settings[column] = (method, tolerance)
+        with self.filter_lock:
+            if settings != self.filter_settings:
+                self.filter_settings = settings
+                if all(method == "none" for method, _ in settings.values()):
+                    self.temperature_filter = None
+                else:
+                    self.temperature_filter = RowFilter(settings)
+                self.tail_rowid = None                                  # 今の仮の点は確定として扱う
 
 
     def set_temperature(self, temp, humi, dt=None):
         """
         温湿度をデータベースに登録する
+        間引く設定ならば、許容幅に収まる読み取りは新しい行にせず、最新の読み取りの行（仮の点）を置き換える
         Args:
             temp: 温度
             humi: 湿度
             dt  : 日時（文字列） 未指定ならば今
         """
-        conn = sqlite3.connect(self.dbname)
-        cur = conn.cursor()
-
         if dt is None:                                                  # 日時がNoneだったら
             dt = datetime.datetime.now()                                # 現在時刻
             strdt = dt.strftime("%Y/%m/%d %H:%M")                       # 日時の文字列
@@ -67,25 +281,57 @@ class DB():
             strdt = dt                                                  # それが日時の文字列
             strdate = dt.split(" ")[0]                                  # スペースで区切った最初のほうが日付
 
-        sql = f"INSERT INTO temperature VALUES('{strdate}','{strdt}', {temp}, {humi})"
-        cur.execute(sql)
-        conn.commit()
-        cur.close()
-        conn.close()
-        self.set_summary(strdate)                                       # その日のサマリーデータを更新する
+        with self.filter_lock:                                          # 仮の点の置き換えが重ならないように
+            action = "insert"
+            if self.temperature_filter is not None:
+                if strdate != self.tail_date:                           # 日をまたいで仮の点を動かさない
+                    self.temperature_filter.reset()
+                    self.tail_extremes = None
+                if self.tail_extremes is None:
+                    self.tail_extremes = (float(temp), float(temp))
+                else:
+                    self.tail_extremes = (max(self.tail_extremes[0], float(temp)), min(self.tail_extremes[1], float(temp)))
+                t = datetime.datetime.strptime(strdt[:16], "%Y/%m/%d %H:%M").timestamp()
+                action = self.temperature_filter.offer(t, {"temperature": float(temp), "humidity": float(humi)})
+            conn = self._connect()
+            cur = conn.cursor()
+            if action == "update" and self.tail_rowid is not None:
+                sql = "UPDATE temperature SET date=?, datetime=?, temperature=?, humidity=? WHERE rowid=?"
+                cur.execute(sql, (strdate, strdt, temp, humi, self.tail_rowid))
+                if cur.rowcount == 0:                                   # 仮の点が消されていたら追加する
+                    action = "insert"
+            else:
+                action = "insert"
+            if action == "insert":
+                sql = f"INSERT INTO temperature VALUES('{strdate}','{strdt}', {temp}, {humi})"
+                cur.execute(sql)
+                self.tail_rowid = cur.lastrowid
+                myMetrics.db_rows_written.inc("temperature", cur.rowcount)
+            self.tail_date = strdate
+            extremes = self.tail_extremes if self.temperature_filter is not None else None
+            conn.commit()
+            cur.close()
+            conn.close()
+        self.bump("temperature")
+        # 仮の点を置き換えたときも更新する　置き換えて消えた読み取りの最高・最低も入れる
+        self.set_summary(strdate, extremes)                             # その日のサマリーデータを更新する
 
 
-    def set_summary(self, date):
+    def set_summary(self, date, extremes=None):
         """
         サマリーデータを登録する
         Args:
-            date: 日付（文字列）
+            date     : 日付（文字列）
+            extremes : DBに残っていない読み取りも含めたその日の(最高気温, 最低気温)　間引いたときに渡す
         """
-        conn = sqlite3.connect(self.dbname)
+        conn = self._connect()
         cur = conn.cursor()
         df = self.get_temperature(date)                                 # 指定した日の温湿度データを取得する
         max_temp = df["temperature"].max()                              # その日の最高気温
         min_temp = df["temperature"].min()                              # その日の最低気温
+        if extremes is not None:
+            max_temp = max(max_temp, extremes[0])
+            min_temp = min(min_temp, extremes[1])
         mean_temp = (max_temp+min_temp)/2                               # 最高気温と最低気温の中間
 
         df = self.get_LED(date)                                         # 指定した日のLEDデータを取得する
@@ -100,11 +346,23 @@ class DB():
                     f"SET max_temp={max_temp}, min_temp={min_temp}, mean_temp={mean_temp}, lighting_minutes={lighting_minutes} "\
                     f"WHERE date='{date}'"
         cur.execute(sql)
+        self.summary_changed(cur, [date])
         conn.commit()
+        myMetrics.db_rows_written.inc("summary", cur.rowcount)
+        self.bump("summary")
         cur.close()
         conn.close()
 
 
+    def summary_changed(self, cur, dates):
+        """
+        サマリーを書き換えた日付を記録する（書き換えと同じトランザクションで呼ぶ）
+        過去の日を後から書き換えても（取り込み・計算し直し）、中央サーバーへ送り直せるようにする
+        """
+        cur.executemany("INSERT OR REPLACE INTO summary_changes(date) VALUES(?)", [(date,) for date in dates])
+
+
+    @cached(("temperature",))
     def get_temperature(self, date):
         """
         データベースから指定した日の温湿度データを取り出す
@@ -113,7 +371,8 @@ class DB():
         Returns:
             df   : dataframe
         """
-        conn = sqlite3.connect(self.dbname)
+        import pandas as pd                                             # 初めて使うときに読み込む
+        conn = self._connect()
         if date is None:                                                # 日付がNoneだったら
             date = datetime.date.today().strftime("%Y/%m/%d")           # 今日の文字列
 
@@ -124,6 +383,7 @@ class DB():
         return df
 
 
+    @cached(("LED",))
     def get_LED(self, date):
         """
         データベースから指定した日のLEDデータを取り出す
@@ -132,7 +392,8 @@ class DB():
         Returns:
             df   : dataframe
         """
-        conn = sqlite3.connect(self.dbname)
+        import pandas as pd                                             # 初めて使うときに読み込む
+        conn = self._connect()
         if date is None:                                                # 日付がNoneだったら
             date = datetime.date.today().strftime("%Y/%m/%d")           # 今日の文字列
 
@@ -141,15 +402,37 @@ class DB():
         conn.close()
         return df
 
+    @cached(("summary",))
     def get_summary(self, sunlight_from, temperature_from, date=None, days=7):
         """
-        温度データのまとめデータを取得する
+        温度データのまとめデータを日付ごとの辞書として取得する
+        Args:
+            get_summary_tableと同じ
+        """
+        df = self.get_summary_table(sunlight_from, temperature_from, date, days)
+        dates = df.index.tolist()                                       # インデックス（日付）のリスト
+        dict = {}
+        for d in dates:                                                 # 各日付において
+            dict[d] = { "max_temp": df.at[d, "max_temp"],
+                        "min_temp": df.at[d, "min_temp"],
+                        "mean_temp": df.at[d, "mean_temp"],
+                        "lighting_minutes": df.at[d, "lighting_minutes"],
+                        "lighting_minutes_sum": df.at[d, "lighting_minutes_sum"],
+                        "mean_temp_sum": df.at[d, "mean_temp_sum"],
+                        }                                               # 日ごとの辞書として登録する
+        return dict
+
+    @cached(("summary",))
+    def get_summary_table(self, sunlight_from, temperature_from, date=None, days=7):
+        """
+        温度データのまとめデータを累計付きのdataframeとして取得する
         Args:
             sunlight_from: LED点灯時間の累計の始点
             temperature_from: 温度の累計の始点
             date_to: 日付（文字列）未指定ならば今日
             days   : 何日前までか
         """
+        import pandas as pd                                             # 初めて使うときに読み込む
         if date is None:                                                # 日付がNoneだったら
             date = datetime.date.today()                                # 今日（datetime型）
         else:                                                           # 日付が文字列として与えられていたら
@@ -158,7 +441,7 @@ class DB():
         date_from = date - datetime.timedelta(days = days-1)            # 何日前（datetime型）
         date_from = date_from.strftime("%Y/%m/%d")                      # datetime型を文字列にする
         date_to = date.strftime("%Y/%m/%d")                             # datetime型を文字列にする
-        conn = sqlite3.connect(self.dbname)
+        conn = self._connect()
 
         sql = f"SELECT date, lighting_minutes FROM summary WHERE date BETWEEN '{sunlight_from}' AND '{date_to}'"
         df_sunlight = pd.read_sql_query(sql, conn)                      # LED点灯時間のみのデータフレーム
@@ -179,18 +462,9 @@ class DB():
 
         df = df.join(df_sunlight, how="left")                           # サマリーにLED点灯時間累計データをジョインする
         df = df.join(df_temp, how="left")                               # サマリーに温度累計データをジョインする
-        dates = df.index.tolist()                                       # インデックス（日付）のリスト
-        dict = {}
-        for d in dates:                                                 # 各日付において
-            dict[d] = { "max_temp": df.at[d, "max_temp"],
-                        "min_temp": df.at[d, "min_temp"],
-                        "mean_temp": df.at[d, "mean_temp"],
-                        "lighting_minutes": df.at[d, "lighting_minutes"],
-                        "lighting_minutes_sum": df.at[d, "lighting_minutes_sum"],
-                        "mean_temp_sum": df.at[d, "mean_temp_sum"],
-                        }                                               # 日ごとの辞書として登録する
-        return dict
+        return df
 
+    @cached(lambda table: (table,))
     def get_latest_date(self, table):
         """
         テーブルの最新日付を取得する
@@ -199,7 +473,7 @@ class DB():
         Returns:
             date: 日付（文字列） データがない場合はNone
         """
-        conn = sqlite3.connect(self.dbname)
+        conn = self._connect()
         cur = conn.cursor()
         sql = f"SELECT MAX(date) FROM {table}"
         cur.execute(sql)
@@ -217,7 +491,7 @@ class DB():
             minute : 時間（分）
             _      : 登録日時指定不可（今を点灯終了時刻とする）
         """
-        conn = sqlite3.connect(self.dbname)
+        conn = self._connect()
         cur = conn.cursor()
         now = datetime.datetime.now()                                   # 今
         date = now.strftime("%Y/%m/%d")                                 # 日付
@@ -227,19 +501,65 @@ class DB():
         print(sql)
         cur.execute(sql)
         conn.commit()
+        myMetrics.db_rows_written.inc("LED", cur.rowcount)
+        self.bump("LED")
         cur.close()
         conn.close()
 
 
+    def set_battery(self, relay1, relay2, volt=None, dt=None):
+        """
+        バッテリーの状態をデータベースに登録する
+        Args:
+            relay1, relay2 : 電圧リレーの状態
+            volt           : 電圧（なければNone）
+            dt             : 日時（datetime） 未指定ならば今
+        """
+        if dt is None:                                                  # 日時がNoneだったら
+            dt = datetime.datetime.now()                                # 現在時刻
+        strdt = dt.strftime("%Y/%m/%d %H:%M:%S")                        # 日時の文字列
+        strdate = dt.strftime("%Y/%m/%d")                               # 日付の文字列
+        conn = self._connect()
+        cur = conn.cursor()
+        sql = "INSERT INTO battery VALUES(?, ?, ?, ?, ?)"
+        cur.execute(sql, (strdate, strdt, int(relay1), int(relay2), volt))
+        conn.commit()
+        myMetrics.db_rows_written.inc("battery", cur.rowcount)
+        self.bump("battery")
+        cur.close()
+        conn.close()
+
+
+    @cached(("battery",))
+    def get_battery(self, date=None):
+        """
+        データベースから指定した日のバッテリーデータを取り出す
+        Args:
+            date : 日付（文字列）Noneならば今日
+        Returns:
+            df   : dataframe
+        """
+        import pandas as pd                                             # 初めて使うときに読み込む
+        if date is None:                                                # 日付がNoneだったら
+            date = datetime.date.today().strftime("%Y/%m/%d")           # 今日の文字列
+        conn = self._connect()
+        sql = f"SELECT * FROM battery WHERE date='{date}'"
+        df = pd.read_sql_query(sql, conn)                               # sql実行しpandas形式で格納する
+        conn.close()
+        return df
+
+
+    @cached(("LED",))
     def getLED(self, date=None):
         """
         LEDデータを取得する
         Args:
             date: 日付（文字列）Noneならば今日
         """
+        import pandas as pd                                             # 初めて使うときに読み込む
         if date is None:                                                # 日付がNoneだったら
             date = datetime.date.today().strftime("%Y/%m/%d")           # 今日の文字列
-        conn = sqlite3.connect(self.dbname)
+        conn = self._connect()
         cur = conn.cursor()
         sql = f"SELECT * FROM LED WHERE date='{date}'"
         df = pd.read_sql_query(sql, conn)                               # sql実行しpandas形式で格納する
@@ -248,6 +568,35 @@ class DB():
         return df
 
 
+    @cached(lambda table, datetime_from, datetime_to: (table,))
+    def get_history(self, table, datetime_from, datetime_to):
+        """
+        終点が過去の期間の時系列データを取り出す　同じ期間をまた読むことが多いのでキャッシュする
+        終点が「今」の期間は毎回違う引数になりキャッシュを埋めてしまうので、read_historyで読む
+        """
+        return self.read_history(table, datetime_from, datetime_to)
+
+
+    def read_history(self, table, datetime_from, datetime_to):
+        """
+        指定した期間の時系列データを取り出す
+        Args:
+            table         : テーブル temperature・battery・LED
+            datetime_from : 始点の日時（文字列）
+            datetime_to   : 終点の日時（文字列）
+        Returns:
+            df   : datetime列を日時に変換したdataframe
+        """
+        import pandas as pd                                             # 初めて使うときに読み込む
+        column = "datetime_to" if table == "LED" else "datetime"        # LEDは点灯終了時刻を時刻とする
+        conn = self._connect()
+        sql = f"SELECT * FROM {table} WHERE {column} BETWEEN ? AND ? ORDER BY {column}"
+        df = pd.read_sql_query(sql, conn, params=(datetime_from, datetime_to))
+        conn.close()
+        df["datetime"] = pd.to_datetime(df[column])                     # 文字列の日時をdatetimeに変換する
+        return df
+
+
     def toCSV(self, table, date=None, days=0):
         """
         DBをcsvとして保存する
@@ -256,7 +605,8 @@ class DB():
             date  : 日付（テキスト）
             days  : dateから何日前まで
         """        
-        conn = sqlite3.connect(self.dbname)
+        import pandas as pd                                             # 初めて使うときに読み込む
+        conn = self._connect()
         if date is None:                                                # 日付がNoneだったら
             date = datetime.date.today()                                # 今日まで
         else:                                                           # 日付が文字列として与えられていたら
@@ -283,7 +633,7 @@ class DB():
         moon_phase = dict["moon_phase"]
         latest_summary_data = self.get_latest_date("summary")           # サマリーの最新日付
         if latest_summary_data != date:                                 # 今日のデータがなければ挿入する
-            conn = sqlite3.connect(self.dbname)
+            conn = self._connect()
             cur = conn.cursor()
             sql = f"INSERT INTO summary(date, sunrise_time, sunset_time, moon_phase) "\
                     f"VALUES('{date}','{sunrise_time}', '{sunset_time}', '{moon_phase}')"
@@ -291,19 +641,200 @@ class DB():
             print(sql)
             print("="*100)
             cur.execute(sql)
+            self.summary_changed(cur, [date])
             conn.commit()
+            myMetrics.db_rows_written.inc("summary", cur.rowcount)
+            self.bump("summary")
             cur.close()
             conn.close()
         else:                                                           # データがあれば何もしない
             pass
     
+    def import_rows(self, table, columns, chunks, key):
+        """
+        大量の行を1つのトランザクションでまとめて追加する　すでに同じキーの行があるものは飛ばす
+        サマリーは更新しないので、終わってからrebuild_summaryを1回呼ぶ
+        Args:
+            table   : テーブル
+            columns : 列名のリスト（dateを含むこと）
+            chunks  : 行のリストを順に返すイテレーター
+            key     : 重複を判定する列名
+        Returns:
+            inserted : 追加した行数
+            skipped  : 重複していた行数
+            dates    : 取り込んだ行（重複していた行も含む）の日付の集合
+                       前回の取り込みが途中で止まっていても、やり直せばその日のサマリーを計算し直せる
+        """
+        date_index = columns.index("date")
+        key_index = columns.index(key)
+        sql = f"INSERT INTO {table}({', '.join(columns)}) VALUES({', '.join('?' * len(columns))})"
+        inserted = 0
+        skipped = 0
+        dates = set()
+        conn = self._connect()
+        try:
+            for rows in chunks:
+                if not rows:
+                    continue
+                chunk_dates = [row[date_index] for row in rows]
+                existing = {r[0] for r in conn.execute(f"SELECT {key} FROM {table} WHERE date BETWEEN ? AND ?",
+                                                       (min(chunk_dates), max(chunk_dates)))}
+                new_rows = []
+                for row in rows:
+                    if row[key_index] in existing:
+                        skipped += 1
+                    else:
+                        existing.add(row[key_index])
+                        new_rows.append(row)
+                conn.executemany(sql, new_rows)
+                inserted += len(new_rows)
+                dates.update(chunk_dates)
+            conn.commit()
+        finally:
+            conn.close()
+        myMetrics.db_rows_written.inc(table, inserted)
+        self.bump(table)
+        return inserted, skipped, dates
+
+    def upsert_summary(self, columns, rows):
+        """
+        サマリーを日付ごとにまとめて書き込む　その日の行があれば与えられた列だけ上書きし、なければ追加する
+        Args:
+            columns : 列名のリスト（dateを含むこと）
+            rows    : 行のリスト
+        Returns:
+            書き込んだ行数
+        """
+        date_index = columns.index("date")
+        others = [c for c in columns if c != "date"]
+        conn = self._connect()
+        try:
+            existing = {r[0] for r in conn.execute("SELECT date FROM summary")}
+            updates = [[row[columns.index(c)] for c in others] + [row[date_index]] for row in rows
+                       if row[date_index] in existing]
+            inserts = [row for row in rows if row[date_index] not in existing]
+            if updates and others:
+                conn.executemany(f"UPDATE summary SET {', '.join(f'{c}=?' for c in others)} WHERE date=?", updates)
+            conn.executemany(f"INSERT INTO summary({', '.join(columns)}) VALUES({', '.join('?' * len(columns))})",
+                             inserts)
+            self.summary_changed(conn, [row[date_index] for row in rows])
+            conn.commit()
+        finally:
+            conn.close()
+        myMetrics.db_rows_written.inc("summary", len(rows))
+        self.bump("summary")
+        return len(rows)
+
+    def rebuild_summary(self, dates):
+        """
+        指定した日のサマリーの気温と点灯時間を、温湿度とLEDのテーブルからまとめて計算し直す
+        set_summaryを1日ずつ呼ぶ代わりに、集計のSQLを1回だけ実行する
+        Args:
+            dates : 日付（文字列）の集合
+        Returns:
+            計算し直した日数
+        """
+        dates = sorted(dates)
+        if not dates:
+            return 0
+        conn = self._connect()
+        try:
+            temps = dict((d, (mx, mn)) for d, mx, mn in conn.execute(
+                "SELECT date, MAX(temperature), MIN(temperature) FROM temperature "
+                "WHERE date BETWEEN ? AND ? AND temperature IS NOT NULL GROUP BY date",    # 空欄・nanの行だけの日は気温を書かない
+                (dates[0], dates[-1])))
+            minutes = dict(conn.execute("SELECT date, SUM(minute) FROM LED "
+                                        "WHERE date BETWEEN ? AND ? AND minute IS NOT NULL GROUP BY date",
+                                        (dates[0], dates[-1])))
+        finally:
+            conn.close()
+        groups = {}                                                     # データのある列の組み合わせ -> 行のリスト
+        for date in dates:                                              # データのない列は上書きしない
+            columns = ["date"]
+            row = [date]
+            if date in temps:
+                max_temp, min_temp = temps[date]
+                columns += ["max_temp", "min_temp", "mean_temp"]
+                row += [max_temp, min_temp, (max_temp + min_temp) / 2]  # 最高気温と最低気温の中間
+            if date in minutes:
+                columns.append("lighting_minutes")
+                row.append(minutes[date])
+            groups.setdefault(tuple(columns), []).append(row)
+        for columns, rows in groups.items():
+            if len(columns) > 1:
+                self.upsert_summary(list(columns), rows)
+        return len(dates)
+
+    def get_delta(self, table, after=0, limit=SYNC_BATCH):
+        """
+        rowidがafterより後の行を取り出す
+        rowidの順にたどるので、テーブルの大きさによらず新しい行の数だけの時間で済む
+        温湿度を間引いているときは、まだ置き換わる仮の点（tail_rowid）とその後は取り出さない
+        Args:
+            table : テーブル
+            after : 送り済みの最後のrowid
+            limit : 取り出す行数の上限
+        Returns:
+            columns : 列名のリスト
+            rows    : 行のリスト
+            last    : 取り出した最後の行のrowid（新しい行がなければafter）
+        """
+        upto = -1                                                       # これより前のrowidだけ　-1は制限なし
+        with self.filter_lock:
+            if table == "temperature" and self.temperature_filter is not None and self.tail_rowid is not None:
+                upto = self.tail_rowid
+        conn = self._connect()
+        cur = conn.execute(f"SELECT rowid, * FROM {table} WHERE rowid > ? AND (? < 0 OR rowid < ?) "
+                           f"ORDER BY rowid LIMIT ?", (after, upto, upto, limit))
+        columns = [d[0] for d in cur.description][1:]
+        rows = cur.fetchall()
+        conn.close()
+        last = rows[-1][0] if rows else after
+        return columns, [list(row[1:]) for row in rows], last
+
+    def get_summary_changes(self, after=0, limit=SYNC_BATCH):
+        """
+        書き換えの番号がafterより後のサマリーを取り出す
+        サマリーは同じ日の行が何度も書き換わるので、rowidではなく書き換えた順の番号（summary_changes）でたどる
+        Returns:
+            columns, rows, last : get_deltaと同じ（lastは取り出した最後の書き換えの番号）
+        """
+        conn = self._connect()
+        cur = conn.execute("SELECT c.seq, s.* FROM summary_changes c JOIN summary s ON s.date = c.date "
+                           "WHERE c.seq > ? ORDER BY c.seq LIMIT ?", (after, limit))
+        columns = [d[0] for d in cur.description][1:]
+        rows = cur.fetchall()
+        conn.close()
+        last = rows[-1][0] if rows else after
+        return columns, [list(row[1:]) for row in rows], last
+
+    def get_sync_marks(self):
+        """
+        中央サーバーへ送り済みの位置　{テーブル名: 最後のrowid（サマリーは日付）}
+        """
+        conn = self._connect()
+        rows = conn.execute("SELECT name, value FROM sync").fetchall()
+        conn.close()
+        return dict(rows)
+
+    def set_sync_marks(self, marks):
+        """
+        送り済みの位置を進める
+        """
+        conn = self._connect()
+        conn.executemany("INSERT INTO sync VALUES(?, ?) ON CONFLICT(name) DO UPDATE SET value=excluded.value",
+                         [(name, str(value)) for name, value in marks.items()])
+        conn.commit()
+        conn.close()
+        self.bump("sync")                                               # 書き戻しが送り済みの位置を取りこぼさないように
+
     def delete(self, date_from):
         """
         指定した日以前のデータベースを削除する
         Args:
             date_from : 日付（文字列）
         """
-        conn = sqlite3.connect(self.dbname)
+        conn = self._connect()
         cur = conn.cursor()
         sql = "SELECT name FROM sqlite_master WHERE type='table'"       # DB内の全テーブル取得するSQL
         cur.execute(sql)
@@ -311,18 +842,69 @@ class DB():
         tables = [table[0] for table in tables]                         # タプルのリストを単純なリストにする
 
         for table in tables:                                            # 各テーブルにおいて
-            if table != "config":                                       # configでなかったら
+            if table not in KEEP_TABLES:                                # configなどでなかったら
                 sql = f"DELETE FROM {table} WHERE date<='{date_from}'"  # データ削除するSQL
                 print(sql)
                 cur.execute(sql)
+        # 最後の行まで消えるとrowidが小さい番号から振り直されるので、送り済みの位置も戻す
+        for name, value in cur.execute("SELECT name, value FROM sync").fetchall():
+            if name in tables and name not in ("summary", "summary_changes"):
+                max_rowid = cur.execute(f"SELECT IFNULL(MAX(rowid), 0) FROM {name}").fetchone()[0]
+                if int(value) > max_rowid:
+                    cur.execute("UPDATE sync SET value=? WHERE name=?", (str(max_rowid), name))
         conn.commit()
         cur.close()
         conn.close()
+        self.bump("sync", *[table for table in tables if table not in KEEP_TABLES])     # 送り済みの位置も戻したかもしれない
+
+
+def memory_owner_file(dbname):
+    return dbname + ".memory"
+
+
+def memory_owner(dbname="agri.db"):
+    """
+    dbnameをメモリに読み込んで動いているサーバーのpid　なければNone
+    そのサーバーは自分のメモリの内容で定期的にファイルを上書きするので、他のプロセスからの書き込みは消える
+    """
+    try:
+        with open(memory_owner_file(dbname)) as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+    except (FileNotFoundError, ValueError, ProcessLookupError):
+        return None
+    except PermissionError:                                             # 別のユーザーで動いている
+        pass
+    return pid
+
+
+_db = None
+_db_lock = threading.Lock()
+_db_options = {}                                                        # get_dbで作るときのDBの引数
+
+
+def configure(**options):
+    """
+    get_dbで作るDBの引数を指定する（serve.pyから、最初のリクエストより前に呼ぶ）
+    """
+    _db_options.update(options)
+
+
+def get_db():
+    """
+    データベースのクラスをプロセスで1つだけ、初めて使うときに作る
+    """
+    global _db
+    with _db_lock:
+        if _db is None:
+            _db = DB(**_db_options)
+        return _db
 
 
-db = DB()
+myMetrics.instrument(DB, myMetrics.db_seconds)                         # 全メソッドの所要時間を記録する
 
 def main():
+    db = DB()
     """
     # 温湿度のデモ
     sunlight_from = "2023/11/15"
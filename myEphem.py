@@ -4,6 +4,7 @@ import numpy as np
 import cv2
 import math
 import base64
+from myMetrics import timed, ephem_seconds
 
 class Ephem():
     def __init__(self, dict, isB64=True):
@@ -19,6 +20,7 @@ class Ephem():
         self.observer.elev = elev
 
 
+    @timed(ephem_seconds, "get_data")
     def get_data(self):
         dt = datetime.date.today()              # ローカル日付
         tz = datetime.timedelta(hours=+9)       # 日本とUTCの時差
@@ -42,6 +44,7 @@ class Ephem():
     def epdate2str(self, epdate):
         return (epdate)
 
+    @timed(ephem_seconds, "draw_moon")
     def draw_moon(self, age, isB64):
         TRANS = (0,0,0,0)                                       # 透明色
         YELLOW = (100,255,255,255)                              # 黄色
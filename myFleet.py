@@ -0,0 +1,221 @@
+import io
+import os
+import re
+import gzip
+import json
+import sqlite3
+import threading
+import myMetrics
+
+# 複数のハウスのコントローラーからデータを集める中央サーバー
+# ハウス（サイト）ごとに別のSQLiteファイルに分けて保存し、サマリーだけは全サイト分を1つの索引DBにまとめる
+# 同じサイト・同じ時刻のデータは何度送られても1件だけ残す
+
+FLEET_DIR = "fleet"                                         # 保存先
+SITE_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")         # サイト名に使える文字（ファイル名になる）
+MAX_BODY = 32 * 1024 * 1024                                 # 展開後の1回のアップロードの上限（バイト）
+
+# テーブルごとの列と、重複を判定するキー
+TABLES = {"temperature": (["date", "datetime", "temperature", "humidity"], ["datetime"]),
+          "LED": (["date", "datetime_from", "datetime_to", "minute"], ["datetime_to"]),
+          "contec": (["date", "datetime", "rawdata"], ["datetime"]),
+          "battery": (["date", "datetime", "relay1", "relay2", "volt"], ["datetime"]),
+          }
+SUMMARY_COLUMNS = ["date", "sunrise_time", "sunset_time", "moon_phase",
+                   "lighting_minutes", "max_temp", "min_temp", "mean_temp"]
+
+
+class FleetError(Exception):
+    """
+    アップロードの内容が正しくない
+    """
+    pass
+
+
+class FleetStore():
+    def __init__(self, directory=FLEET_DIR):
+        """
+        サイトごとのDBと、全サイトのサマリーの索引DBを管理するクラス
+        Args:
+            directory : 保存先
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index_name = os.path.join(directory, "index.db")
+        self.lock = threading.Lock()
+        self.site_locks = {}                                # サイトごとの書き込みロック
+        self.sites = set()                                  # テーブルを作成済みのサイト
+        conn = self.connect(self.index_name)
+        conn.execute("CREATE TABLE IF NOT EXISTS summary(site TEXT, " +
+                     ", ".join(SUMMARY_COLUMNS) + ", PRIMARY KEY(site, date)) WITHOUT ROWID")
+        conn.execute("CREATE INDEX IF NOT EXISTS summary_date ON summary(date)")   # 期間で全サイトを見るとき
+        conn.execute("CREATE TABLE IF NOT EXISTS sites(site TEXT PRIMARY KEY, last_upload TEXT, rows INTEGER)")
+        conn.commit()
+        conn.close()
+
+    def connect(self, name):
+        conn = sqlite3.connect(name, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")             # 書き込み中でも読める
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def site_path(self, site):
+        if not SITE_PATTERN.match(site or ""):
+            raise FleetError(f"サイト名が正しくありません: {site!r}")
+        return os.path.join(self.directory, f"site-{site}.db")
+
+    def site_lock(self, site):
+        with self.lock:
+            lock = self.site_locks.get(site)
+            if lock is None:
+                lock = self.site_locks[site] = threading.Lock()
+            return lock
+
+    def create_site(self, conn, site):
+        if site in self.sites:
+            return
+        for table, (columns, key) in TABLES.items():
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table}({', '.join(columns)}, "
+                         f"PRIMARY KEY({', '.join(key)})) WITHOUT ROWID")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_date ON {table}(date)")
+        self.sites.add(site)
+
+    def ingest(self, payload):
+        """
+        1サイト分のアップロードを保存する
+        Args:
+            payload : {"site": サイト名,
+                       "tables": {テーブル名: {"columns": [...], "rows": [[...], ...]}, ...}}
+        Returns:
+            {テーブル名: 新しく保存した行数}　重複していた行は数えない
+        """
+        site = payload.get("site")
+        path = self.site_path(site)
+        tables = payload.get("tables") or {}
+        result = {}
+        with self.site_lock(site):
+            conn = self.connect(path)
+            try:
+                self.create_site(conn, site)
+                for table, batch in tables.items():
+                    if table == "summary":
+                        continue
+                    if table not in TABLES:
+                        raise FleetError(f"知らないテーブルです: {table}")
+                    columns = TABLES[table][0]
+                    rows = reorder(batch, columns)
+                    before = conn.total_changes
+                    conn.executemany(f"INSERT OR IGNORE INTO {table}({', '.join(columns)}) "
+                                     f"VALUES({', '.join('?' * len(columns))})", rows)
+                    result[table] = conn.total_changes - before
+                conn.commit()
+            finally:
+                conn.close()
+
+        conn = self.connect(self.index_name)
+        try:
+            if "summary" in tables:                         # サマリーは同じ日でも後から値が変わるので上書きする
+                rows = [(site,) + row for row in reorder(tables["summary"], SUMMARY_COLUMNS)]
+                updates = ", ".join(f"{c}=excluded.{c}" for c in SUMMARY_COLUMNS[1:])
+                before = conn.total_changes
+                conn.executemany(f"INSERT INTO summary(site, {', '.join(SUMMARY_COLUMNS)}) "
+                                 f"VALUES({', '.join('?' * (len(SUMMARY_COLUMNS) + 1))}) "
+                                 f"ON CONFLICT(site, date) DO UPDATE SET {updates}", rows)
+                result["summary"] = conn.total_changes - before
+            conn.execute("INSERT INTO sites VALUES(?, datetime('now', 'localtime'), ?) "
+                         "ON CONFLICT(site) DO UPDATE SET last_upload=excluded.last_upload, rows=rows+excluded.rows",
+                         (site, sum(result.values())))
+            conn.commit()
+        finally:
+            conn.close()
+        for table, count in result.items():
+            myMetrics.db_rows_written.inc(f"fleet_{table}", count)
+        return result
+
+    def summary(self, date_from, date_to, sites=None):
+        """
+        全サイト（またはsitesのサイト）の期間のサマリーを列ごとの配列で返す
+        """
+        sql = f"SELECT site, {', '.join(SUMMARY_COLUMNS)} FROM summary WHERE date BETWEEN ? AND ?"
+        params = [date_from, date_to]
+        if sites:
+            sql += f" AND site IN ({', '.join('?' * len(sites))})"
+            params += list(sites)
+        sql += " ORDER BY site, date"
+        conn = self.connect(self.index_name)
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        columns = ["site"] + SUMMARY_COLUMNS
+        return {column: [row[i] for row in rows] for i, column in enumerate(columns)}
+
+    def list_sites(self):
+        conn = self.connect(self.index_name)
+        try:
+            rows = conn.execute("SELECT site, last_upload, rows FROM sites ORDER BY site").fetchall()
+        finally:
+            conn.close()
+        return [{"site": site, "last_upload": last, "rows": count} for site, last, count in rows]
+
+    def init_app(self, app):
+        """
+        Flaskに集約用のルートを追加する
+        """
+        from flask import request
+        from myResponse import json_response
+
+        @app.route("/fleet/ingest", methods=["POST"])
+        def fleet_ingest():
+            try:
+                payload = decode(request.get_data(), request.headers.get("Content-Encoding", ""))
+                return json_response({"accepted": self.ingest(payload)})
+            except FleetError as e:
+                return json_response({"error": str(e)}, status=400)
+
+        @app.route("/fleet/summary", methods=["GET", "POST"])
+        def fleet_summary():
+            sites = request.values.get("sites")
+            return json_response(self.summary(request.values.get("from", "0000/00/00"),
+                                              request.values.get("to", "9999/99/99"),
+                                              sites.split(",") if sites else None))
+
+        @app.route("/fleet/sites", methods=["GET", "POST"])
+        def fleet_sites():
+            return json_response(self.list_sites())
+
+
+def reorder(batch, columns):
+    """
+    {"columns": [...], "rows": [...]}の行を、保存する列の順のタプルにする　足りない列はNone
+    """
+    try:
+        index = [batch["columns"].index(c) if c in batch["columns"] else None for c in columns]
+        return [tuple(row[i] if i is not None else None for i in index) for row in batch["rows"]]
+    except (KeyError, TypeError, IndexError, AttributeError) as e:
+        raise FleetError(f"バッチの形式が正しくありません: {e}")
+
+
+def encode(payload):
+    """
+    アップロードの本文を作る（コントローラー側）　gzipで圧縮したJSON
+    """
+    return gzip.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"), compresslevel=6)
+
+
+def decode(body, encoding="gzip"):
+    """
+    アップロードの本文を読む（中央側）
+    """
+    try:
+        if "gzip" in encoding:
+            with gzip.GzipFile(fileobj=io.BytesIO(body)) as f:
+                body = f.read(MAX_BODY + 1)                 # 展開すると巨大になるものは受け付けない
+            if len(body) > MAX_BODY:
+                raise FleetError("アップロードが大きすぎます")
+        payload = json.loads(body)
+    except (OSError, ValueError) as e:
+        raise FleetError(f"アップロードを読めません: {e}")
+    if not isinstance(payload, dict):
+        raise FleetError("アップロードの形式が正しくありません")
+    return payload
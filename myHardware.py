@@ -0,0 +1,133 @@
+import time
+import threading
+import myMetrics
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class HardwareError(Exception):
+    """
+    ハードウェア呼び出しの失敗（タイムアウト・遮断中・デバイスの例外）
+    """
+    pass
+
+
+class Device():
+    def __init__(self, name, timeout=2.0, max_failures=3, cooldown=30.0):
+        """
+        1つのデバイスへの呼び出しを専用スレッドで実行するクラス
+        デバイスが固まってもFlaskのスレッドは待たされず、そのデバイスの値が古くなるだけで済む
+        Args:
+            name         : デバイス名
+            timeout      : 1回の呼び出しの待ち時間（秒）
+            max_failures : 連続でこの回数失敗したら遮断する
+            cooldown     : 遮断してから再び呼び出しを試すまでの時間（秒）
+        """
+        self.name = name
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.failures = 0                                   # 連続失敗回数
+        self.opened_at = None                               # 遮断した時刻　遮断していなければNone
+        self.probing = False                                # 遮断後の試しの呼び出しが実行中かどうか
+        self.stuck = None                                   # タイムアウトしたまま終わっていない呼び出し（Future）
+
+        # 所要時間の集計
+        self.count = 0
+        self.error_count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = None
+        self.last_error = ""
+
+    def call(self, func, *args, timeout=None, **kwargs):
+        """
+        デバイスの関数を専用スレッドで実行し、結果を返す
+        Raises:
+            HardwareError : 遮断中・タイムアウト・関数内で例外
+        """
+        if timeout is None:
+            timeout = self.timeout
+        is_probe = False
+        with self.lock:
+            if self.stuck is not None:                                  # 固まった呼び出しがデバイスを握っている間は遮断したまま
+                raise HardwareError(f"{self.name}: 前の呼び出しが終わっていません")
+            if self.opened_at is not None:                              # 遮断中ならば
+                if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+                    raise HardwareError(f"{self.name}: 遮断中")         # 待ち時間が過ぎるまではすぐに失敗を返す
+                self.probing = True                                     # 待ち時間が過ぎたら1つだけ試す
+                is_probe = True
+
+        start = time.perf_counter()
+        future = self.executor.submit(func, *args, **kwargs)
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # スレッドは止められないので、終わるまで次の呼び出しを通さない（スレッドも増やさない）
+            with self.lock:
+                self.stuck = future
+            future.add_done_callback(self.unstick)
+            self.record(start, f"タイムアウト（{timeout}秒）", is_probe)
+            raise HardwareError(f"{self.name}: タイムアウト")
+        except Exception as e:
+            self.record(start, str(e), is_probe)
+            raise HardwareError(f"{self.name}: {e}") from e
+        self.record(start, None, is_probe)
+        return result
+
+    def unstick(self, future):
+        """
+        固まっていた呼び出しが終わった　遮断の待ち時間が過ぎれば、また試せるようになる
+        """
+        with self.lock:
+            if self.stuck is future:
+                self.stuck = None
+
+    def record(self, start, error=None, is_probe=False):
+        """
+        所要時間と成否を記録し、連続失敗が続いたら遮断する
+        試しの呼び出しは、成功すれば遮断を解き、失敗すればもう一度待ち時間から遮断する
+        """
+        elapsed = time.perf_counter() - start
+        myMetrics.hardware_seconds.observe(self.name, elapsed)
+        if error is not None:
+            myMetrics.sensor_failures.inc(self.name)
+        with self.lock:
+            self.count += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            self.last_time = elapsed
+            if is_probe:
+                self.probing = False
+            if error is None:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.error_count += 1
+                self.last_error = error
+                self.failures += 1
+                if is_probe or self.failures >= self.max_failures:
+                    self.opened_at = time.monotonic()
+                    print(f"{self.name}: {self.failures}回続けて失敗したので{self.cooldown}秒遮断します")
+
+    def get_status(self):
+        """
+        呼び出し回数・所要時間・遮断状態を辞書として返す
+        """
+        with self.lock:
+            mean = self.total_time / self.count if self.count else None
+            return {"name": self.name,
+                    "count": self.count,
+                    "errors": self.error_count,
+                    "mean_ms": None if mean is None else round(mean * 1000, 2),
+                    "max_ms": round(self.max_time * 1000, 2),
+                    "last_ms": None if self.last_time is None else round(self.last_time * 1000, 2),
+                    "last_error": self.last_error,
+                    "is_open": self.opened_at is not None,
+                    "is_stuck": self.stuck is not None,
+                    }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,147 @@
+import numpy as np
+
+# グラフ用に時系列を間引くモジュール
+# 何週間分でも、画面の横幅くらいの点数にしてから送れば、スマホでもすぐに描ける
+
+MAX_POINTS = 5000                                           # 要求できる点数の上限
+DEFAULT_POINTS = 500                                        # 点数を指定しなかったとき
+
+# 間引いてよいテーブルと列
+SERIES = {"temperature": ["temperature", "humidity"],
+          "battery": ["volt", "relay1", "relay2"],
+          "LED": ["minute"],
+          }
+
+
+def lttb(x, y, points):
+    """
+    Largest-Triangle-Three-Buckets法で間引く　山や谷の形を残したまま点数を減らす
+    Args:
+        x, y   : 時刻と値（numpy配列、xは昇順）
+        points : 残す点数
+    Returns:
+        残す点のインデックスの配列
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)      # 最初と最後を除いた点をpoints-2個のバケツに分ける
+    index = np.empty(points, dtype=np.int64)
+    index[0] = 0
+    index[-1] = n - 1
+    a = 0                                                   # 直前に選んだ点
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i + 1]
+        if i + 2 < len(edges):                              # 次のバケツの平均
+            next_stop = edges[i + 2]
+        else:
+            next_stop = n
+        cx = x[stop:next_stop].mean() if next_stop > stop else x[-1]
+        cy = y[stop:next_stop].mean() if next_stop > stop else y[-1]
+        # 直前の点・候補・次のバケツの平均でできる三角形の面積が最大の点を選ぶ
+        area = np.abs((x[a] - cx) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (cy - y[a]))
+        a = start + int(np.argmax(area))
+        index[i + 1] = a
+    return index
+
+
+def minmax(x, y, points):
+    """
+    バケツごとに最小と最大の点を残して間引く　瞬間的な異常値を見落とさない
+    Args:
+        lttbと同じ
+    Returns:
+        残す点のインデックスの配列（最大points個）
+    """
+    n = len(x)
+    if points >= n or points < 2:
+        return np.arange(n)
+    edges = np.linspace(0, n, points // 2 + 1).astype(np.int64)
+    index = []
+    for start, stop in zip(edges[:-1], edges[1:]):
+        if stop <= start:
+            continue
+        lo = start + int(np.argmin(y[start:stop]))
+        hi = start + int(np.argmax(y[start:stop]))
+        index.extend(sorted({lo, hi}))                      # 時刻の順に並べる
+    return np.array(index, dtype=np.int64)
+
+
+METHODS = {"lttb": lttb, "minmax": minmax}
+
+
+def downsample(df, columns, points=DEFAULT_POINTS, method="lttb"):
+    """
+    DataFrameを間引いて、開始時刻からの秒数と各列の配列にする
+    点を選ぶのは最初の列で、他の列は同じ時刻の値を使う
+    Args:
+        df      : datetime列と値の列を持つdataframe
+        columns : 値の列名のリスト
+        points  : 残す点数
+        method  : "lttb" か "minmax"
+    Returns:
+        start   : 最初の点の時刻（Timestamp　Noneならばデータなし）
+        t       : startからの秒数（float64配列）
+        values  : 列名 -> float64配列
+    """
+    df = df.dropna(subset=[columns[0]])
+    if len(df) == 0:
+        return None, np.empty(0), {column: np.empty(0) for column in columns}
+    ns = df["datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    t = (ns - ns[0]) / 1e9
+    y = df[columns[0]].to_numpy(dtype=np.float64)
+    index = METHODS[method](t, y, max(2, min(int(points), MAX_POINTS)))
+    values = {column: df[column].to_numpy(dtype=np.float64)[index] for column in columns}
+    return df["datetime"].iloc[0], t[index], values
+
+
+def resample(df, columns, step, interp="linear"):
+    """
+    間引いて保存した時系列を、step秒ごとの等間隔の時刻の値に戻す
+    スウィングドアで間引いたものはlinear（前後の点を直線で結ぶ）、デッドバンドはhold（直前の点の値）で、
+    どちらも許容幅の中で元の読み取りを再現する
+    Args:
+        df      : datetime列と値の列を持つdataframe
+        columns : 値の列名のリスト
+        step    : 間隔（秒）　点数がMAX_POINTSを超えるときは広げる
+        interp  : "linear" か "hold"
+    Returns:
+        downsampleと同じ
+    """
+    df = df.dropna(subset=[columns[0]])
+    if len(df) == 0:
+        return None, np.empty(0), {column: np.empty(0) for column in columns}
+    ns = df["datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    x = (ns - ns[0]) / 1e9
+    step = max(step, x[-1] / (MAX_POINTS - 1), 1.0)
+    t = np.arange(0, x[-1] + step / 2, step)
+    t = t[t <= x[-1]]                                       # 最後の点より先は分からないので作らない
+    values = {}
+    for column in columns:
+        y = df[column].to_numpy(dtype=np.float64)
+        if interp == "hold":
+            values[column] = y[np.searchsorted(x, t, side="right") - 1]
+        else:
+            values[column] = np.interp(t, x, y)
+    return df["datetime"].iloc[0], t, values
+
+
+INTERPOLATIONS = ("linear", "hold")
+
+
+def pack(t, values, columns):
+    """
+    時刻と値をfloat32のリトルエンディアンで詰める　[時刻n個][列1のn個][列2のn個]...
+    時刻は開始時刻からの秒数なので、float32でも半年分までは1秒の精度がある
+    """
+    arrays = [t] + [values[column] for column in columns]
+    return b"".join(np.asarray(a, dtype="<f4").tobytes() for a in arrays)
+
+
+def unpack(body, columns):
+    """
+    packの逆　確認用
+    """
+    n = len(body) // 4 // (len(columns) + 1)
+    data = np.frombuffer(body, dtype="<f4")
+    return data[:n], {column: data[(i + 1) * n:(i + 2) * n] for i, column in enumerate(columns)}
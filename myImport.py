@@ -0,0 +1,291 @@
+# 過去のデータをまとめてagri.dbに取り込むモジュール
+# CSV（toCSVで書き出したもの・summary.csvなど）と日当たりログ.txtを読み、日付を揃えてから
+# 1つのトランザクションでまとめて追加し、サマリーの計算し直しは最後に1回だけ行う
+#   python myImport.py temperature.csv LED.csv
+#   python myImport.py summary.csv 日当たりログ.txt
+# サーバーが動いているときは、サーバーの /importData にファイルを送る
+#   コマンドで別のプロセスから書き込むと、サーバーの読み取りのキャッシュ（書き込み世代）は古いままになる
+#   --memory-dbのサーバーは自分のメモリの内容でagri.dbを上書きするので、コマンドからの取り込みは断る
+import os
+import re
+import csv
+import argparse
+import datetime
+
+CHUNK_SIZE = 50000                                          # 1回のexecutemanyで追加する行数
+MAX_ERRORS = 20                                             # 返すエラーメッセージの数
+
+# テーブルごとの列と、日時の列（秒まで持つかどうか）・重複を判定するキー
+TABLES = {"temperature": {"columns": ["date", "datetime", "temperature", "humidity"],
+                          "datetimes": {"datetime": False}, "key": "datetime",
+                          "numbers": ["temperature", "humidity"]},
+          "LED": {"columns": ["date", "datetime_from", "datetime_to", "minute"],
+                  "datetimes": {"datetime_from": False, "datetime_to": False},
+                  "key": "datetime_to", "numbers": ["minute"]},
+          "battery": {"columns": ["date", "datetime", "relay1", "relay2", "volt"],
+                      "datetimes": {"datetime": True}, "key": "datetime",
+                      "numbers": ["relay1", "relay2", "volt"]},
+          }
+SUMMARY_COLUMNS = ["date", "sunrise_time", "sunset_time", "moon_phase",
+                   "lighting_minutes", "max_temp", "min_temp", "mean_temp"]
+SUMMARY_NUMBERS = ["lighting_minutes", "max_temp", "min_temp", "mean_temp"]
+ALIASES = {"sunrise": "sunrise_time", "sunset": "sunset_time"}     # summary.csvの列名
+
+
+class ImportDataError(Exception):
+    """
+    取り込めない行やファイル
+    """
+    pass
+
+
+# 2024/01/02・2024-1-2・20240102・2024.01.02 に、時刻（"T"区切り・秒は省略可）が続くもの
+DATETIME_PATTERN = re.compile(r"^(\d{4})[-/.]?(\d{1,2})[-/.]?(\d{1,2})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?$")
+
+
+def parse(text):
+    """
+    日付・日時の文字列を (年, 月, 日, 時, 分, 秒) にする
+    行数が多いので、書式ごとにstrptimeを試す代わりに正規表現1回で読む
+    """
+    m = DATETIME_PATTERN.match(text.strip())
+    if m is None:
+        raise ImportDataError(f"日付を読めません: {text!r}")
+    values = [int(v) if v else 0 for v in m.groups()]
+    try:
+        datetime.datetime(*values)                          # ありえない日付（2月30日など）を除く
+    except ValueError:
+        raise ImportDataError(f"日付を読めません: {text!r}")
+    return values
+
+
+def normalize_date(text):
+    """
+    いろいろな書き方の日付を YYYY/MM/DD にする
+    """
+    year, month, day = parse(text)[:3]
+    return f"{year:04d}/{month:02d}/{day:02d}"
+
+
+def normalize_datetime(text, seconds=False):
+    """
+    いろいろな書き方の日時を YYYY/MM/DD HH:MM（secondsならば YYYY/MM/DD HH:MM:SS）にする
+    """
+    year, month, day, hour, minute, second = parse(text)
+    if seconds:
+        return f"{year:04d}/{month:02d}/{day:02d} {hour:02d}:{minute:02d}:{second:02d}"
+    return f"{year:04d}/{month:02d}/{day:02d} {hour:02d}:{minute:02d}"
+
+
+def number(text):
+    text = (text or "").strip()
+    if text == "" or text.lower() == "nan":
+        return None
+    return float(text)
+
+
+class Importer():
+    def __init__(self, db, chunk_size=CHUNK_SIZE):
+        """
+        Args:
+            db         : DBのクラス
+            chunk_size : 1回のexecutemanyで追加する行数
+        """
+        self.db = db
+        self.chunk_size = chunk_size
+        self.dates = set()                                  # サマリーを計算し直す日付
+        self.result = {}                                    # ファイル名 -> 結果
+        self.errors = []
+
+    def error(self, message):
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(message)
+
+    def check(self, filename, table=None):
+        """
+        取り込む前に、ファイルが読めて、どのテーブルのものか分かるかを確かめる
+        Raises:
+            ImportDataError : 読めない・テーブルが分からない・日時の列がない
+        """
+        if filename.endswith(".txt"):
+            if not os.path.isfile(filename):
+                raise ImportDataError(f"{filename}: ファイルがありません")
+            return "summary"
+        try:
+            with open(filename, encoding="utf-8-sig", newline="") as f:
+                header = [ALIASES.get(name.strip(), name.strip()) for name in next(csv.reader(f), [])]
+        except (OSError, UnicodeDecodeError) as e:
+            raise ImportDataError(f"{filename}: {e}")
+        if table is None:
+            table = guess_table(header)
+        if table == "summary":
+            if "date" not in header:
+                raise ImportDataError(f"{filename}: date列がありません")
+            return table
+        for name in TABLES[table]["datetimes"]:
+            if name not in header:
+                raise ImportDataError(f"{filename}: {name}列がありません")
+        return table
+
+    def import_file(self, filename, table=None):
+        """
+        ファイルを1つ取り込む　テーブルは列名（日当たりログは拡張子）から判断する
+        """
+        if filename.endswith(".txt"):
+            result = self.import_dailylog(filename)
+        else:
+            result = self.import_csv(filename, table)
+        self.result[filename] = result
+        return result
+
+    def import_csv(self, filename, table=None):
+        with open(filename, encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f)
+            header = [ALIASES.get(name.strip(), name.strip()) for name in next(reader, [])]
+            if table is None:
+                table = guess_table(header)
+            if table == "summary":
+                return self.import_summary(filename, header, reader)
+            spec = TABLES[table]
+            chunks = self.chunks(filename, header, reader, spec)
+            inserted, skipped, dates = self.db.import_rows(table, spec["columns"], chunks, spec["key"])
+        self.dates.update(dates)
+        return {"table": table, "inserted": inserted, "skipped": skipped}
+
+    def chunks(self, filename, header, reader, spec):
+        """
+        CSVの行を揃えながら、chunk_size行ずつのリストにして返す
+        """
+        index = {name: i for i, name in enumerate(header)}
+        main = next(iter(spec["datetimes"]))                # 日付がなければこの列の日付を使う
+        for name in spec["datetimes"]:
+            if name not in index:
+                raise ImportDataError(f"{filename}: {name}列がありません")
+        rows = []
+        for line_no, values in enumerate(reader, start=2):
+            if not values:
+                continue
+            try:
+                record = {}
+                for name, seconds in spec["datetimes"].items():
+                    record[name] = normalize_datetime(values[index[name]], seconds)
+                if "date" in index and values[index["date"]].strip():
+                    record["date"] = normalize_date(values[index["date"]])
+                else:
+                    record["date"] = record[main][:10]
+                for name in spec["numbers"]:
+                    record[name] = number(values[index[name]]) if name in index else None
+            except (ImportDataError, ValueError, IndexError) as e:
+                self.error(f"{filename}:{line_no}: {e}")
+                continue
+            rows.append([record[name] for name in spec["columns"]])
+            if len(rows) >= self.chunk_size:
+                yield rows
+                rows = []
+        yield rows
+
+    def import_summary(self, filename, header, reader):
+        columns = [name for name in header if name in SUMMARY_COLUMNS]
+        if "date" not in columns:
+            raise ImportDataError(f"{filename}: date列がありません")
+        index = [header.index(name) for name in columns]
+        rows = []
+        for line_no, values in enumerate(reader, start=2):
+            if not values:
+                continue
+            try:
+                row = []
+                for name, i in zip(columns, index):
+                    value = values[i]
+                    if name == "date":
+                        value = normalize_date(value)
+                    elif name in SUMMARY_NUMBERS:
+                        value = number(value)
+                    else:
+                        value = value.strip() or None
+                    row.append(value)
+            except (ImportDataError, ValueError, IndexError) as e:
+                self.error(f"{filename}:{line_no}: {e}")
+                continue
+            rows.append(row)
+        return {"table": "summary", "inserted": self.db.upsert_summary(columns, rows), "skipped": 0}
+
+    def import_dailylog(self, filename):
+        """
+        日当たりログ（日付,一日の実績:N分, 累計:M分）の一日の実績をサマリーの点灯時間にする
+        """
+        rows = []
+        with open(filename, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    items = re.split("[,:]", line)
+                    rows.append([normalize_date(items[0]), int(items[2].strip().rstrip("分"))])
+                except (ImportDataError, ValueError, IndexError) as e:
+                    self.error(f"{filename}:{line_no}: {e}")
+        return {"table": "summary", "inserted": self.db.upsert_summary(["date", "lighting_minutes"], rows),
+                "skipped": 0}
+
+    def finish(self):
+        """
+        取り込んだ温湿度・LEDの日のサマリーを、最後に1回だけ計算し直す
+        """
+        days = self.db.rebuild_summary(self.dates)
+        self.dates = set()
+        return {"files": self.result, "summary_days": days, "errors": self.errors}
+
+
+def guess_table(header):
+    names = set(header)
+    if "datetime_to" in names:
+        return "LED"
+    if "temperature" in names:
+        return "temperature"
+    if "relay1" in names:
+        return "battery"
+    if "date" in names and names & set(SUMMARY_COLUMNS[1:]):
+        return "summary"
+    raise ImportDataError(f"どのテーブルのデータか分かりません: {header}")
+
+
+def import_files(db, filenames, table=None):
+    """
+    ファイルをまとめて取り込み、結果を返す
+    """
+    importer = Importer(db)
+    for filename in filenames:                              # 途中で止まらないように、先に全部確かめる
+        importer.check(filename, table)
+    try:
+        for filename in filenames:
+            importer.import_file(filename, table)
+    finally:
+        result = importer.finish()                          # 途中で失敗しても、取り込んだ分のサマリーは計算し直す
+    return result
+
+
+def main():
+    import time
+    from myDatabase import DB, memory_owner
+    parser = argparse.ArgumentParser(description="過去のデータをagri.dbに取り込む")
+    parser.add_argument("files", nargs="+", help="CSVまたは日当たりログ.txt")
+    parser.add_argument("--table", choices=list(TABLES) + ["summary"], help="テーブル（省略すると列名から判断）")
+    args = parser.parse_args()
+    pid = memory_owner()
+    if pid is not None:
+        parser.exit(1, f"--memory-dbのサーバー（pid {pid}）が動いているので取り込めません　"
+                       f"サーバーの /importData にファイルを送ってください\n")
+    start = time.perf_counter()
+    try:
+        result = import_files(DB(), args.files, args.table)
+    except ImportDataError as e:
+        parser.exit(1, f"{e}\n")
+    for filename, r in result["files"].items():
+        print(f"{filename}: {r['table']}に{r['inserted']}行（重複{r['skipped']}行）")
+    print(f"サマリーを計算し直した日数 {result['summary_days']}　{time.perf_counter() - start:.2f}秒")
+    for error in result["errors"]:
+        print(error)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import time
+import bisect
+import functools
+import threading
+
+# 所要時間のヒストグラムの区切り（秒）
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram():
+    def __init__(self, name, help, label):
+        """
+        ラベルごとの所要時間のヒストグラム
+        Args:
+            name  : メトリクス名
+            help  : 説明
+            label : ラベル名
+        """
+        self.name = name
+        self.help = help
+        self.label = label
+        self.lock = threading.Lock()
+        self.series = {}                                    # ラベルの値 → [区切りごとの個数, 合計, 個数]
+
+    def observe(self, value, seconds):
+        index = bisect.bisect_left(BUCKETS, seconds)        # 入る区切り　累積は出力時に計算する
+        with self.lock:
+            data = self.series.get(value)
+            if data is None:
+                data = self.series[value] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            data[0][index] += 1
+            data[1] += seconds
+            data[2] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((value, [list(data[0]), data[1], data[2]]) for value, data in self.series.items())
+        for value, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label}="{value}"}} {total}')
+            lines.append(f'{self.name}_count{{{self.label}="{value}"}} {count}')
+        return lines
+
+
+class Counter():
+    def __init__(self, name, help, label):
+        """
+        ラベルごとの回数
+        """
+        self.name = name
+        self.help = help
+        self.label = label
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def inc(self, value, amount=1):
+        with self.lock:
+            self.series[value] = self.series.get(value, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.series.items())
+        for value, count in items:
+            lines.append(f'{self.name}{{{self.label}="{value}"}} {count}')
+        return lines
+
+
+route_seconds = Histogram("agri_route_seconds", "Flaskのルートごとの所要時間", "route")
+db_seconds = Histogram("agri_db_seconds", "DBのメソッドごとの所要時間", "method")
+hardware_seconds = Histogram("agri_hardware_seconds", "ハードウェア呼び出しの所要時間", "device")
+ephem_seconds = Histogram("agri_ephem_seconds", "暦の計算の所要時間", "step")
+sensor_failures = Counter("agri_sensor_failures_total", "センサーの読み取り失敗回数", "sensor")
+sensor_reads = Counter("agri_sensor_reads_total", "センサーを読んだ回数", "sensor")
+db_rows_written = Counter("agri_db_rows_written_total", "DBに書き込んだ行数", "table")
+db_cache_hits = Counter("agri_db_cache_hits_total", "DBの読み取りキャッシュに当たった回数", "method")
+db_cache_misses = Counter("agri_db_cache_misses_total", "DBの読み取りキャッシュに外れた回数", "method")
+
+METRICS = [route_seconds, db_seconds, hardware_seconds, ephem_seconds, sensor_failures, sensor_reads, db_rows_written,
+           db_cache_hits, db_cache_misses]
+
+
+def timed(histogram, value):
+    """
+    関数の所要時間をヒストグラムに記録するデコレーター
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(value, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def instrument(cls, histogram):
+    """
+    クラスの公開メソッドすべての所要時間をメソッド名ごとに記録する
+    """
+    for name, func in list(vars(cls).items()):
+        if callable(func) and not name.startswith("_"):
+            setattr(cls, name, timed(histogram, name)(func))
+    return cls
+
+
+def init_app(app):
+    """
+    Flaskのすべてのルートの所要時間を記録する
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.teardown_request
+    def stop_timer(exc=None):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            route_seconds.observe(request.endpoint or "unknown", time.perf_counter() - start)
+
+
+def expose():
+    """
+    Prometheusのテキスト形式で全メトリクスを返す
+    """
+    lines = []
+    for metric in METRICS:
+        lines += metric.expose()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,121 @@
+import os
+import io
+import time
+import pstats
+import cProfile
+import threading
+
+PROFILE_DIR = "profiles"                                    # プロファイルの保存先
+PROFILE_KEEP = 20                                           # 保存しておく数（古いものから消す）
+PROFILE_HEADER = "X-Agri-Profile"                           # このヘッダーが付いたリクエストをプロファイルする
+SORT_KEYS = ("cumulative", "tottime", "time", "calls", "ncalls", "pcalls",      # 表示の並べ替えに使えるpstatsのキー
+             "name", "filename", "module", "line", "nfl", "stdname")
+
+
+class Profiler():
+    def __init__(self, mode=lambda: "0", directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        """
+        リクエストをcProfileで計測し、結果をファイルに残すクラス
+        Args:
+            mode      : 計測のしかたを返す関数（設定テーブルの値）
+                        "1"=全リクエスト、"header"=ヘッダーが付いたリクエストだけ、それ以外=計測しない
+            directory : 保存先
+            keep      : 保存しておく数
+        """
+        self.mode = mode
+        self.directory = directory
+        self.keep = keep
+        self.lock = threading.Lock()                        # cProfileは同時に1つしか動かせないので1リクエストずつ
+
+    def init_app(self, app):
+        from flask import g, request
+
+        @app.before_request
+        def start_profile():
+            if request.endpoint in ("profiles", "profile", "static"):
+                return
+            mode = self.mode()
+            if mode != "1" and not (mode == "header" and request.headers.get(PROFILE_HEADER) == "1"):
+                return
+            if not self.lock.acquire(blocking=False):       # 他のリクエストを計測中ならばあきらめる
+                return
+            profile = cProfile.Profile()
+            g.profile = profile
+            profile.enable()
+
+        @app.teardown_request
+        def stop_profile(exc=None):
+            profile = g.pop("profile", None)
+            if profile is None:
+                return
+            profile.disable()
+            self.lock.release()
+            self.save(profile, request.endpoint or "unknown")
+
+    def is_enabled(self):
+        """
+        計測する設定かどうか　計測しないときはプロファイルの一覧や内容も見せない
+        """
+        return self.mode() in ("1", "header")
+
+    def submit(self, executor, func, *args, **kwargs):
+        """
+        executorで処理を実行する　計測中のリクエストから出した処理はワーカーのスレッドでも計測する
+        cProfileは有効にしたスレッドしか計測しないので、リクエストのプロファイルにはワーカーの中身が入らない
+        ワーカーの分は「エンドポイント.関数名」として別のファイルに保存する
+        """
+        from flask import g, request
+        if g.get("profile") is None:
+            return executor.submit(func, *args, **kwargs)
+        name = f"{request.endpoint}.{func.__name__}"
+
+        def run():
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:                              # Python 3.12以降は同時に1つしか有効にできないので計測しない
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                self.save(profile, name)
+        return executor.submit(run)
+
+    def save(self, profile, endpoint):
+        """
+        プロファイルを保存し、古いものを削除する
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{endpoint}.prof"
+        profile.dump_stats(os.path.join(self.directory, name))
+        for old in self.list()[self.keep:]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:                       # ワーカーと同時に保存したときは、もう消えている
+                pass
+
+    def list(self):
+        """
+        保存してあるプロファイルのファイル名を新しい順に返す
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted((f for f in os.listdir(self.directory) if f.endswith(".prof")), reverse=True)
+
+    def path(self, name):
+        """
+        ファイル名から保存先のパスを返す　保存してあるもの以外はNone
+        """
+        if name not in self.list():
+            return None
+        return os.path.join(self.directory, name)
+
+    def report(self, name, sort="cumulative", limit=50):
+        """
+        プロファイルを読める文字列にする
+        """
+        buffer = io.StringIO()
+        stats = pstats.Stats(self.path(name), stream=buffer)
+        stats.sort_stats(sort).print_stats(limit)
+        return buffer.getvalue()
@@ -0,0 +1,150 @@
+import os
+import json
+import gzip
+import math
+import hashlib
+import datetime
+import threading
+from collections import OrderedDict
+
+GZIP_MIN_SIZE = 1024                                        # これより大きい応答だけ圧縮する
+GZIP_LEVEL = 5                                              # 圧縮レベル　ラズパイでは速さを優先する
+CACHE_SIZE = 32                                             # VersionCacheに残しておく応答の数
+
+
+def default(obj):
+    """
+    json標準で扱えない型を変換する
+    numpy・pandasの型はモジュールを読み込まずに判定する
+    """
+    module = type(obj).__module__
+    if module == "numpy":
+        if hasattr(obj, "tolist"):                          # 配列・スカラーともtolistでPythonの値になる
+            return clean(obj.tolist())
+    if module.startswith("pandas"):
+        if hasattr(obj, "isoformat"):                       # Timestamp
+            return obj.strftime("%Y/%m/%d %H:%M:%S")
+        if hasattr(obj, "tolist"):                          # Series・Index
+            return clean(obj.tolist())
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.strftime("%Y/%m/%d %H:%M:%S") if isinstance(obj, datetime.datetime) else obj.strftime("%Y/%m/%d")
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode("utf-8")
+    raise TypeError(f"{type(obj).__name__} はJSONにできません")
+
+
+def clean(value):
+    """
+    NaNやInfはJSONにないのでNoneにする
+    """
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, (list, tuple)):
+        return [clean(v) for v in value]
+    if isinstance(value, dict):
+        return {k: clean(v) for k, v in value.items()}
+    return value
+
+
+def dumps(obj):
+    """
+    numpy・pandasの値を含んでいてもJSON文字列にする
+    """
+    try:
+        return json.dumps(obj, default=default, ensure_ascii=False, separators=(",", ":"), allow_nan=False)
+    except ValueError:                                      # NaNを含むときだけ全体をたどって直す
+        return json.dumps(clean(obj), default=default, ensure_ascii=False, separators=(",", ":"), allow_nan=False)
+
+
+def columns(df, index=None):
+    """
+    DataFrameを列ごとの配列にする　辞書の辞書より小さく、作るのも速い
+    Args:
+        df    : dataframe
+        index : インデックスの名前（Noneならばインデックスは含めない）
+    Returns:
+        {"インデックス名": [...], "列名": [...], ...}
+    """
+    dict = {}
+    if index is not None:
+        dict[index] = clean(df.index.tolist())
+    for column in df.columns:
+        dict[column] = clean(df[column].tolist())
+    return dict
+
+
+def make_response(body, status=200, headers=None, gzipped=None):
+    """
+    JSONの本文から応答を作る　大きいものはブラウザが対応していればgzipで圧縮する
+    Args:
+        body    : JSONのバイト列
+        gzipped : 圧縮済みの本文を返す関数（キャッシュしてあるものを使うとき）
+    """
+    from flask import request, Response
+
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    if len(body) >= GZIP_MIN_SIZE and "gzip" in request.headers.get("Accept-Encoding", ""):
+        body = gzipped() if gzipped else gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, status=status, mimetype="application/json", headers=headers)
+
+
+def json_response(obj, status=200):
+    """
+    JSONの応答を作る
+    """
+    return make_response(dumps(obj).encode("utf-8"), status=status)
+
+
+class VersionCache():
+    def __init__(self, size=CACHE_SIZE):
+        """
+        読み取りが多いエンドポイントの応答を、元データのバージョンごとに覚えておくクラス
+        ETagはバージョンから作るので、変わっていなければ本文を作らずに304を返せる
+        Args:
+            size : 覚えておく応答の数
+        """
+        self.size = size
+        self.boot = os.urandom(8).hex()                     # 再起動したら世代が0に戻るので、起動ごとに別のETagにする
+        self.entries = OrderedDict()                        # ETag -> [本文, 圧縮した本文]
+        self.lock = threading.Lock()
+
+    def etag(self, name, version):
+        key = f"{self.boot}:{name}:{version!r}".encode("utf-8")
+        return hashlib.sha1(key).hexdigest()[:20]
+
+    def respond(self, name, version, build):
+        """
+        バージョンが同じならば覚えている本文を返し、ブラウザが持っていれば304を返す
+        Args:
+            name    : エンドポイントの名前
+            version : 元データのバージョン（テーブルの書き込み世代や日付、引数のタプル）
+            build   : 本文にするオブジェクトを作る関数
+        """
+        from flask import request, Response
+
+        etag = self.etag(name, version)
+        headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+        if etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+        with self.lock:
+            entry = self.entries.get(etag)
+            if entry is not None:
+                self.entries.move_to_end(etag)
+        if entry is None:
+            obj = build()
+            if isinstance(obj, dict) and "error" in obj:    # エラーは覚えずに毎回やり直す
+                return json_response(obj)
+            entry = [dumps(obj).encode("utf-8"), None]
+            with self.lock:
+                self.entries[etag] = entry
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+
+        def gzipped():
+            if entry[1] is None:
+                entry[1] = gzip.compress(entry[0], compresslevel=GZIP_LEVEL)
+            return entry[1]
+
+        return make_response(entry[0], headers=headers, gzipped=gzipped)
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import socket
+import struct
+import threading
+from multiprocessing import shared_memory
+from myHardware import HardwareError
+
+# ハードウェアデーモン（hwdaemon.py）とWebのプロセスの間で状態を受け渡すモジュール
+# 最新の値は共有メモリに、LEDの操作などの命令はUNIXソケットで送る
+
+STATE_NAME = "agri_state"                                   # 共有メモリの名前
+SOCKET_PATH = "/tmp/agri-hw.sock"                           # 命令を受け付けるソケット
+STALE_SECONDS = 10.0                                        # これより古い値は使わない
+
+# 共有メモリの並び　先頭のseqが奇数の間はデーモンが書き込み中
+SEQ = struct.Struct("<Q")
+PAYLOAD = struct.Struct("<I d 8B B d d d B B 4B")
+SIZE = SEQ.size + PAYLOAD.size
+
+
+def encode(state):
+    return (state["pid"],
+            state["contec_time"], *state["inputs"], state["contec_ok"],
+            state["humi_time"], state["temp"], state["humi"], state["humi_ok"],
+            state["led_on"], *state["relays"])
+
+
+def decode(values):
+    return {"pid": values[0],
+            "contec_time": values[1], "inputs": list(values[2:10]), "contec_ok": bool(values[10]),
+            "humi_time": values[11], "temp": values[12], "humi": values[13], "humi_ok": bool(values[14]),
+            "led_on": bool(values[15]), "relays": list(values[16:20]),
+            }
+
+
+def empty_state(pid=0):
+    return {"pid": pid,
+            "contec_time": 0.0, "inputs": [0] * 8, "contec_ok": False,
+            "humi_time": 0.0, "temp": 0.0, "humi": 0.0, "humi_ok": False,
+            "led_on": False, "relays": [1, 1, 1, 1],
+            }
+
+
+class SharedState():
+    def __init__(self, create=False, name=STATE_NAME):
+        """
+        seqlockで守った共有メモリ上の状態
+        書くのはデーモン1つだけで、読む側はロックを取らずに、書き込み中でなければそのまま読む
+        Args:
+            create : Trueならば作る（デーモン）、Falseならば既存のものにつなぐ（Web）
+                     つなぐだけのときに無ければFileNotFoundError
+        """
+        if create:
+            try:                                            # 前回のデーモンが残したものは作り直す
+                old = shared_memory.SharedMemory(name=name)
+                old.close()
+                old.unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            try:                                            # つないだだけのプロセスが終了時に消してしまわないように
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+            except Exception:
+                pass
+        self.create = create
+        self.buf = self.shm.buf
+        self.seq = SEQ.unpack_from(self.buf, 0)[0]
+
+    def write(self, state):
+        """
+        状態を書き込む（デーモンから）
+        """
+        self.seq += 1                                       # 奇数　書き込み中
+        SEQ.pack_into(self.buf, 0, self.seq)
+        PAYLOAD.pack_into(self.buf, SEQ.size, *encode(state))
+        self.seq += 1                                       # 偶数　書き終わり
+        SEQ.pack_into(self.buf, 0, self.seq)
+
+    def read(self, retries=100):
+        """
+        状態を読む　書き込み中や読んでいる間に書き換わったときは読み直す
+        Returns:
+            状態の辞書　まだ一度も書かれていなければNone
+        """
+        for _ in range(retries):
+            before = SEQ.unpack_from(self.buf, 0)[0]
+            if before & 1:
+                continue
+            values = PAYLOAD.unpack_from(self.buf, SEQ.size)
+            if SEQ.unpack_from(self.buf, 0)[0] == before:
+                return decode(values) if before else None
+        raise HardwareError("共有メモリの状態を読めません（書き込みが続いています）")
+
+    def writer_pid(self):
+        """
+        書き込んだデーモンのpid　書き込み中でも読める（pidは書き込みのたびに同じ値なので崩れない）
+        """
+        return PAYLOAD.unpack_from(self.buf, SEQ.size)[0]
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.create:
+            self.shm.unlink()
+
+
+class HardwareClient():
+    def __init__(self, name=STATE_NAME, socket_path=SOCKET_PATH, stale=STALE_SECONDS):
+        """
+        Webのプロセスからハードウェアデーモンを使うクラス
+        デーモンが動いていなければavailable()がFalseになり、呼び出し元は自分でデバイスを扱う
+        """
+        self.name = name
+        self.socket_path = socket_path
+        self.stale = stale
+        self.shared = None
+        self.lock = threading.Lock()                        # Flaskの複数スレッドがつなぐ・切る・読むを同時にしないように
+
+    def state(self):
+        """
+        デーモンが公開している最新の状態　デーモンが動いていなければNone
+        別のスレッドが切った共有メモリを読まないように、ロックを取って読む
+        デーモンが書き込みの途中で止まった（seqが奇数のまま）ときも、止まったデーモンとして扱う
+        """
+        with self.lock:
+            if self.shared is None:
+                try:
+                    self.shared = SharedState(name=self.name)
+                except FileNotFoundError:
+                    return None
+            try:
+                state = self.shared.read()
+            except HardwareError:
+                pid = self.shared.writer_pid()
+                if self.is_alive(pid):                      # 書き込みが続いているだけなので、今回は読めなかったことにする
+                    return empty_state(pid)
+                self.shared.close()                         # 書き込みの途中で止まった
+                self.shared = None
+                return None
+            if state is None:
+                return None
+            if not self.is_alive(state["pid"]):             # デーモンが止まったら、作り直されたときにつなぎ直す
+                self.shared.close()
+                self.shared = None
+                return None
+            return state
+
+    def is_alive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:                             # 別のユーザーで動いている
+            return True
+        return True
+
+    def available(self):
+        return self.state() is not None
+
+    def is_fresh(self, state, key):
+        """
+        contec_time・humi_timeがstale秒以内かどうか
+        """
+        return time.time() - state[key] <= self.stale
+
+    def command(self, cmd, timeout=3.0, **args):
+        """
+        デーモンに命令を送り、返事を返す
+        Raises:
+            HardwareError : デーモンにつながらない・デーモン側で失敗
+        """
+        message = dict(args, cmd=cmd)
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+                reply = sock.makefile("rb").readline()
+        except OSError as e:
+            raise HardwareError(f"ハードウェアデーモン: {e}")
+        reply = json.loads(reply or b"{}")
+        if "error" in reply:
+            raise HardwareError(f"ハードウェアデーモン: {reply['error']}")
+        return reply
@@ -0,0 +1,123 @@
+import threading
+
+class LightCounter():
+    def __init__(self, sensing_count=1):
+        """
+        光センサーの積算状態を保持するクラス
+        複数のスレッドから同時にリクエストが来ても数え間違えないようにロックで守る
+        Args:
+            sensing_count : 光センサー計測リセット回数
+        """
+        self.lock = threading.Lock()
+        self.light_sum = 0                                  # 光センサーオフの累計
+        self.sensing_count = sensing_count                  # 光センサー計測リセット回数
+        self.light_cnt = 0                                  # 光センサー計測回数　sensing_countの回数でリセット
+        self.light_log = ""                                 # 光センサーのログ
+
+    def set_sensing_count(self, sensing_count):
+        """
+        光センサー計測リセット回数を変更する
+        """
+        with self.lock:
+            self.sensing_count = max(1, int(sensing_count))
+
+    def add(self, lights, is_light_cnt):
+        """
+        光センサーの状態を積算する
+        Args:
+            lights       : 5個の光センサーの状態
+            is_light_cnt : 積算するかどうか
+        Returns:
+            light_sum, light_cnt : 積算後の値
+        """
+        with self.lock:                                     # 回数の更新と累計の加算をひとまとまりにする
+            if is_light_cnt:
+                self.light_cnt = (self.light_cnt + 1) % self.sensing_count
+                if self.light_cnt == 0:
+                    self.light_log = ""
+                    self.light_sum = 0
+                self.light_sum += sum(lights)               # 光の合計を加算する
+            return self.light_sum, self.light_cnt
+
+
+class Cadence():
+    def __init__(self, min_interval, max_interval, tolerance=0.0, threshold=None, margin=0.0):
+        """
+        センサーを読む間隔を、値の変わり方に合わせて決めるクラス
+        値が変わっているときやしきい値に近いときは間隔を半分にし、落ち着いているときは1.5倍にする
+        Args:
+            min_interval : 最短の間隔（秒）
+            max_interval : 最長の間隔（秒）
+            tolerance    : 前回からこれより大きく変われば「変わっている」とみなす
+            threshold    : 判断のしきい値（Noneならば使わない）
+            margin       : しきい値からこの幅の中ならば「しきい値に近い」とみなす
+        """
+        self.lock = threading.Lock()
+        self.tolerance = tolerance
+        self.threshold = threshold
+        self.margin = margin
+        self.interval = float(min_interval)                 # 最初は短い間隔から始める
+        self.set_bounds(min_interval, max_interval)
+        self.last_value = None                              # 前回の値
+        self.reads = 0                                      # 読んだ回数
+
+    def set_bounds(self, min_interval, max_interval):
+        """
+        間隔の範囲を変更する
+        """
+        with self.lock:
+            self.min_interval = max(1.0, float(min_interval))
+            self.max_interval = max(self.min_interval, float(max_interval))
+            self.interval = min(self.max_interval, max(self.min_interval, self.interval))
+
+    def update(self, value):
+        """
+        読んだ値から次の間隔を決める
+        Args:
+            value : 読んだ値（読めなかったときはNone　間隔を変えずに次を待つ）
+        Returns:
+            次に読むまでの間隔（秒）
+        """
+        with self.lock:
+            if value is not None:
+                self.reads += 1
+                is_changing = self.last_value is not None and abs(value - self.last_value) > self.tolerance
+                is_near = self.threshold is not None and abs(value - self.threshold) <= self.margin
+                if is_changing or is_near:
+                    self.interval = max(self.min_interval, self.interval / 2)
+                else:
+                    self.interval = min(self.max_interval, self.interval * 1.5)
+                self.last_value = value
+            return self.interval
+
+    def get_status(self):
+        with self.lock:
+            return {"interval": self.interval,
+                    "min_interval": self.min_interval,
+                    "max_interval": self.max_interval,
+                    "last_value": self.last_value,
+                    "reads": self.reads,
+                    }
+
+
+class Lazy():
+    def __init__(self, factory):
+        """
+        初めて属性を使うときにfactory()でオブジェクトを作る代理のクラス
+        重いモジュールの読み込みやDBへの接続を、起動時ではなく最初のリクエストまで遅らせる
+        Args:
+            factory : オブジェクトを作る関数
+        """
+        self._factory = factory
+        self._object = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._object is None:
+            with self._lock:
+                if self._object is None:
+                    self._object = self._factory()
+        return self._object
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
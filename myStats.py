@@ -0,0 +1,247 @@
+import math
+import time
+import threading
+from collections import deque
+
+# センサーごとの統計を、読み取りのたびに少しずつ更新するモジュール
+# 「この1時間の平均」などを、DBやpandasを使わずにその場で答えられるようにする
+
+WINDOWS = {"10m": 600, "1h": 3600, "24h": 86400}            # 移動窓の名前 -> 長さ（秒）
+EXACT_SECONDS = 600                                         # これ以下の窓は読み取りを1件ずつ持つ
+BUCKET_SECONDS = 60                                         # それより長い窓は、この長さごとの件数・合計・最小・最大にまとめる
+EMA_TAUS = {"5m": 300, "1h": 3600}                          # 指数移動平均の名前 -> 時定数（秒）
+
+
+class Window():
+    def __init__(self, seconds):
+        """
+        時間の窓の中の件数・合計・最小・最大を保持するクラス
+        最小と最大は単調なdequeで持つので、値を足すのも答えるのもならしてO(1)
+        Args:
+            seconds : 窓の長さ（秒）
+        """
+        self.seconds = seconds
+        self.values = deque()                               # (時刻, 値)　件数と合計のため
+        self.mins = deque()                                 # 値が増える順の(時刻, 値)　先頭が最小
+        self.maxs = deque()                                 # 値が減る順の(時刻, 値)　先頭が最大
+        self.total = 0.0
+
+    def add(self, t, value):
+        self.values.append((t, value))
+        self.total += value
+        while self.mins and self.mins[-1][1] >= value:      # 新しい値より大きいものは、もう最小にならない
+            self.mins.pop()
+        self.mins.append((t, value))
+        while self.maxs and self.maxs[-1][1] <= value:      # 新しい値より小さいものは、もう最大にならない
+            self.maxs.pop()
+        self.maxs.append((t, value))
+        self.expire(t)
+
+    def expire(self, now):
+        """
+        窓から外れた古い値を捨てる
+        """
+        limit = now - self.seconds
+        while self.values and self.values[0][0] <= limit:
+            self.total -= self.values.popleft()[1]
+        while self.mins and self.mins[0][0] <= limit:
+            self.mins.popleft()
+        while self.maxs and self.maxs[0][0] <= limit:
+            self.maxs.popleft()
+        if not self.values:
+            self.total = 0.0                                # 足し引きの誤差を持ち越さない
+
+    def get(self, now):
+        self.expire(now)
+        count = len(self.values)
+        return {"count": count,
+                "mean": self.total / count if count else None,
+                "min": self.mins[0][1] if self.mins else None,
+                "max": self.maxs[0][1] if self.maxs else None,
+                }
+
+
+class BucketWindow():
+    def __init__(self, seconds, bucket=BUCKET_SECONDS):
+        """
+        長い時間の窓を、bucket秒ごとの件数・合計で持つクラス
+        1秒ごとの読み取りでも、24時間で1440個の集計だけで済む（窓の端はbucket秒単位で丸まる）
+        件数と合計は足し引きで、最小と最大は集計ごとに1つまでの単調なdequeで持つので、Windowと同じくならしてO(1)
+        Args:
+            seconds : 窓の長さ（秒）
+            bucket  : 1つの集計の長さ（秒）
+        """
+        self.seconds = seconds
+        self.bucket = bucket
+        self.buckets = deque()                              # [始まりの時刻, 件数, 合計]
+        self.mins = deque()                                 # 値が増える順の(始まりの時刻, 集計の最小)　先頭が最小
+        self.maxs = deque()                                 # 値が減る順の(始まりの時刻, 集計の最大)　先頭が最大
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, t, value):
+        start = t - t % self.bucket
+        if self.buckets and self.buckets[-1][0] == start:
+            self.buckets[-1][1] += 1
+            self.buckets[-1][2] += value
+        else:
+            self.buckets.append([start, 1, value])
+        self.count += 1
+        self.total += value
+        if not (self.mins and self.mins[-1][0] == start and self.mins[-1][1] <= value):
+            while self.mins and self.mins[-1][1] >= value:  # 同じ集計の古い最小もここで置き換わる
+                self.mins.pop()
+            self.mins.append((start, value))
+        if not (self.maxs and self.maxs[-1][0] == start and self.maxs[-1][1] >= value):
+            while self.maxs and self.maxs[-1][1] <= value:
+                self.maxs.pop()
+            self.maxs.append((start, value))
+        self.expire(t)
+
+    def expire(self, now):
+        """
+        すべてが窓から外れた集計を捨てる
+        """
+        limit = now - self.seconds - self.bucket            # 始まりがこれ以前の集計は窓から外れている
+        while self.buckets and self.buckets[0][0] <= limit:
+            _, count, total = self.buckets.popleft()
+            self.count -= count
+            self.total -= total
+        while self.mins and self.mins[0][0] <= limit:
+            self.mins.popleft()
+        while self.maxs and self.maxs[0][0] <= limit:
+            self.maxs.popleft()
+        if not self.buckets:
+            self.count = 0
+            self.total = 0.0                                # 足し引きの誤差を持ち越さない
+
+    def get(self, now):
+        self.expire(now)
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else None,
+                "min": self.mins[0][1] if self.mins else None,
+                "max": self.maxs[0][1] if self.maxs else None,
+                }
+
+
+def make_window(seconds):
+    """
+    短い窓は1件ずつ、長い窓は時間ごとの集計で持つ
+    """
+    if seconds <= EXACT_SECONDS:
+        return Window(seconds)
+    return BucketWindow(seconds)
+
+
+class SensorStats():
+    def __init__(self, windows=WINDOWS, taus=EMA_TAUS):
+        """
+        1つのセンサーの統計
+        全期間の平均と分散（Welford法）、指数移動平均、時間の窓ごとの件数・平均・最小・最大
+        Args:
+            windows : 窓の名前 -> 長さ（秒）
+            taus    : 指数移動平均の名前 -> 時定数（秒）
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0                                       # 平均との差の2乗の合計
+        self.taus = dict(taus)
+        self.emas = {name: None for name in taus}
+        self.windows = {name: make_window(seconds) for name, seconds in windows.items()}
+        self.last = None                                    # 最後の値
+        self.last_time = None                               # 最後の値の時刻
+
+    def add(self, value, t, dedupe=False):
+        """
+        値を1つ加える
+        Args:
+            value  : 値
+            t      : 読み取った時刻
+            dedupe : Trueならば前の値より新しくない時刻の値は数えない（デーモンの同じ読み取りを何度も渡されるとき）
+        """
+        if dedupe and self.last_time is not None and t <= self.last_time:
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        for name, tau in self.taus.items():                 # 間隔が不揃いでも効くように、経過時間から重みを決める
+            ema = self.emas[name]
+            if ema is None:
+                self.emas[name] = float(value)
+            else:
+                alpha = 1 - math.exp(-max(0.0, t - self.last_time) / tau)
+                self.emas[name] = ema + alpha * (value - ema)
+        for window in self.windows.values():
+            window.add(t, value)
+        self.last = value
+        self.last_time = t
+
+    def get(self, now):
+        variance = self.m2 / (self.count - 1) if self.count > 1 else None
+        return {"last": self.last,
+                "last_time": self.last_time,
+                "count": self.count,
+                "mean": self.mean if self.count else None,
+                "variance": variance,
+                "stdev": math.sqrt(variance) if variance is not None else None,
+                "ema": dict(self.emas),
+                "windows": {name: window.get(now) for name, window in self.windows.items()},
+                }
+
+
+class StreamStats():
+    def __init__(self, windows=WINDOWS, taus=EMA_TAUS):
+        """
+        センサーごとの統計をまとめて持つクラス
+        複数のスレッドから読み取りが来るのでロックで守る
+        """
+        self.lock = threading.Lock()
+        self.windows = windows
+        self.taus = taus
+        self.sensors = {}                                   # センサー名 -> SensorStats
+
+    def add(self, sensor, value, t=None):
+        """
+        読み取った値を1つ加える
+        Args:
+            sensor : センサー名
+            value  : 値（Noneならば読めなかったものとして何もしない）
+            t      : デーモンが読み取った時刻（省略するとロックの中でtime.time()）　与えたときは前の値より新しくなければ数えない
+        """
+        self.add_many({sensor: value}, t)
+
+    def add_many(self, values, t=None):
+        """
+        同じ時刻に読み取った値をまとめて加える
+        Args:
+            values : センサー名 -> 値
+            t      : addと同じ
+        """
+        with self.lock:
+            dedupe = t is not None                          # 時刻を付けるのがロックの中なので、自分で付けた時刻は順に並ぶ
+            t = time.time() if t is None else t
+            for sensor, value in values.items():
+                if value is None:
+                    continue
+                stats = self.sensors.get(sensor)
+                if stats is None:
+                    stats = self.sensors[sensor] = SensorStats(self.windows, self.taus)
+                stats.add(float(value), t, dedupe)
+
+    def get(self, sensor=None, now=None):
+        """
+        統計を返す
+        Args:
+            sensor : センサー名（省略すると全センサー）
+            now    : 窓の終わりの時刻（省略するとtime.time()）
+        Returns:
+            センサー名 -> 統計の辞書
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            if sensor is None:
+                return {name: stats.get(now) for name, stats in self.sensors.items()}
+            if sensor not in self.sensors:
+                return {}
+            return {sensor: self.sensors[sensor].get(now)}
@@ -0,0 +1,196 @@
+import os
+import time
+import threading
+import urllib.request
+import urllib.error
+from myFleet import encode
+from myDatabase import SYNC_BATCH
+
+# このハウスのデータを中央サーバー（serve.py --fleet）へ少しずつ送るモジュール
+# テーブルごとに送り済みの位置（rowid）を覚えておき、前回から増えた行だけを送る
+# 送る内容は先にoutboxフォルダーのファイルにしてから位置を進めるので、回線が切れていても失わない
+
+SYNC_TABLES = ["temperature", "LED", "contec", "battery"]            # rowidで差分を取るテーブル
+OUTBOX_DIR = "outbox"                                       # 送信待ちのファイルの置き場所
+SYNC_INTERVAL = 300                                         # 送る間隔（秒）
+MAX_QUEUE = 100                                             # 送信待ちがこれより多ければ、差分はDBに残したままにする
+MAX_BACKOFF = 3600                                          # 失敗が続いたときに待つ最大の時間（秒）
+
+
+class SyncError(Exception):
+    """
+    中央サーバーに送れなかった
+    """
+    pass
+
+
+class Outbox():
+    def __init__(self, directory=OUTBOX_DIR):
+        """
+        送信待ちのファイルを古い順に並べておくクラス
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, body):
+        """
+        圧縮済みの本文を保存する　一時ファイルに書いてから置き換えるので、電源断でも壊れたファイルを残さない
+        """
+        name = f"{time.time_ns():020d}.json.gz"                # 名前の順が作った順
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", mode="wb") as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return name
+
+    def list(self):
+        return sorted(f for f in os.listdir(self.directory) if f.endswith(".json.gz"))
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name), mode="rb") as f:
+            return f.read()
+
+    def remove(self, name):
+        os.remove(os.path.join(self.directory, name))
+
+    def reject(self, name):
+        path = os.path.join(self.directory, name)
+        os.replace(path, path + ".rejected")
+
+
+class Syncer():
+    def __init__(self, db, url, site, directory=OUTBOX_DIR, interval=SYNC_INTERVAL, max_queue=MAX_QUEUE, timeout=30):
+        """
+        Args:
+            db        : DBのクラス
+            url       : 中央サーバーのURL（http://host:port）
+            site      : このハウスの名前
+            directory : 送信待ちのファイルの置き場所
+            interval  : 送る間隔（秒）
+            max_queue : 送信待ちのファイル数の上限
+            timeout   : 1回の送信の待ち時間（秒）
+        """
+        self.db = db
+        self.url = url.rstrip("/") + "/fleet/ingest"
+        self.site = site
+        self.outbox = Outbox(directory)
+        self.interval = interval
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.lock = threading.Lock()                        # collectとflushを同時に動かさない
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.failures = 0
+        self.last_error = ""
+        self.last_sync = None
+
+    def collect(self):
+        """
+        送り済みの位置から後の差分を1つのファイルにして、位置を進める
+        Returns:
+            name : 作ったファイル名　差分がなければNone
+            full : 上限まで取れたテーブルがあり、まだ続きがあるかどうか
+        """
+        marks = self.db.get_sync_marks()
+        tables = {}
+        new_marks = {}
+        full = False                                        # どれかのテーブルが上限まで取れた（まだ続きがある）
+        for table in SYNC_TABLES:
+            after = int(marks.get(table, 0))
+            columns, rows, last = self.db.get_delta(table, after)
+            if rows:
+                tables[table] = {"columns": columns, "rows": rows}
+                new_marks[table] = last
+                full = full or len(rows) >= SYNC_BATCH
+        columns, rows, last = self.db.get_summary_changes(int(marks.get("summary_changes", 0)))
+        if rows:                                            # 書き換わった日のサマリー（過去の日も含む）
+            tables["summary"] = {"columns": columns, "rows": rows}
+            new_marks["summary_changes"] = last
+            full = full or len(rows) >= SYNC_BATCH
+        if not tables:
+            return None, False
+        name = self.outbox.put(encode({"site": self.site, "tables": tables}))
+        self.db.set_sync_marks(new_marks)                   # ファイルに残してから進める（途中で止まっても重複するだけ）
+        return name, full
+
+    def send(self, body):
+        """
+        1つのファイルを送る
+        Returns:
+            受け取られたかどうか（中央サーバーが内容を拒んだときはFalse）
+        Raises:
+            SyncError : つながらない・中央サーバー側の障害
+        """
+        req = urllib.request.Request(self.url, data=body, method="POST",
+                                     headers={"Content-Encoding": "gzip", "Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as res:
+                res.read()
+        except urllib.error.HTTPError as e:
+            if 400 <= e.code < 500:
+                return False
+            raise SyncError(str(e))
+        except (urllib.error.URLError, OSError) as e:
+            raise SyncError(str(e))
+        return True
+
+    def flush(self):
+        """
+        送信待ちのファイルを古い順に送り、受け取られたものを消す
+        Returns:
+            送ったファイル数
+        Raises:
+            SyncError : 送れなかった（残りは次回）
+        """
+        sent = 0
+        for name in self.outbox.list():
+            if self.send(self.outbox.read(name)):
+                self.outbox.remove(name)
+                sent += 1
+            else:                                           # 何度送っても同じなので、後で調べられるように脇へ置く
+                self.outbox.reject(name)
+        return sent
+
+    def sync(self):
+        """
+        差分をまとめてから送る　送信待ちが多すぎるときは差分をDBに残したままにする
+        """
+        with self.lock:
+            while len(self.outbox.list()) < self.max_queue:
+                name, full = self.collect()
+                if name is None or not full:
+                    break
+            sent = self.flush()
+            self.last_sync = time.time()
+            return sent
+
+    def run(self):
+        wait = self.interval
+        while not self.stop_event.wait(wait):
+            try:
+                self.sync()
+                self.failures = 0
+                wait = self.interval
+            except Exception as e:                          # 回線が戻る・DBのロックが外れるまで間隔を延ばしながら待つ
+                self.failures += 1                          # （SyncError以外で終わると、再起動まで送らなくなる）
+                self.last_error = str(e) if isinstance(e, SyncError) else f"{type(e).__name__}: {e}"
+                wait = min(MAX_BACKOFF, self.interval * 2 ** min(self.failures, 10))
+                print(f"中央サーバーへの送信に失敗しました（{wait:.0f}秒後に再送）: {self.last_error}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="sync", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def get_status(self):
+        return {"site": self.site,
+                "queued": len(self.outbox.list()),
+                "marks": self.db.get_sync_marks(),
+                "failures": self.failures,
+                "last_error": self.last_error,
+                "last_sync": self.last_sync,
+                }
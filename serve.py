@@ -0,0 +1,49 @@
+# 本番用の起動スクリプト
+# 開発用サーバー（app.pyを直接実行）ではなく、マルチスレッドのWSGIサーバーで動かす
+# 状態はプロセス内に持っているので、プロセスは1つ・スレッドを複数とする
+import sys
+import signal
+import argparse
+import myDatabase
+from app import app, start_adc
+
+
+def main():
+    parser = argparse.ArgumentParser(description="agri 本番サーバー")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--memory-db", action="store_true", help="DBをメモリに置き、定期的にagri.dbへ書き戻す")
+    parser.add_argument("--snapshot-interval", type=float, default=myDatabase.SNAPSHOT_INTERVAL,
+                        help="メモリのDBを書き戻す間隔（秒）")
+    parser.add_argument("--fleet", metavar="DIR", help="中央サーバーとして各ハウスからのアップロードをDIRに集める")
+    parser.add_argument("--sync-url", help="このハウスのデータを送る中央サーバーのURL")
+    parser.add_argument("--site", default="house", help="中央サーバーでのこのハウスの名前")
+    parser.add_argument("--sync-interval", type=float, default=300, help="中央サーバーへ送る間隔（秒）")
+    parser.add_argument("--adc", action="store_true", help="MCP3004でバッテリー電圧を読む")
+    parser.add_argument("--battery-channel", type=int, default=0, help="バッテリー電圧をつないだMCP3004のチャンネル")
+    parser.add_argument("--battery-scale", type=float, default=1.0, help="分圧の比（バッテリー電圧 = ADCの電圧 × この値）")
+    args = parser.parse_args()
+    myDatabase.configure(memory=args.memory_db, snapshot_interval=args.snapshot_interval)
+    if args.fleet:
+        from myFleet import FleetStore
+        FleetStore(args.fleet).init_app(app)
+    if args.adc:
+        start_adc(args.battery_channel, args.battery_scale)
+    if args.sync_url:
+        from mySync import Syncer
+        Syncer(myDatabase.get_db(), args.sync_url, args.site, interval=args.sync_interval).start()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))           # systemctl stopでも終了処理（DBの書き戻し）を行う
+
+    try:
+        from waitress import serve                                  # あればwaitressを使う
+    except ImportError:
+        print("waitressがないので、werkzeugのマルチスレッドサーバーで起動します")
+        from werkzeug.serving import run_simple
+        run_simple(args.host, args.port, app, threaded=True, use_reloader=False, use_debugger=False)
+    else:
+        serve(app, host=args.host, port=args.port, threads=args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# 起動時間のベンチマーク
+# モジュールごとに新しいPythonプロセスで読み込み、読み込み時間と常駐メモリ（RSS）の増加を表示する
+import sys
+import json
+import subprocess
+
+MODULES = ["flask", "numpy", "pandas", "cv2", "ephem", "myDatabase", "myEphem", "app"]
+
+PROBE = """
+import json, sys, time, resource, importlib
+
+def rss():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])                     # KB
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+before = rss()
+start = time.perf_counter()
+try:
+    importlib.import_module(sys.argv[1])
+    error = ""
+except Exception as e:
+    error = f"{type(e).__name__}: {e}"
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "rss_kb": rss() - before, "error": error}))
+"""
+
+
+def measure(module):
+    out = subprocess.run([sys.executable, "-c", PROBE, module], capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    print(f"{'モジュール':<12}{'読み込み時間':>12}{'RSS増加':>12}")
+    for module in MODULES:
+        result = measure(module)
+        if result["error"]:
+            print(f"{module:<12}{'-':>12}{'-':>12}  {result['error']}")
+        else:
+            print(f"{module:<12}{result['seconds']*1000:>10.0f}ms{result['rss_kb']/1024:>10.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -40,6 +40,8 @@ let mode = true                     // モード（自動／強制オン／強
 let lastmode = false                // 1秒前のモード　モードが変わったらログを残す
 
 let senging_time = "00:00";         // 次に光センサーの状態を取得する時刻
+let contec_time = dayjs();          // 次にコンテックを取得する時刻　間隔はサーバーが値の変わり方から決める
+let humi_time = dayjs();            // 次に温湿度を取得する時刻　同上
 const sensing_threshold = 0.5;      // ★ LEDを付けるか消すかのしきい値（5個×回数 に対する割合）
 let lightOnTime;                    // 育成LED点灯時刻　引き算をするのでdayjs形式
 
@@ -248,16 +250,40 @@ async function do1st() {
     addMsg(time+"　開始")
     showReadyLamp(isReady);     // Ready（運転準備）ランプ
     showRunLamp(isRun);         // 起動ランプ
-    await getEphem();           // 暦を取得する
-    await getConfig();          // 設定を取得する
-    calcTime();                 // 時間を計算する
-    clearLightMsg();
-    showDailyLog();
-    await getHumi(isHumiTry);
-    await getContec(isContecTry, isLightCnt);
+    if (! await bootstrap()) {  // 初期表示に必要なものを1回の通信でまとめて取得する
+        await getEphem();       // 失敗したら1つずつ取得する
+        await getConfig();
+        calcTime();
+        clearLightMsg();
+        showDailyLog();
+        await getHumi(isHumiTry);
+        await getContec(isContecTry, isLightCnt);
+    }
     showLights(lights);
 }
 
+// 暦・設定・デイリーログ・温湿度・コンテックをまとめて取得する　成功したらtrueを返す
+async function bootstrap() {
+    let isDone = false;
+    $("#date").text(dayjs().format("M月D日"))               // 日付
+    await $.ajax("/bootstrap", {
+        type: "POST",
+    }).done(function(data) {
+        const dict = toDict(data);
+        applyEphem(dict["ephem"]);                          // 暦
+        applyConfig(dict["config"]);                        // 設定
+        calcTime();                                         // 時間を計算する
+        clearLightMsg();
+        applyDailyLog(dict["dailylog"]);                    // デイリーログ
+        applyHumi(dict["humi"]);                            // 温湿度
+        applyContec(dict["contec"], isLightCnt);            // コンテック
+        isDone = true;
+    }).fail(function() {
+        console.log("初期データ取得失敗");
+    });
+    return isDone;
+}
+
 //////////////////////////////////////////////////////////////////////
 // 表示しているタブを取得する
 function getTab() {
@@ -299,13 +325,15 @@ async function showTime() {
     } else {                                                            // センサーを取得する時刻になっていなかったら
         isLightCnt = false;                                             // 積算しない
     };
-    getContec(isContecTry, isLightCnt);                                 // 以上の条件でコンテック取得する
-
 
-    // 一定時間で温湿度を更新する
-    if ((m % 30)==0 && s==0) {                                          // 毎時0分・30分に
-        getHumi(isHumiTry);                                             // 温湿度取得
-    }
+    // コンテックと温湿度は、サーバーが決めた時刻になったら取得する（光センサーを積算するときは必ず取得する）
+    const isHumi = !now.isBefore(humi_time);                            // 温湿度を取得する時刻になったか
+    if (isLightCnt || isHumi || !now.isBefore(contec_time)) {
+        if (isHumi) {
+            humi_time = now.add(1, "minutes");                          // 応答までに同じ読み取りを重ねないように仮の時刻にしておく
+        };
+        tick(isLightCnt, isHumi);                                       // 以上の条件でコンテック（と温湿度）を1回の通信で取得する
+    };
     
 
     // 起動中のみ時刻する機能
@@ -322,6 +350,30 @@ async function showTime() {
 }
 
 
+// 定期的な更新　コンテックと、必要ならば温湿度をまとめて取得する
+async function tick(isLightCnt, isHumi) {
+    await $.ajax("/tick", {
+        type: "post",
+        data: {"isContecTry": isContecTry,
+               "isLightCnt": isLightCnt,
+               "isHumiTry": isHumiTry,
+               "isHumi": isHumi},
+    }).done(function(data) {
+        const dict = toDict(data);
+        applyContec(dict["contec"], isLightCnt);
+        if ("humi" in dict) {
+            applyHumi(dict["humi"]);
+        };
+        contec_time = dayjs().add(dict["next"]["contec"], "seconds");  // 次に取得する時刻
+        if ("humi" in dict["next"]) {
+            humi_time = dayjs().add(dict["next"]["humi"], "seconds");
+        };
+    }).fail(function() {
+        console.log("定期的な更新　通信失敗");
+    });
+}
+
+
 //////////////////////////////////////////////////////////////////////
 // トライの状態を表示する関数
 function showTryBtn(btnid, bool) {
@@ -398,18 +450,18 @@ async function writeLog(text, filename) {
 
 // デイリーログ
 async function showDailyLog() {
-    await $.ajax("/showDailyLog", {
-        type: "POST",
-        data: {},
-    }).done(function(data) {
-        const dict = JSON.parse(data);
-        $("#dailylog").html(dict["html"]);
-        $("#dailylog_main").html(dict["html"]);
+    await postCached("/showDailyLog", {}).done(function(dict) {
+        applyDailyLog(dict);
     }).fail(function() {
         console.log("デイリーログ取得失敗");
     });
 };
 
+function applyDailyLog(dict) {
+    $("#dailylog").html(dict["html"]);
+    $("#dailylog_main").html(dict["html"]);
+};
+
 //////////////////////////////////////////////////////////////////////
 //    温湿度
 //////////////////////////////////////////////////////////////////////
@@ -418,112 +470,123 @@ async function getHumi(isTry) {
         type: "post",
         data: {"isTry": isTry},                 // テストか本番かのbool値をisTryとして送る
     }).done(function(data) {
-        const dict = JSON.parse(data);
-        if (dict["temp"] != "N/A") {            // センサー値取得できていたら
-            temp = dict["temp"];
-            humi = dict["humi"];
-            $("#temp").text(temp + "℃");
-            $("#humi").text(humi + "％");   
-            addMsg(time + "　温湿度更新");
-        } else {                                // センサー値取得できなかったら
-            console.log("温湿度　センサー失敗");
-        }
+        applyHumi(toDict(data));
     }).fail(function() {                        // ajaxのリターン失敗したら更新しない
         console.log("温湿度　通信失敗");
     });
 }
 
+function applyHumi(dict) {
+    if (dict["temp"] != "N/A" && !("error" in dict)) {  // センサー値取得できていたら
+        temp = dict["temp"];
+        humi = dict["humi"];
+        $("#temp").text(temp + "℃");
+        $("#humi").text(humi + "％");   
+        addMsg(time + "　温湿度更新");
+    } else {                                // センサー値取得できなかったら
+        console.log("温湿度　センサー失敗");
+    }
+}
+
 
 
 //////////////////////////////////////////////////////////////////////
 //    コンテック
 //////////////////////////////////////////////////////////////////////
 async function getContec(isTry, isLightCnt) {
-    let msg = "";
     await $.ajax("/getContec", {
         type: "post",
         data: {"isTry": isTry,                                          // テストか本番かのbool値をisTryとして、
                "isLightCnt": isLightCnt},                               // 光センサーを取得するだけか積算するかをisLightCntとして送る
     }).done(function(data) {
-        const dict = JSON.parse(data);
-        try {                                                           // センサー値取得できていたら
-            // 電圧リレーの状態
-            const volt_status = dict["volt"];                           // コンテックの電圧
-            if (volt_status == "青" ) {                                  // 「青」ならば
-                $(".batt_blue").css("visibility","visible");            // グラフの青バーを表示
-                $(".batt_green").css("visibility","visible");           // グラフの緑バーを表示
-            } else if (volt_status == "緑") {                            // 「緑」ならば
-                $(".batt_blue").css("visibility","hidden");             // グラフの青バーを非表示
-                $(".batt_green").css("visibility","visible");           // グラフの緑バーを表示
-            } else {                                                    // いずれでもなければ
-                $(".batt_blue").css("visibility","hidden");             // グラフの青バーを非表示
-                $(".batt_green").css("visibility","hidden");            // グラフの緑バーを非表示
-            };                                                          // つまり、グラフの黄色バーは消えない（0の判定はない）
-
-            // 光センサーの状態
-            showLights(dict["log"]);                                    // 制御盤のランプを点灯させる
-            if (isLightCnt) {                                           // 光センサー積算する設定ならば
-                if (dict["light_cnt"]==0) {                             // 0回目で
-                    clearLightMsg();                                    // メッセージをクリアする
-                }
-                const lightlog = dict["log"].slice(0,5);                // コンテックの光センサー＋バッテリーから光センサーを切り出す
-                msg = time + "　#" + (dict["light_cnt"]+1) + "　" + lightlog;
-                addLightLog(msg);
+        applyContec(toDict(data), isLightCnt);
+    }).fail(function() {                        // ajaxのリターン失敗したら
+        console.log("コンテック　通信失敗");
+    });
+};
 
-                const th = 5*sensing_count*sensing_threshold;
-                if (dict["light_cnt"] == sensing_count-1) {                     // 指定した回数だけセンサー値を測定したら
-                    addLightLog("曇りのカウント" + dict["light_sum"] + "　　しきい値" + th);
-                    if (dict["light_sum"] < th) {                               // 点灯消灯判断　しきい値未満ならば
+// コンテックの結果を画面に表示し、育成LEDの点灯消灯を判断する
+function applyContec(dict, isLightCnt) {
+    let msg = "";
+    if ("error" in dict) {                                              // ハードウェアが応答しなかったら今回は更新しない
+        console.log("コンテック　" + dict["error"]);
+        return;
+    };
+    try {                                                           // センサー値取得できていたら
+        // 電圧リレーの状態
+        const volt_status = dict["volt"];                           // コンテックの電圧
+        if (volt_status == "青" ) {                                  // 「青」ならば
+            $(".batt_blue").css("visibility","visible");            // グラフの青バーを表示
+            $(".batt_green").css("visibility","visible");           // グラフの緑バーを表示
+        } else if (volt_status == "緑") {                            // 「緑」ならば
+            $(".batt_blue").css("visibility","hidden");             // グラフの青バーを非表示
+            $(".batt_green").css("visibility","visible");           // グラフの緑バーを表示
+        } else {                                                    // いずれでもなければ
+            $(".batt_blue").css("visibility","hidden");             // グラフの青バーを非表示
+            $(".batt_green").css("visibility","hidden");            // グラフの緑バーを非表示
+        };                                                          // つまり、グラフの黄色バーは消えない（0の判定はない）
+
+        // 光センサーの状態
+        showLights(dict["log"]);                                    // 制御盤のランプを点灯させる
+        if (isLightCnt) {                                           // 光センサー積算する設定ならば
+            if (dict["light_cnt"]==0) {                             // 0回目で
+                clearLightMsg();                                    // メッセージをクリアする
+            }
+            const lightlog = dict["log"].slice(0,5);                // コンテックの光センサー＋バッテリーから光センサーを切り出す
+            msg = time + "　#" + (dict["light_cnt"]+1) + "　" + lightlog;
+            addLightLog(msg);
+
+            const th = 5*sensing_count*sensing_threshold;
+            if (dict["light_cnt"] == sensing_count-1) {                     // 指定した回数だけセンサー値を測定したら
+                addLightLog("曇りのカウント" + dict["light_sum"] + "　　しきい値" + th);
+                if (dict["light_sum"] < th) {                               // 点灯消灯判断　しきい値未満ならば
+                    isLED = false;                                          // 消灯にする
+                    if (lastIsLED) {                                        // さっきまで点灯していたら
+                        msg = "十分明るいので消灯します";
+                        const lightSeconds = dayjs().diff(lightOnTime, "seconds") + 5;  // lightOnTimeから今までの時間（秒） 念のため5秒プラスしておく
+                        const lightMinutes = Math.trunc(lightSeconds/60);               // 秒を分にする
+                        msg += "　点灯時間 " + lightMinutes + "分";
+                        addMsg(time + "　" + msg);
+                        writeDB("LED", lightMinutes);
+                    } else {                                                // さっきまでも消灯していたら
+                        msg = "消灯を継続します";
+                        addMsg(time + "　" + msg);
+                    };
+                } else {                                                    // しきい値以上ならば
+                    if (volt_status == "青" || volt_status == "緑") {             // コンテックの電圧が青か緑ならば
+                        isLED = true;                                           // 点灯にする
+                        if (lastIsLED) {                                        // さっきまでも点灯していたら
+                            msg = "点灯を継続します";
+                            addMsg(time + "　" + msg);
+                        } else {                                                // さっきまで消灯していたら
+                            msg = "暗いので点灯します";
+                            lightOnTime = dayjs();
+                            addMsg(time + "　" + msg);
+                        };
+                    } else {                                                    // 電圧が黄色ならば
                         isLED = false;                                          // 消灯にする
                         if (lastIsLED) {                                        // さっきまで点灯していたら
-                            msg = "十分明るいので消灯します";
-                            const lightSeconds = dayjs().diff(lightOnTime, "seconds") + 5;  // lightOnTimeから今までの時間（秒） 念のため5秒プラスしておく
-                            const lightMinutes = Math.trunc(lightSeconds/60);               // 秒を分にする
-                            msg += "　点灯時間 " + lightMinutes + "分";
-                            addMsg(time + "　" + msg);
+                            msg = "バッテリーが不足気味なので消灯します"
                             writeDB("LED", lightMinutes);
+                            const lightSeconds = dayjs().diff(lightOnTime, "seconds") + 2;  // lightOnTimeから今までの時間（秒） 念のため2秒プラスしておく
+                            const lightMinutes = Math.trunc(lightSeconds/60);               // 秒を分にする
+                                msg += "　点灯時間 " + lightMinutes + "分";
+                                addMsg(time + "　" + msg);
                         } else {                                                // さっきまでも消灯していたら
-                            msg = "消灯を継続します";
+                            msg = "バッテリーが不足気味で消灯を継続します"
                             addMsg(time + "　" + msg);
                         };
-                    } else {                                                    // しきい値以上ならば
-                        if (volt_status == "青" || volt_status == "緑") {             // コンテックの電圧が青か緑ならば
-                            isLED = true;                                           // 点灯にする
-                            if (lastIsLED) {                                        // さっきまでも点灯していたら
-                                msg = "点灯を継続します";
-                                addMsg(time + "　" + msg);
-                            } else {                                                // さっきまで消灯していたら
-                                msg = "暗いので点灯します";
-                                lightOnTime = dayjs();
-                                addMsg(time + "　" + msg);
-                            };
-                        } else {                                                    // 電圧が黄色ならば
-                            isLED = false;                                          // 消灯にする
-                            if (lastIsLED) {                                        // さっきまで点灯していたら
-                                msg = "バッテリーが不足気味なので消灯します"
-                                writeDB("LED", lightMinutes);
-                                const lightSeconds = dayjs().diff(lightOnTime, "seconds") + 2;  // lightOnTimeから今までの時間（秒） 念のため2秒プラスしておく
-                                const lightMinutes = Math.trunc(lightSeconds/60);               // 秒を分にする
-                                    msg += "　点灯時間 " + lightMinutes + "分";
-                                    addMsg(time + "　" + msg);
-                            } else {                                                // さっきまでも消灯していたら
-                                msg = "バッテリーが不足気味で消灯を継続します"
-                                addMsg(time + "　" + msg);
-                            };
-                        };
                     };
-                    addLightLog(msg);
-                    lastIsLED = isLED;
-                    enpowerLED(isLED);
                 };
+                addLightLog(msg);
+                lastIsLED = isLED;
+                enpowerLED(isLED);
             };
-        } catch(e) {                            // センサー値取得できなかったら
-            console.log("コンテック　データ失敗");
-            console.log(e);
         };
-    }).fail(function() {                        // ajaxのリターン失敗したら
-        console.log("コンテック　通信失敗");
-    });
+    } catch(e) {                            // センサー値取得できなかったら
+        console.log("コンテック　データ失敗");
+        console.log(e);
+    };
 };
 
 // 光センサーの状態を表示する関数
@@ -605,23 +668,24 @@ function showLedLamp(flag) {
 //////////////////////////////////////////////////////////////////////
 async function getEphem() {
     $("#date").text(dayjs().format("M月D日"))               // 日付
-    await $.ajax("/getEphem", {
-        type: "POST",
-    }).done(function(data) {
-        const dict = JSON.parse(data);
-        sunrise_time = dict["sunrise_time"];                // 日の出時刻　HH:MM形式
-        sunset_time = dict["sunset_time"];                  // 日没時刻　HH:MM形式
-        $("#sunrise").text(sunrise_time);                   // 日の出時刻
-        $("#sunset").text(sunset_time);                     // 日没時刻
-        $("#moon_phase").text(dict["moon_phase"]);          // 月相
-        $("#moon_image").attr("src", dict["moon_image"]);   // 月の画像
-
-        console.log("暦取得成功");
+    await postCached("/getEphem", {}).done(function(dict) {
+        applyEphem(dict);
     }).fail(function() {
         console.log("暦取得失敗");
     });
 };
 
+function applyEphem(dict) {
+    sunrise_time = dict["sunrise_time"];                    // 日の出時刻　HH:MM形式
+    sunset_time = dict["sunset_time"];                      // 日没時刻　HH:MM形式
+    $("#sunrise").text(sunrise_time);                       // 日の出時刻
+    $("#sunset").text(sunset_time);                         // 日没時刻
+    $("#moon_phase").text(dict["moon_phase"]);              // 月相
+    $("#moon_image").attr("src", dict["moon_image"]);       // 月の画像
+
+    console.log("暦取得成功");
+};
+
 function calcTime() {
     // 点灯時間を計算する　暦と設定の取得が先
 
@@ -716,7 +780,7 @@ async function writeDB(table, values) {
         data: { "table": table,
                 "values": values}
     }).done(function(data) {
-        const dict = JSON.parse(data);    
+        const dict = toDict(data);    
     }).fail(function() {
         console.log("データベース書き込み失敗");
     });
@@ -725,73 +789,74 @@ async function writeDB(table, values) {
 
 // 設定を取得する関数
 async function getConfig() {
-    await $.ajax("/getConfig", {
-        type: "POST",
-    }).done(function(data) {
-        const dict = JSON.parse(data);
-        // 暦　変数にはせず、ブラウザ上に出力するのみ
-        $("#place").val(dict["place"]);                         // 場所
-        $("#lat").val(dict["lat"]);                             // 経度
-        $("#lon").val(dict["lon"]);                             // 緯度
-        $("#elev").val(dict["elev"]);                           // 標高
-
-        // 朝と夕方の強制点灯の設定
-        morning_offset = Number(dict["morning_offset"]);        // 日の出の何分後に始まる
-        evening_offset = Number(dict["evening_offset"]);        // 日の入りの何分前に終わる
-        morning_minutes = Number(dict["morning_minutes"]);      // 朝の強制点灯時間
-        evening_minutes = Number(dict["evening_minutes"]);      // 夕方の強制点灯時間
-        $("#morning_offset").val(morning_offset);
-        $("#evening_offset").val(evening_offset);
-        $("#morning_minutes").val(morning_minutes);
-        $("#evening_minutes").val(evening_minutes);
-        
-        // 光センサー取得設定
-        sensing_interval = Number(dict["sensing_interval"]);    // 光センサー取得間隔
-        sensing_count = Number(dict["sensing_count"]);          // 光センサー取得回数
-        $("#sensing_interval").val(sensing_interval);
-        $("#sensing_count").val(sensing_count);
-
-        // コンテックのボード出力設定
-        for (i=1; i<=4; i++) {
-            outputRelays[i] = str2Bool(dict["output" + i]);     // 文字列の0/1を真偽値にする
-            showOutputLamp("#output" + i, outputRelays[i]);     // 状態を画面に表示する
-        }
-
-        // バッテリー設定
-        batt_yellow = dict["batt_yellow"];
-        batt_green = dict["batt_green"];
-        $(".batt_yellow").css("width", batt_yellow+"%");
-        $(".batt_green").css("width", (batt_green-batt_yellow)+"%");
-        $(".batt_blue").css("width", (100-batt_green)+"%");
-        $("#batt_yellow").val(batt_yellow);
-        $("#batt_green").val(batt_green);
-
-        // トライボタン
-        isHumiTry = str2Bool(dict["isHumiTry"]);
-        isContecTry = str2Bool(dict["isContecTry"]);
-        isLEDTry = str2Bool(dict["isLEDTry"]);
-        isNightSense = str2Bool(dict["isNightSense"]);
-        showTryBtn("#HumiTry", isHumiTry);
-        showTryBtn("#ContecTry", isContecTry);
-        showTryBtn("#LEDTry", isLEDTry);
-        showTryBtn("#NightSense", isNightSense);
-
-        sunlight_from = dict["sunlight_from"];                          // 育成LED点灯時間の累計の始点
-        temperature_from = dict["temperature_from"];                    // 温度の累計の始点
-        const js_from = dayjs(sunlight_from);
-        const cumsum_year = js_from.year();
-        const cumsum_month = js_from.month()+1;                         // 月は0～11で返されるので+1する
-        const cumsum_day = js_from.date();
-        $("#cumsum_year").val(cumsum_year);
-        $("#cumsum_month").val(cumsum_month);
-        $("#cumsum_day").val(cumsum_day);
-        senging_time = dayjs().add(1, "minutes").format("HH:mm:30");    // 次に光センサーを取得する時刻
-        console.log("設定ファイル取得成功");
+    await postCached("/getConfig", {}).done(function(dict) {
+        applyConfig(dict);
     }).fail(function() {
         console.log("設定ファイル取得失敗");
     });
 };
 
+function applyConfig(dict) {
+    // 暦　変数にはせず、ブラウザ上に出力するのみ
+    $("#place").val(dict["place"]);                         // 場所
+    $("#lat").val(dict["lat"]);                             // 経度
+    $("#lon").val(dict["lon"]);                             // 緯度
+    $("#elev").val(dict["elev"]);                           // 標高
+
+    // 朝と夕方の強制点灯の設定
+    morning_offset = Number(dict["morning_offset"]);        // 日の出の何分後に始まる
+    evening_offset = Number(dict["evening_offset"]);        // 日の入りの何分前に終わる
+    morning_minutes = Number(dict["morning_minutes"]);      // 朝の強制点灯時間
+    evening_minutes = Number(dict["evening_minutes"]);      // 夕方の強制点灯時間
+    $("#morning_offset").val(morning_offset);
+    $("#evening_offset").val(evening_offset);
+    $("#morning_minutes").val(morning_minutes);
+    $("#evening_minutes").val(evening_minutes);
+    
+    // 光センサー取得設定
+    sensing_interval = Number(dict["sensing_interval"]);    // 光センサー取得間隔
+    sensing_count = Number(dict["sensing_count"]);          // 光センサー取得回数
+    $("#sensing_interval").val(sensing_interval);
+    $("#sensing_count").val(sensing_count);
+
+    // コンテックのボード出力設定
+    for (i=1; i<=4; i++) {
+        outputRelays[i] = str2Bool(dict["output" + i]);     // 文字列の0/1を真偽値にする
+        showOutputLamp("#output" + i, outputRelays[i]);     // 状態を画面に表示する
+    }
+
+    // バッテリー設定
+    batt_yellow = dict["batt_yellow"];
+    batt_green = dict["batt_green"];
+    $(".batt_yellow").css("width", batt_yellow+"%");
+    $(".batt_green").css("width", (batt_green-batt_yellow)+"%");
+    $(".batt_blue").css("width", (100-batt_green)+"%");
+    $("#batt_yellow").val(batt_yellow);
+    $("#batt_green").val(batt_green);
+
+    // トライボタン
+    isHumiTry = str2Bool(dict["isHumiTry"]);
+    isContecTry = str2Bool(dict["isContecTry"]);
+    isLEDTry = str2Bool(dict["isLEDTry"]);
+    isNightSense = str2Bool(dict["isNightSense"]);
+    showTryBtn("#HumiTry", isHumiTry);
+    showTryBtn("#ContecTry", isContecTry);
+    showTryBtn("#LEDTry", isLEDTry);
+    showTryBtn("#NightSense", isNightSense);
+
+    sunlight_from = dict["sunlight_from"];                          // 育成LED点灯時間の累計の始点
+    temperature_from = dict["temperature_from"];                    // 温度の累計の始点
+    const js_from = dayjs(sunlight_from);
+    const cumsum_year = js_from.year();
+    const cumsum_month = js_from.month()+1;                         // 月は0～11で返されるので+1する
+    const cumsum_day = js_from.date();
+    $("#cumsum_year").val(cumsum_year);
+    $("#cumsum_month").val(cumsum_month);
+    $("#cumsum_day").val(cumsum_day);
+    senging_time = dayjs().add(1, "minutes").format("HH:mm:30");        // 次に光センサーを取得する時刻
+    console.log("設定ファイル取得成功");
+};
+
 // 設定を変更する関数
 async function setConfig() {
     let dict = {};                                                              // 空の辞書
@@ -934,6 +999,58 @@ function closePopupWindow() {
     $("#del_result").text("");
 }
 
+// 応答を辞書にする関数　JSONの応答はjQueryが変換済みなのでそのまま返す
+function toDict(data) {
+    if (typeof data == "string") {
+        return JSON.parse(data);
+    }
+    return data;
+}
+
+// ETagで条件付きにしたPOST　変わっていなければサーバーは304だけを返すので、前回の辞書を使う
+var etagCache = {};                         // URLと引数ごとの{etag, dict}
+function postCached(url, data) {
+    var key = url + "?" + $.param(data);
+    var entry = etagCache[key];
+    return $.ajax(url, {
+        type: "POST",
+        data: data,
+        headers: entry ? {"If-None-Match": entry.etag} : {},
+    }).then(function(data, status, xhr) {
+        if (xhr.status == 304 && entry) {
+            return entry.dict;
+        }
+        var dict = toDict(data);
+        var etag = xhr.getResponseHeader("ETag");
+        if (etag && !("error" in dict)) {
+            etagCache[key] = {"etag": etag, "dict": dict};
+        }
+        return dict;
+    });
+}
+
+// グラフ用の履歴を取得する関数　isBinaryならばfloat32の配列で受け取る
+// 戻り値は{"start": 最初の日時, "t": startからの秒数の配列, 列名: 値の配列, ...}
+async function getHistory(table, from, to, points, isBinary, step) {
+    var params = {"table": table, "from": from, "to": to, "points": points};
+    if (step) {                                 // 間引いて保存した温湿度を、step秒ごとの等間隔に戻す
+        params["step"] = step;
+    }
+    if (!isBinary) {
+        return toDict(await $.post("/history", params));
+    }
+    params["format"] = "f32";
+    var response = await fetch("/history?" + $.param(params));
+    var buffer = await response.arrayBuffer();
+    var columns = response.headers.get("X-History-Columns").split(",");
+    var n = Number(response.headers.get("X-History-Count"));
+    var dict = {"start": response.headers.get("X-History-Start"), "t": new Float32Array(buffer, 0, n)};
+    columns.forEach(function(column, i) {
+        dict[column] = new Float32Array(buffer, (i + 1) * n * 4, n);
+    });
+    return dict;
+}
+
 // 文字列のtrue/falseを真偽値に変換する関数
 function str2Bool(str){
     if (typeof str != "string") { 
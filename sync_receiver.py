@@ -0,0 +1,36 @@
+# 中央サーバーの代わりに差分を受け取るだけのサーバー（回線なしで同期を確かめるため）
+#   python sync_receiver.py --port 5050 --fail-rate 0.3
+#   python serve.py --sync-url http://127.0.0.1:5050 --site house1 --sync-interval 10
+# --fail-rateの割合でわざと503を返し、回線が不安定なときの再送を確かめられる
+import random
+import argparse
+from flask import Flask, request
+from myFleet import FleetStore
+
+
+def create_app(directory, fail_rate=0.0):
+    app = Flask("sync_receiver")
+    store = FleetStore(directory)
+
+    @app.before_request
+    def flaky():
+        if request.path == "/fleet/ingest" and random.random() < fail_rate:
+            return "わざと失敗しました", 503
+
+    store.init_app(app)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同期の受け取り役")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--directory", default="fleet_receiver", help="受け取ったデータの保存先")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="わざと失敗する割合")
+    args = parser.parse_args()
+    app = create_app(args.directory, args.fail_rate)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()